@@ -1,4 +1,4 @@
-import numpy, os, sys
+import numpy, os, sys, collections
 import FreeCAD
 import FreeCADGui
 import Part
@@ -32,10 +32,69 @@ def make_string(input):
         else:
             return input
 
-def debugPrint( level, msg ):
-    if level <= debugPrint.level:
-        FreeCAD.Console.PrintMessage(msg + '\n')
-debugPrint.level = 4 if hasattr(os,'uname') and os.uname()[1].startswith('antoine') else 2
+class DebugPrint(object):
+    '''
+    debugPrint( level, msg, *args ) prints msg % args if level <= debugPrint.level.
+    The message is only formatted if printed (or traced), so pass the format arguments rather than a formatted string.
+    msg can also be a function returning the message, for messages expensive to construct.
+
+    In hot code, guard the call so that nothing is evaluated when debug output is off
+      if debugPrint.guard >= 4: debugPrint( 4, 'x %s', x )
+    debugPrint.guard is the highest level which is printed or traced.
+
+    Tracing keeps the last debug messages (up to traceLevel, including those not printed) in a ring buffer,
+    which the solvers dump on failure. Traced messages are formatted when traced, as the arguments (lists, systems, arrays)
+    may be changed before the trace is dumped. So with tracing on, every traced message is formatted.
+      debugPrint.enableTrace( level=4, size=1000 )
+    '''
+    def __init__( self, level ):
+        self.trace = None
+        self.traceLevel = -1
+        self.level = level
+
+    @property
+    def level( self ):
+        return self._level
+    @level.setter
+    def level( self, value ):
+        self._level = value
+        self.guard = max( value, self.traceLevel )
+
+    def __call__( self, level, msg, *args ):
+        if level > self.guard:
+            return
+        text = formatDebugMessage( msg, args )
+        if level <= self._level:
+            FreeCAD.Console.PrintMessage( text + '\n' )
+        if level <= self.traceLevel:
+            self.trace.append( ( level, text ) )
+
+    def enableTrace( self, level=4, size=1000 ):
+        self.trace = collections.deque( maxlen=size )
+        self.traceLevel = level
+        self.guard = max( self._level, level )
+
+    def disableTrace( self ):
+        self.trace = None
+        self.traceLevel = -1
+        self.guard = self._level
+
+    def traceMessages( self ):
+        return [ text for level, text in self.trace ] if self.trace is not None else []
+
+    def dumpTrace( self, header='debug trace' ):
+        'prints the traced messages, and clears the trace'
+        if self.trace is None or len(self.trace) == 0:
+            return
+        FreeCAD.Console.PrintMessage( '%s (last %i messages):\n%s\n' % ( header, len(self.trace), '\n'.join( self.traceMessages() ) ) )
+        self.trace.clear()
+
+def formatDebugMessage( msg, args ):
+    if callable( msg ):
+        msg = msg()
+    return msg % args if len(args) > 0 else msg
+
+debugPrint = DebugPrint( 4 if hasattr(os,'uname') and os.uname()[1].startswith('antoine') else 2 )
 #debugPrint.level = 4 #maui to debug
 
 def formatDictionary( d, indent):
@@ -126,6 +126,19 @@ def euler_ZYX_rotation_matrix( angle1, angle2, angle3 ):
         [ - s_2   , c_2*s_3 , c_2*c_3 ]
     ])
     
+def euler_ZYX_rotation_matrix_derivatives( angle1, angle2, angle3 ):
+    'derivatives of euler_ZYX_rotation_matrix with respect to angle1, angle2 and angle3, using R = R_z(angle1) * R_y(angle2) * R_x(angle3)'
+    c_1, s_1 = cos(angle1), sin(angle1)
+    c_2, s_2 = cos(angle2), sin(angle2)
+    c_3, s_3 = cos(angle3), sin(angle3)
+    R_z  = numpy.array([ [ c_1, -s_1, 0 ], [ s_1, c_1, 0 ], [ 0, 0, 1 ] ])
+    dR_z = numpy.array([ [ -s_1, -c_1, 0 ], [ c_1, -s_1, 0 ], [ 0, 0, 0 ] ])
+    R_y  = numpy.array([ [ c_2, 0, s_2 ], [ 0, 1, 0 ], [ -s_2, 0, c_2 ] ])
+    dR_y = numpy.array([ [ -s_2, 0, c_2 ], [ 0, 0, 0 ], [ -c_2, 0, -s_2 ] ])
+    R_x  = numpy.array([ [ 1, 0, 0 ], [ 0, c_3, -s_3 ], [ 0, s_3, c_3 ] ])
+    dR_x = numpy.array([ [ 0, 0, 0 ], [ 0, -s_3, -c_3 ], [ 0, c_3, -s_3 ] ])
+    return dotProduct( dR_z, dotProduct( R_y, R_x ) ), dotProduct( R_z, dotProduct( dR_y, R_x ) ), dotProduct( R_z, dotProduct( R_y, dR_x ) )
+
 def euler_ZYX_rotation(p, angle1, angle2, angle3 ):
     return dotProduct(euler_ZYX_rotation_matrix( angle1, angle2, angle3 ), p)
 
@@ -147,6 +160,97 @@ def azimuth_elevation_rotation_matrix(azi, ela, theta ):
 def azimuth_elevation_rotation( p, azi, ela, theta ):
     return dotProduct(azimuth_elevation_rotation_matrix( azi, ela, theta ), p)
 
+def azimuth_elevation_angular_velocities( azi, ela, theta ):
+    '''
+    returns the angular velocity vectors w_azi, w_ela, w_theta (global co-ordinates) resulting from unit changes in azi, ela and theta,
+    so that d/d(azi) azimuth_elevation_rotation_matrix( azi, ela, theta ) = crossProduct( w_azi, R ) and so on.
+    w = theta_dot*u + sin(theta)*u_dot + (1 - cos(theta))*crossProduct(u, u_dot), where u is the rotation axis
+    '''
+    u = azimuth_and_elevation_angles_to_axis( azi, ela )
+    du_dazi = numpy.array([ -cos(ela)*sin(azi), cos(ela)*cos(azi), 0 ])
+    du_dela = numpy.array([ -sin(ela)*cos(azi), -sin(ela)*sin(azi), cos(ela) ])
+    w_azi = sin(theta)*du_dazi + (1 - cos(theta))*crossProduct( u, du_dazi )
+    w_ela = sin(theta)*du_dela + (1 - cos(theta))*crossProduct( u, du_dela )
+    return w_azi, w_ela, u
+
+def rotation_vector_to_quaternion( r ):
+    'returns the quaternion (wikipedia order, i.e. cos(theta/2) element first) for the rotation vector r = axis*angle'
+    theta = norm(r)
+    if theta == 0:
+        return numpy.array([ 1.0, 0, 0, 0 ])
+    return numpy.array( quaternion2( theta, *(r/theta) ) )
+
+def quaternion_to_rotation_vector( q ):
+    'inverse of rotation_vector_to_quaternion, returns the rotation vector with an angle in [0, pi]'
+    q = numpy.array(q) if q[0] >= 0 else -numpy.array(q)
+    s = norm( q[1:] )
+    if s == 0:
+        return numpy.zeros(3)
+    return 2*arctan2( s, q[0] ) * q[1:] / s
+
+def quaternion_conjugate( q ):
+    return numpy.array([ q[0], -q[1], -q[2], -q[3] ])
+
+def rotation_vector_angular_velocities( r ):
+    '''
+    returns the angular velocity vectors (global co-ordinates) resulting from unit changes in r[0], r[1] and r[2], where r is a rotation vector;
+    i.e. the columns of the left Jacobian of SO(3): J = I + (1-cos(theta))/theta**2 * K + (theta - sin(theta))/theta**3 * K**2, where K = skew(r)
+    '''
+    theta = norm(r)
+    K = numpy.array([ [ 0, -r[2], r[1] ], [ r[2], 0, -r[0] ], [ -r[1], r[0], 0 ] ])
+    if theta < 10**-6:
+        J = numpy.eye(3) + 0.5*K + dotProduct(K,K)/6
+    else:
+        J = numpy.eye(3) + (1 - cos(theta))/theta**2 * K + (theta - sin(theta))/theta**3 * dotProduct(K,K)
+    return J[:,0], J[:,1], J[:,2]
+
+#
+# batched versions of the above, for transforming many rotations at once.
+# angles and axis components are (N,) arrays and quaternions (N,4) arrays, with (N,3) vectors or (N,3,3) matrices returned.
+#
+
+def _broadcast_1d( *args ):
+    return numpy.broadcast_arrays( *[ numpy.atleast_1d( numpy.asarray( a, dtype=float ) ) for a in args ] )
+
+def arccos2_batch( v, allowableNumericalError=10**-1 ):
+    v = numpy.asarray( v, dtype=float )
+    if not numpy.all( abs(v) - 1 < allowableNumericalError ):
+        raise ValueError("arccos2_batch called with invalid input of %s" % v)
+    return arccos( numpy.clip( v, -1, 1 ) )
+
+def quaternion_batch( theta, u_x, u_y, u_z ):
+    'FreeCAD ordered quaternions, see quaternion'
+    return numpy.array( quaternion( *_broadcast_1d( theta, u_x, u_y, u_z ) ) ).T
+
+def quaternion_to_axis_and_angle_batch( Q ):
+    'Q - quaternions in FreeCAD order, (q_1, q_2, q_3, q_0) for each row. returns axes, angles'
+    Q = numpy.atleast_2d( numpy.asarray( Q, dtype=float ) )
+    q_norm = norm( Q[:,:3], axis=1 )
+    axes = numpy.zeros( (len(Q), 3) )
+    axes[:,0] = 1.0
+    nonZero = q_norm > 0
+    axes[nonZero] = Q[nonZero,:3] / q_norm[nonZero,None]
+    return axes, 2*arccos2_batch( Q[:,3] )
+
+def azimuth_and_elevation_angles_to_axis_batch( a, e ):
+    return numpy.array( azimuth_and_elevation_angles_to_axis( *_broadcast_1d( a, e ) ) ).T
+
+def quaternion_multiply_batch( q1, q2 ):
+    'q1, q2 - (N,4) or (4,) arrays'
+    q1, q2 = numpy.broadcast_arrays( numpy.atleast_2d( q1 ), numpy.atleast_2d( q2 ) )
+    return quaternion_multiply( q1.T, q2.T ).T
+
+def axis_rotation_matrix_batch( theta, u_x, u_y, u_z ):
+    return axis_rotation_matrix( *_broadcast_1d( theta, u_x, u_y, u_z ) ).transpose( 2, 0, 1 )
+
+def azimuth_elevation_rotation_matrix_batch( azi, ela, theta ):
+    U = azimuth_and_elevation_angles_to_axis_batch( azi, ela )
+    return axis_rotation_matrix_batch( theta, U[:,0], U[:,1], U[:,2] )
+
+def rotate_batch( R, P ):
+    'R - (N,3,3) or (3,3), P - (N,3) or (3,), returns the (N,3) rotated vectors'
+    return numpy.einsum( '...ij,...j->...i', R, P )
+
 def rotation_matrix_to_euler_ZYX(R, debug=False, checkAnswer=False, tol=10**-6, tol_XZ_same_axis=10**-9 ):
     'better way available at http://en.wikipedia.org/wiki/Rotation_formalisms_in_three_dimensions#Rotation_matrix_.E2.86.94_Euler_angles'
     if 1.0 - abs(R[2,0]) > tol_XZ_same_axis :
@@ -476,52 +580,58 @@ def gram_schmidt_orthonormalization( v1, v2, v3 ):
     u3 = v3 - gram_schmidt_proj(u1,v3) - gram_schmidt_proj(u2,v3)
     return normalize(u1), normalize(u2), normalize(u3)
 
+def sample_surface( surface, n_u, n_v ):
+    'positions and normals (cross product of the tangents) of a surface sampled on a n_u by n_v grid, as (n,3) arrays'
+    P = []
+    N = []
+    for v in linspace(0,1,n_v):
+        for u in linspace(0,1,n_u):
+            t_u, t_v = surface.tangent(u,v)
+            P.append( numpy.array( surface.value(u,v) ) )
+            N.append( crossProduct( t_u, t_v ) )
+    return numpy.array(P), numpy.array(N)
+
 def fit_plane_to_surface1( surface, n_u=3, n_v=3 ):
-    uv = sum( [ [ (u,v) for u in linspace(0,1,n_u)] for v in linspace(0,1,n_v) ], [] )
-    P = [ surface.value(u,v) for u,v in uv ] #positions at u,v points
-    N = [ crossProduct( *surface.tangent(u,v) ) for u,v in uv ] 
-    plane_norm = sum(N) / len(N) #plane's normal, averaging done to reduce error
+    'fit plane to surface sampled on a n_u by n_v grid, returns plane_norm, plane_pos, error'
+    return fit_plane_to_points( *sample_surface( surface, n_u, n_v ) )
+
+def fit_plane_to_points( P, N ):
+    plane_norm = N.mean( axis=0 ) #plane's normal, averaging done to reduce error
     plane_pos = P[0]
-    error = sum([ abs( dot(p - plane_pos, plane_norm) ) for p in P ])
+    error = numpy.abs( dot( P - plane_pos, plane_norm ) ).sum()
     return plane_norm, plane_pos, error
 
 def fit_rotation_axis_to_surface1( surface, n_u=3, n_v=3 ):
     'should work for cylinders and pssibly cones (depending on the u,v mapping)'
-    uv = sum( [ [ (u,v) for u in linspace(0,1,n_u)] for v in linspace(0,1,n_v) ], [] )
-    P = [ numpy.array(surface.value(u,v)) for u,v in uv ] #positions at u,v points
-    N = [ crossProduct( *surface.tangent(u,v) ) for u,v in uv ] 
-    intersections = []
-    for i in range(len(N)-1):
-        for j in range(i+1,len(N)):
-            # based on the distance_between_axes( p1, u1, p2, u2) function,
-            if 1 - abs(dot( N[i], N[j])) < 10**-6:
-                continue #ignore parrallel case
-            p1_x, p1_y, p1_z = P[i]
-            u1_x, u1_y, u1_z = N[i]
-            p2_x, p2_y, p2_z = P[j]
-            u2_x, u2_y, u2_z = N[j]
-            t1_t1_coef = u1_x**2 + u1_y**2 + u1_z**2 #should equal 1
-            t1_t2_coef = -2*u1_x*u2_x - 2*u1_y*u2_y - 2*u1_z*u2_z # collect( expand(d_sqrd), [t1*t2] )
-            t2_t2_coef = u2_x**2 + u2_y**2 + u2_z**2 #should equal 1 too
-            t1_coef    = 2*p1_x*u1_x + 2*p1_y*u1_y + 2*p1_z*u1_z - 2*p2_x*u1_x - 2*p2_y*u1_y - 2*p2_z*u1_z
-            t2_coef    =-2*p1_x*u2_x - 2*p1_y*u2_y - 2*p1_z*u2_z + 2*p2_x*u2_x + 2*p2_y*u2_y + 2*p2_z*u2_z
-            A = numpy.array([ [ 2*t1_t1_coef , t1_t2_coef ] , [ t1_t2_coef, 2*t2_t2_coef ] ])
-            b = numpy.array([ t1_coef, t2_coef])
-            try:
-                t1, t2 = numpy.linalg.solve(A,-b)
-            except numpy.linalg.LinAlgError:
-                continue #print('distance_between_axes, failed to solve problem due to LinAlgError, using numerical solver instead')
-            pos_t1 = P[i] + numpy.array(N[i])*t1
-            pos_t2 = P[j] + N[j]*t2
-            intersections.append( pos_t1 )
-            intersections.append( pos_t2 )
+    return fit_rotation_axis_to_points( *sample_surface( surface, n_u, n_v ) )
+
+def fit_rotation_axis_to_points( P, N ):
+    '''
+    the closest approach points of the lines through P along N, for all pairs of non-parallel lines, are fitted to an axis.
+    P, N - arrays of shape (n,3)
+    '''
+    i, j = numpy.triu_indices( len(N), 1 )
+    nonParallel = 1 - abs( numpy.sum( N[i]*N[j], axis=1 ) ) >= 10**-6
+    i, j = i[nonParallel], j[nonParallel]
+    # based on the distance_between_axes( p1, u1, p2, u2) function, solving [[2*t1_t1_coef, t1_t2_coef],[t1_t2_coef, 2*t2_t2_coef]] * [t1, t2] = -[t1_coef, t2_coef] for each pair
+    D = P[i] - P[j]
+    t1_t1_coef = numpy.sum( N[i]**2, axis=1 ) #should equal 1
+    t1_t2_coef = -2*numpy.sum( N[i]*N[j], axis=1 )
+    t2_t2_coef = numpy.sum( N[j]**2, axis=1 ) #should equal 1 too
+    t1_coef = 2*numpy.sum( D*N[i], axis=1 )
+    t2_coef = -2*numpy.sum( D*N[j], axis=1 )
+    det = 4*t1_t1_coef*t2_t2_coef - t1_t2_coef**2
+    solvable = det != 0
+    i, j, det = i[solvable], j[solvable], det[solvable]
+    t1 = ( -2*t2_t2_coef[solvable]*t1_coef[solvable] + t1_t2_coef[solvable]*t2_coef[solvable] ) / det
+    t2 = ( t1_t2_coef[solvable]*t1_coef[solvable] - 2*t1_t1_coef[solvable]*t2_coef[solvable] ) / det
+    intersections = numpy.concatenate([ P[i] + N[i]*t1[:,None], P[j] + N[j]*t2[:,None] ])
     if len(intersections) < 2:
         error = numpy.inf
         return 0, 0, error
     else: #fit vector to intersection points; http://mathforum.org/library/drmath/view/69103.html
-        X = numpy.array(intersections)
-        centroid = numpy.mean(X,axis=0)
-        M = numpy.array([i - centroid for i in intersections ])
+        centroid = numpy.mean( intersections, axis=0 )
+        M = intersections - centroid
         A = numpy.dot(M.transpose(), M)
         U,s,V = numpy.linalg.svd(A)    #numpy docs: s : (..., K) The singular values for every matrix, sorted in descending order.
         axis_pos = centroid
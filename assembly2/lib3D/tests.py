@@ -100,7 +100,35 @@ class Test_Lib3D(unittest.TestCase):
                 norm(axis - axis_out) < 10**-12,
                 "norm(axis - axis_out) > 10**-12. \n  in:  axis %s \n  azimuth %f, elavation %f \n  out: axis %s" % (axis,a,e,axis_out)
             )
-        
+
+    def test_batched_rotations( self ):
+        from lib3D import quaternion, quaternion_to_axis_and_angle, azimuth_and_elevation_angles_to_axis, quaternion_multiply, axis_rotation_matrix, azimuth_elevation_rotation_matrix
+        from lib3D import quaternion_batch, quaternion_to_axis_and_angle_batch, azimuth_and_elevation_angles_to_axis_batch, quaternion_multiply_batch, axis_rotation_matrix_batch, azimuth_elevation_rotation_matrix_batch, rotate_batch
+        n = 20
+        azi, ela, theta = pi*(2*rand(n)-1), pi*(rand(n)-0.5), pi*(2*rand(n)-1)
+        U = azimuth_and_elevation_angles_to_axis_batch( azi, ela )
+        self.assertEqual( U.shape, (n,3) )
+        self.assertTrue( numpy.allclose( U, [ azimuth_and_elevation_angles_to_axis( a, e ) for a,e in zip(azi,ela) ] ) )
+        Q = quaternion_batch( theta, U[:,0], U[:,1], U[:,2] )
+        self.assertEqual( Q.shape, (n,4) )
+        self.assertTrue( numpy.allclose( Q, [ quaternion( t, *u ) for t,u in zip(theta,U) ] ) )
+        Q[0] = 0, 0, 0, 1 #zero rotation
+        axes, angles = quaternion_to_axis_and_angle_batch( Q )
+        for q, axis, angle in zip( Q, axes, angles ):
+            axis_s, angle_s = quaternion_to_axis_and_angle( *q )
+            self.assertAllClose( axis, axis_s )
+            self.assertClose( angle, angle_s )
+        Q2 = 2*rand(n,4) - 1
+        self.assertTrue( numpy.allclose( quaternion_multiply_batch( Q, Q2 ), [ quaternion_multiply( q, q2 ) for q,q2 in zip(Q,Q2) ] ) )
+        self.assertTrue( numpy.allclose( quaternion_multiply_batch( Q[1], Q2 ), [ quaternion_multiply( Q[1], q2 ) for q2 in Q2 ] ) )
+        R = axis_rotation_matrix_batch( theta, U[:,0], U[:,1], U[:,2] )
+        self.assertEqual( R.shape, (n,3,3) )
+        self.assertTrue( numpy.allclose( R, [ axis_rotation_matrix( t, *u ) for t,u in zip(theta,U) ] ) )
+        R = azimuth_elevation_rotation_matrix_batch( azi, ela, theta )
+        self.assertTrue( numpy.allclose( R, [ azimuth_elevation_rotation_matrix( a, e, t ) for a,e,t in zip(azi,ela,theta) ] ) )
+        P = rand(n,3)
+        self.assertTrue( numpy.allclose( rotate_batch( R, P ), [ dot( R_i, p ) for R_i, p in zip(R,P) ] ) )
+
     def test_distance_between_axes( self ):
         from lib3D import distance_between_axes_fmin, distance_between_axes
         p1 = numpy.array( [0.0 , 0, 0 ] )
@@ -299,7 +327,49 @@ class Test_Lib3D(unittest.TestCase):
                 error < 10**-9,
                 'gram_schmidt_orthonormalization test failed, error %e > 10**-9' % error
             )
-    
+
+    def test_surface_fitting( self ):
+        from lib3D import fit_plane_to_surface1, fit_rotation_axis_to_surface1, normalize
+        class Surface: #mimics the value and tangent methods of a FreeCAD surface
+            def __init__( self, value, tangent_u, tangent_v ):
+                self.value = value
+                self.tangent = lambda u,v : ( normalize(tangent_u(u,v)), normalize(tangent_v(u,v)) )
+        c = numpy.array([ 1.0, 2.0, 3.0 ])
+        cylinder = Surface(
+            lambda u,v : c + numpy.array([ 2*cos(3*u), 2*sin(3*u), 5*v ]),
+            lambda u,v : numpy.array([ -sin(3*u), cos(3*u), 0 ]),
+            lambda u,v : numpy.array([ 0, 0, 1.0 ]) )
+        plane = Surface(
+            lambda u,v : numpy.array([ u, 2*v, 0.3*u + 0.1*v ]),
+            lambda u,v : numpy.array([ 1, 0, 0.3 ]),
+            lambda u,v : numpy.array([ 0, 2, 0.1 ]) )
+        sphere = Surface(
+            lambda u,v : numpy.array([ cos(u)*cos(v), sin(u)*cos(v), sin(v) ]),
+            lambda u,v : numpy.array([ -sin(u), cos(u), 0 ]),
+            lambda u,v : numpy.array([ -cos(u)*sin(v), -sin(u)*sin(v), cos(v) ]) )
+        for n_u, n_v in [ (3,3), (5,4) ]:
+            axis, center, error = fit_rotation_axis_to_surface1( cylinder, n_u, n_v )
+            self.assertTrue( error < 10**-9 )
+            self.assertClose( abs(axis[2]), 1.0 )
+            self.assertAllClose( center[:2], c[:2] )
+            plane_norm, plane_pos, error = fit_plane_to_surface1( plane, n_u, n_v )
+            self.assertTrue( error < 10**-9 )
+            self.assertClose( abs( dot( normalize(plane_norm), normalize(numpy.array([-0.3, -0.05, 1])) ) ), 1.0 )
+            self.assertTrue( fit_plane_to_surface1( cylinder, n_u, n_v )[2] > 10**-3 )
+        #planar surface whose corner normals are tilted one way, and whose edge midpoint normals are tilted the other way. Only the full grid shows it is a plane
+        e = 0.01
+        def noisy_tangent( u, v ):
+            if u in [0, 1] and v in [0, 1]:
+                return numpy.array([ 1, 0, -e ]), numpy.array([ 0, 1.0, 0 ])
+            elif ( u == 0.5 and v in [0, 1] ) or ( u in [0, 1] and v == 0.5 ):
+                return numpy.array([ 1, 0, e ]), numpy.array([ 0, 1.0, 0 ])
+            return numpy.array([ 1.0, 0, 0 ]), numpy.array([ 0, 1.0, 0 ])
+        noisy_corners = Surface( lambda u,v : numpy.array([ u, v, 0.0 ]), None, None )
+        noisy_corners.tangent = noisy_tangent
+        self.assertTrue( fit_plane_to_surface1( noisy_corners, 2, 2 )[2] > 10**-3 )
+        plane_norm, plane_pos, error = fit_plane_to_surface1( noisy_corners, 5, 5 )
+        self.assertTrue( error < 10**-9 )
+        self.assertClose( abs( normalize(plane_norm)[2] ), 1.0 )
 
 if False:
     print('investigating trigonmetric function precission loss')
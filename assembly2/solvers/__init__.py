@@ -7,7 +7,7 @@ from assembly2.constraints import updateOldStyleConstraintProperties
 from assembly2.constraints import common 
 from .common import constraintsObjectsAllExist
 from assembly2.solvers.dof_reduction_solver import solveConstraints as solveConstraints_dof_reduction_solver
-from assembly2.solvers.newton_solver import solveConstraints as solveConstraints_newton_solver
+from assembly2.solvers.newton_solver import solveConstraints as solveConstraints_newton_solver, solve_via_least_squares
 
 _default =  "_assembly2_preference_"
     
@@ -17,14 +17,17 @@ def solveConstraints(
         showFailureErrorDialog = True,
         printErrors = True,
         use_cache = _default,
+        **solverArgs
 ):
+    'solverArgs - additional solver specific keyword arguments, e.g. split_components for the dof_reduction_solver'
     if solver_name == _default or use_cache == _default:
         preferences = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/Assembly2")
     if solver_name == _default:
         #solver_name = preferences.GetString('solver_to_use', 'dof_reduction_solver')
         solver_name = {
             0:'dof_reduction_solver',
-            1:'newton_solver_slsqp'
+            1:'newton_solver_slsqp',
+            2:'newton_solver_least_squares'
         }[ preferences.GetInt('solver_to_use',0) ]
     if use_cache == _default:
         use_cache = preferences.GetBool('useCache', False)
@@ -32,9 +35,13 @@ def solveConstraints(
         return
     updateOldStyleConstraintProperties(doc)
     if solver_name == 'dof_reduction_solver':
-        return solveConstraints_dof_reduction_solver( doc, showFailureErrorDialog, printErrors, use_cache )
+        if use_cache and not 'persistent_cache' in solverArgs:
+            solverArgs['persistent_cache'] = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/Assembly2").GetBool('persistentCache', False)
+        return solveConstraints_dof_reduction_solver( doc, showFailureErrorDialog, printErrors, use_cache, **solverArgs )
     elif solver_name == 'newton_solver_slsqp':
-        return solveConstraints_newton_solver( doc, showFailureErrorDialog, printErrors, use_cache )
+        return solveConstraints_newton_solver( doc, showFailureErrorDialog, printErrors, use_cache, **solverArgs )
+    elif solver_name == 'newton_solver_least_squares':
+        return solveConstraints_newton_solver( doc, showFailureErrorDialog, printErrors, use_cache, solver=solve_via_least_squares, **solverArgs )
     else:
         raise NotImplementedError( '%s solver interface not added yet' % solver_name )
         
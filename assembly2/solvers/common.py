@@ -1,4 +1,8 @@
 from assembly2.core import debugPrint
+from assembly2.lib3D import quaternion_rotation
+from assembly2.selection import getSubElementPos, getSubElementAxis, planeSelected, cylindricalPlaneSelected, CircularEdgeSelected, LinearEdgeSelected, vertexSelected, sphericalSurfaceSelected
+import FreeCAD
+import numpy, collections
 
 
 def findBaseObject( doc, objectNames  ):
@@ -10,8 +14,8 @@ def findBaseObject( doc, objectNames  ):
         debugPrint( 1, 'It is recommended that the assembly 2 module is used with parts imported using the assembly 2 module.')
         debugPrint( 1, 'This allows for part updating, parts list support, object copying (shift + assembly2 move) and also tells the solver which objects to treat as fixed.')
         debugPrint( 1, 'since no objects have the fixedPosition attribute, fixing the postion of the first object in the first constraint')
-        debugPrint( 1, 'assembly 2 solver: assigning %s a fixed position' % objectNames[0])
-        debugPrint( 1, 'assembly 2 solver: assigning %s, %s a fixed position' % (objectNames[0], doc.getObject(objectNames[0]).Label))
+        debugPrint( 1, 'assembly 2 solver: assigning %s a fixed position', objectNames[0] )
+        debugPrint( 1, 'assembly 2 solver: assigning %s, %s a fixed position', objectNames[0], doc.getObject(objectNames[0]).Label )
         return objectNames[0]
 
 def constraintsObjectsAllExist( doc ):
@@ -30,3 +34,106 @@ def constraintsObjectsAllExist( doc ):
                     FreeCAD.Console.PrintError("aborted solving constraints due to %s refering the non-existent object %s" % (obj.Name, missingObject))
                     return False
     return True
+
+
+#copied and pasted from importPart
+class _SelectionWrapper:
+    'as to interface with assembly2lib classification functions'
+    def __init__(self, obj, subElementName):
+        assert obj != None
+        self.Object = obj
+        self.SubElementNames = [subElementName]
+def classifySubElement(  obj, subElementName ):
+    selection = _SelectionWrapper( obj, subElementName )
+    if planeSelected( selection ):
+        return 'plane'
+    elif cylindricalPlaneSelected( selection ):
+        return 'cylindricalSurface'
+    elif CircularEdgeSelected( selection ):
+        return 'circularEdge'
+    elif LinearEdgeSelected( selection ):
+        return 'linearEdge'
+    elif vertexSelected( selection ):
+        return 'vertex' #all vertex belong to Vertex classification
+    elif sphericalSurfaceSelected( selection ):
+        return 'sphericalSurface'
+    else:
+        return 'other'
+#/copy
+
+
+"""
+Sub-element geometry store.
+For non-analytic surfaces and curves getSubElementPos and getSubElementAxis do costly numerical fits (fit_plane_to_surface1, toBiArcs, ...),
+so there results are stored relative to the objects placement, and reused until the objects shape changes.
+The least recently used entries are evicted once the store holds geometryStoreLimit entries.
+"""
+
+geometryStore = collections.OrderedDict() # ( document name, object name, sub-element name, shapeVersion ) -> { 'category':..., 'pos':..., 'axis':... } relative to the objects placement, least recently used first
+geometryStoreLimit = 10000
+
+def shapeVersion( obj ):
+    '''
+    changes when obj.Shape changes but not when obj is moved, None if unknown in which case the geometry is not stored.
+    Imported parts are only changed by reimporting, otherwise the hashCode of the shape without its placement is used
+    (the hashCode of obj.Shape itself also changes when the object is moved).
+    '''
+    if hasattr( obj, 'sourceFile' ) and hasattr( obj, 'timeLastImport' ):
+        return ( obj.sourceFile, obj.timeLastImport )
+    shape = getattr( obj, 'Shape', None )
+    if hasattr( shape, 'hashCode' ):
+        shape.Placement = FreeCAD.Placement() #obj.Shape returns a copy, so that obj is unaffected
+        return ( 'hashCode', shape.hashCode() )
+    return None
+
+def _storeEntry( obj, subElementName ):
+    version = shapeVersion( obj )
+    if version == None:
+        return None
+    key = ( getattr( getattr( obj, 'Document', None ), 'Name', None ), obj.Name, subElementName, version )
+    if key in geometryStore:
+        entry = geometryStore.pop( key ) #reinserted below as the most recently used entry
+    else:
+        entry = {}
+        while len( geometryStore ) >= geometryStoreLimit:
+            geometryStore.popitem( last=False )
+    geometryStore[key] = entry
+    return entry
+
+def _storedVector( obj, subElementName, quantity, query, translate ):
+    '''
+    the value is stored relative to the objects placement, as well as for the placement it was last requested at.
+    So that for an unmoved object exactly the same value as query( obj, subElementName ) is returned.
+    '''
+    entry = _storeEntry( obj, subElementName )
+    if entry == None:
+        return query( obj, subElementName )
+    base = numpy.array( obj.Placement.Base )
+    q_1, q_2, q_3, q_0 = obj.Placement.Rotation.Q
+    placement = tuple( base ) + ( q_1, q_2, q_3, q_0 )
+    if not quantity in entry:
+        value = numpy.array( query( obj, subElementName ) )
+        relative = quaternion_rotation( value - base if translate else value, -q_1, -q_2, -q_3, q_0 )
+    else:
+        relative, last_placement, value = entry[quantity]
+        if last_placement != placement:
+            value = quaternion_rotation( relative, q_1, q_2, q_3, q_0 ) + ( base if translate else 0 )
+    entry[quantity] = relative, placement, value
+    return value.copy()
+
+def subElementCategory( obj, subElementName ):
+    'classifySubElement, read from the geometry store'
+    entry = _storeEntry( obj, subElementName )
+    if entry == None:
+        return classifySubElement( obj, subElementName )
+    if not 'category' in entry:
+        entry['category'] = classifySubElement( obj, subElementName )
+    return entry['category']
+
+def subElementPos( obj, subElementName ):
+    'getSubElementPos, read from the geometry store'
+    return _storedVector( obj, subElementName, 'pos', getSubElementPos, True )
+
+def subElementAxis( obj, subElementName ):
+    'getSubElementAxis, read from the geometry store'
+    return _storedVector( obj, subElementName, 'axis', getSubElementAxis, False )
@@ -8,21 +8,60 @@ import time, numpy
 from numpy import pi, inf
 from numpy.linalg import norm
 from .solverLib import *
-from .variableManager import VariableManager
+from .variableManager import VariableManager, QuaternionVariableManager, variableManager_classes
 from .constraintSystems import *
 
-import traceback
+from .components import constraintComponents, solveComponents
+from .scheduling import scheduleConstraints
 from . import cache as cacheLib
+from . import profiler as profilerLib
+from .profiler import SolverProfiler
 
-cache = cacheLib.defaultCache
+cacheManager = cacheLib.defaultCacheManager
+componentsCacheManager = cacheLib.defaultComponentsCacheManager
 
 def solveConstraints(
         doc,
         showFailureErrorDialog=True,
         printErrors=True,
-        use_cache=False
+        use_cache=False,
+        split_components=False,
+        processes=1,
+        rotation_parameterization='azimuth_elevation',
+        persistent_cache=False,
+        profiler=None,
+        schedule_constraints=False,
+        loop_closure=False
 ):
+    '''
+    split_components - solve independent sub-assemblies (parts only linked via fixed objects) as separate constraint systems.
+                       With use_cache, each component is cached separately so that editing a constraint only re-solves its own component.
+                       Note the cache is invalidated per component, not per constraint: within the component of an edited constraint,
+                       every constraint after it is re-solved, including those which do not depend on the parts it moves.
+                       So this only helps assemblies made up of several components.
+    processes - number of worker processes used to solve the components in parallel (requires os.fork)
+    rotation_parameterization - 'azimuth_elevation' or 'quaternion', see variableManager.py
+    use_cache - reuse the cached solution of the unchanged constraints; a cache is kept for each document (see cache.SolverCacheManager)
+    persistent_cache - with use_cache, save the cache to a sidecar file next to the document (see cache.saveCache),
+                       which is loaded if the cache in memory does not hold a solution for the document (e.g. after reopening it)
+    profiler - a SolverProfiler to record this solve with, see profiler.py
+    schedule_constraints - add the constraints in the order given by scheduling.scheduleConstraints instead of the doc.Objects order,
+                           to avoid numerical solutions caused by an irregular constraint order
+    loop_closure - solve constraints which close a loop in the assembly (see loops.py) as a block, using the degrees-of-freedom of the parts in the loop
+    '''
+    if profiler is not None:
+        profilerLib.active = profiler
+        try:
+            with profilerLib.span( 'solveConstraints', 'solve', document=doc.Name ):
+                return solveConstraints( doc, showFailureErrorDialog, printErrors, use_cache, split_components, processes, rotation_parameterization, persistent_cache, schedule_constraints=schedule_constraints, loop_closure=loop_closure )
+        finally:
+            profilerLib.active = None
+            profiler.finish()
+            debugPrint( 3, profiler.summary )
     T_start = time.time()
+    updateStats_start = dict( updateStats )
+    solutionStats_start = dict( solutionStats )
+    solverStats_start = solverStatsSnapshot()
     constraintObjectQue = [ obj for obj in doc.Objects if 'ConstraintInfo' in obj.Content ]
     #doc.Objects already in tree order so no additional sorting / order checking required for constraints.
     objectNames = []
@@ -31,75 +70,77 @@ def solveConstraints(
             objectName = getattr(c, attr, None)
             if objectName != None and not objectName in objectNames:
                 objectNames.append( objectName )
-    variableManager = VariableManager( doc, objectNames )
-    debugPrint(3,' variableManager.X0 %s' % variableManager.X0 )
+    variableManager = variableManager_classes[rotation_parameterization]( doc, objectNames )
+    debugPrint( 3, ' variableManager.X0 %s', variableManager.X0 )
     constraintSystem = FixedObjectSystem( variableManager, findBaseObject(doc, objectNames) )
-    debugPrint(4, 'solveConstraints base system: %s' % constraintSystem.str() )
+    if schedule_constraints:
+        constraintObjectQue = scheduleConstraints( doc, constraintObjectQue, constraintSystem.objName )
+        if debugPrint.guard >= 3: debugPrint( 3, 'constraint schedule: %s', ', '.join( c.Name for c in constraintObjectQue ) )
+    if debugPrint.guard >= 4: debugPrint( 4, 'solveConstraints base system: %s', constraintSystem.str() )
 
-    solved = True
-    
     if use_cache:
+        solverCacheManager = componentsCacheManager if split_components else cacheManager
+        solverCache = solverCacheManager.get( doc, None if split_components else constraintSystem.objName )
+        if persistent_cache and not solverCache.holdsDocument( doc ):
+            t_cache_load_start = time.time()
+            with profilerLib.span( 'load', 'cache' ):
+                cacheLoaded = cacheLib.loadCache( solverCache, doc )
+            if cacheLoaded:
+                debugPrint( 3, 'solver cache loaded from file in %3.2fs', time.time() - t_cache_load_start )
+
+    if use_cache and not split_components:
         t_cache_start = time.time()
-        constraintSystem, que_start = cache.retrieve( constraintSystem, constraintObjectQue)
-        debugPrint(3,"~cached solution available for first %i out-off %i constraints (retrieved in %3.2fs)" % (que_start, len(constraintObjectQue), time.time() - t_cache_start ) )
-        cache.prepare()
+        with profilerLib.span( 'retrieve', 'cache' ):
+            constraintSystem, que_start = solverCache.retrieve( constraintSystem, constraintObjectQue)
+        debugPrint( 3, "~cached solution available for first %i out-off %i constraints (retrieved in %3.2fs)", que_start, len(constraintObjectQue), time.time() - t_cache_start )
+        solverCache.prepare()
     else:
         que_start = 0
 
-    for constraintObj in constraintObjectQue[que_start:]:
-        debugPrint( 3, '  parsing %s, type:%s' % (constraintObj.Name, constraintObj.Type ))
-        try:
-            cArgs = [variableManager, constraintObj]
-            if not constraintSystem.containtsObject( constraintObj.Object1) and not constraintSystem.containtsObject( constraintObj.Object2):
-                constraintSystem = AddFreeObjectsUnion(constraintSystem, *cArgs)
-            if constraintObj.Type == 'plane':
-                if constraintObj.SubElement2.startswith('Face'): #otherwise vertex
-                    constraintSystem = AxisAlignmentUnion(constraintSystem, *cArgs,  constraintValue = constraintObj.directionConstraint )
-                constraintSystem = PlaneOffsetUnion(constraintSystem,  *cArgs, constraintValue = constraintObj.offset.Value)
-            elif constraintObj.Type == 'angle_between_planes':
-                constraintSystem = AngleUnion(constraintSystem,  *cArgs, constraintValue = constraintObj.angle.Value*pi/180 )
-            elif constraintObj.Type == 'axial':
-                constraintSystem = AxisAlignmentUnion(constraintSystem,  *cArgs, constraintValue = constraintObj.directionConstraint)
-                constraintSystem =  AxisDistanceUnion(constraintSystem,  *cArgs, constraintValue = 0)
-                if constraintObj.lockRotation: constraintSystem =  LockRelativeAxialRotationUnion(constraintSystem,  *cArgs, constraintValue = 0)
-            elif constraintObj.Type == 'circularEdge':
-                constraintSystem = AxisAlignmentUnion(constraintSystem,  *cArgs, constraintValue=constraintObj.directionConstraint)
-                constraintSystem = AxisDistanceUnion(constraintSystem,  *cArgs, constraintValue=0)
-                constraintSystem = PlaneOffsetUnion(constraintSystem,  *cArgs, constraintValue=constraintObj.offset.Value)
-                if constraintObj.lockRotation: constraintSystem =  LockRelativeAxialRotationUnion(constraintSystem,  *cArgs, constraintValue = 0)
-            elif constraintObj.Type == 'sphericalSurface':
-                constraintSystem = VertexUnion(constraintSystem,  *cArgs, constraintValue=0)
-            else:
-                raise NotImplementedError('constraintType %s not supported yet' % constraintObj.Type)
-            if use_cache:
-                cache.record( constraintSystem )
+    if split_components:
+        components = constraintComponents( doc, constraintObjectQue )
+        debugPrint( 3, 'assembly split into %i independent components', len(components) )
+        constraintSystem, constraintObj = solveComponents( doc, variableManager, components, printErrors, processes, solverCache if use_cache else None, loop_closure )
+    else:
+        constraintSystem, constraintObj = addConstraints(
+            constraintSystem, variableManager, constraintObjectQue[que_start:], printErrors,
+            record = solverCache.record if use_cache else None,
+            loopClosure = loop_closure
+        )
+    solved = constraintObj == None
+    if not solved:
+        debugPrint.dumpTrace( 'solver failed on constraint %s, debug trace' % constraintObj.Name )
 
-                    
-        except Assembly2SolverError as e:
-            if printErrors:
-                FreeCAD.Console.PrintError('UNABLE TO SOLVE CONSTRAINTS! info:')
-                FreeCAD.Console.PrintError(e)
-            solved = False
-            break
-        except:
-            if printErrors:
-                FreeCAD.Console.PrintError('UNABLE TO SOLVE CONSTRAINTS! info:')
-                FreeCAD.Console.PrintError( traceback.format_exc())
-            solved = False
-            break
     if solved:
-        debugPrint(4,'placement X %s' % constraintSystem.variableManager.X )
+        debugPrint( 4, 'placement X %s', constraintSystem.variableManager.X )
 
-        if use_cache:
+        if use_cache and not split_components:
             t_cache_record_start = time.time()
-            cache.commit( constraintSystem, constraintObjectQue, que_start)
-            debugPrint( 4,'  time cache.record %3.2fs' % (time.time()-t_cache_record_start) )
+            with profilerLib.span( 'commit', 'cache' ):
+                solverCache.commit( constraintSystem, constraintObjectQue, que_start)
+            debugPrint( 4, '  time cache.record %3.2fs', time.time()-t_cache_record_start )
+        if use_cache:
+            solverCacheManager.evict()
+            if debugPrint.guard >= 3: debugPrint( 3, '  %s', solverCacheManager.statsSummary() )
+        if use_cache and persistent_cache:
+            t_cache_save_start = time.time()
+            with profilerLib.span( 'save', 'cache' ):
+                cacheLib.saveCache( solverCache, doc )
+            debugPrint( 4, '  time to save cache %3.2fs', time.time()-t_cache_save_start )
 
         t_update_freecad_start = time.time()
         variableManager.updateFreeCADValues( constraintSystem.variableManager.X )
-        debugPrint( 4,'  time to update FreeCAD placement variables %3.2fs' % (time.time()-t_update_freecad_start) )
+        debugPrint( 4, '  time to update FreeCAD placement variables %3.2fs', time.time()-t_update_freecad_start )
 
-        debugPrint(2,'Constraint system solved in %2.2fs; resulting system has %i degrees-of-freedom' % (time.time()-T_start, len( constraintSystem.degreesOfFreedom)))
+        if hasattr( constraintSystem, 'degreesOfFreedomCount' ): #split_components, degreesOfFreedom not available if solved in worker processes
+            degreesOfFreedomCount = constraintSystem.degreesOfFreedomCount
+        else:
+            degreesOfFreedomCount = len( constraintSystem.degreesOfFreedom )
+        debugPrint( 2, 'Constraint system solved in %2.2fs; resulting system has %i degrees-of-freedom', time.time()-T_start, degreesOfFreedomCount )
+        if debugPrint.guard >= 3:
+            debugPrint( 3, '  constraint system updates %i, skipped as unchanged %i', *[ updateStats[k] - updateStats_start[k] for k in ['updates','skipped'] ] )
+            debugPrint( 3, '  constraint equations solved analytically %i, numerically %i', *[ solutionStats[k] - solutionStats_start[k] for k in ['analytical','numerical'] ] )
+            debugPrint( 3, '  numerical solves, %s', solverStatsSummary( solverStats_start ) )
     elif showFailureErrorDialog and  QtGui.qApp != None: #i.e. GUI active
         # http://www.blog.pythonlibrary.org/2013/04/16/pyside-standard-dialogs-and-message-boxes/
         flags = QtGui.QMessageBox.StandardButton.Yes
@@ -1,69 +1,109 @@
 from .constraintSystems import *
-import copy
+from . import constraintSystems as constraintSystemsModule, degreesOfFreedom as degreesOfFreedomModule, variableManager as variableManagerModule, loops as loopsModule
+from assembly2.solvers.common import subElementCategory, subElementPos, subElementAxis, shapeVersion
+import copy, os, io, pickle, zlib, inspect, hashlib, numpy
+from sys import getsizeof
 
 class SolverCache:
+    copyOnWrite = True #share the cached constraint system nodes with later solves via ConstraintSystemSnapshot, instead of copy.deepcopy-ing them on retrieval
+
     def __init__(self):
         self.inputs = []
         self.input_levels = []
         self.result = None
         self.debugMode = 0
+        self.cacheInputs = {} #see cacheInput
+
+    def cacheInput( self, vM, constraint ):
+        '''
+        CacheInput for constraint, computed once for each constraint value and shape version of its objects (see solvers.common.shapeVersion).
+        Not stored if the shape version of either object is unknown.
+        '''
+        obj1 = vM.doc.getObject( constraint.Object1 )
+        obj2 = vM.doc.getObject( constraint.Object2 )
+        version1, version2 = shapeVersion( obj1 ), shapeVersion( obj2 )
+        if version1 == None or version2 == None:
+            return CacheInput( vM, constraint )
+        key = ( constraint.Name, constraint.Type, constraintArgs( constraint ), constraint.Object1, constraint.SubElement1, version1, constraint.Object2, constraint.SubElement2, version2 )
+        if not key in self.cacheInputs:
+            self.cacheInputs[key] = CacheInput( vM, constraint )
+        return self.cacheInputs[key]
 
-    def retrieve( self, rootSystem, constraintObjectQue):
+    def retrieve( self, rootSystem, constraintObjectQue, objectNames=None):
+        'objectNames - if given, only the placement variables of these objects are restored from the cached solution'
         if self.result == None:
             return rootSystem , 0
         if rootParameters(rootSystem) != self.rootParameters:
             debugPrint(4,'cache: rootParameters(rootSystem) != self.rootParameters')
             return rootSystem, 0
-        for i, c in enumerate(constraintObjectQue) :
-            if i > len(self.inputs)-1:
-                i = i - 1
-                break
-            if not self.inputs[i] == CacheInput( rootSystem.variableManager, c ):
+        if rootSystem.variableManager.__class__ != self.vM.__class__:
+            debugPrint( 4, 'cache: cached solution uses a different placement parameterization (%s)', self.vM.__class__.__name__ )
+            return rootSystem, 0
+        i = 0 #number of constraints at the start of constraintObjectQue with unchanged inputs
+        for c, cachedInput in zip( constraintObjectQue, self.inputs ):
+            constraintInput = self.cacheInput( rootSystem.variableManager, c )
+            if constraintInput.digest != cachedInput.digest:
                 if self.debugMode == 1:
-                    i_cache = self.inputs[i]
-                    i_const = CacheInput( rootSystem.variableManager, c )
-                    print( i_cache )
-                    print( i_const )
-                    if i_cache.constraintType != i_const.constraintType:
+                    print( cachedInput )
+                    print( constraintInput )
+                    if cachedInput.constraintType != constraintInput.constraintType:
                         print('  constraintType not equal!')
-                    elif i_cache.constraintArgs != i_const.constraintArgs:
+                    elif cachedInput.constraintArgs != constraintInput.constraintArgs:
                         print('  constraintArgspe not equal!')
-                    elif  i_cache.shapeElement1 != i_const.shapeElement1:
+                    elif  cachedInput.shapeElement1 != constraintInput.shapeElement1:
                         print( '  shapeElement1 not equal:')
-                        print( i_cache.shapeElement1)
-                        print( i_const.shapeElement1)
-                    elif  i_cache.shapeElement2 != i_const.shapeElement2:
+                        print( cachedInput.shapeElement1)
+                        print( constraintInput.shapeElement1)
+                    elif  cachedInput.shapeElement2 != constraintInput.shapeElement2:
                         print( '  shapeElement2 not equal:')
-                        print( i_cache.shapeElement2)
-                        print( i_const.shapeElement2)
+                        print( cachedInput.shapeElement2)
+                        print( constraintInput.shapeElement2)
                     #raw_input(' for cache.debugMode1 inputs should be equal! press enter to continue')
                     #raise RuntimeError, "for cache.debugMode1 inputs should be equal!"
-                i = i -1
                 break
+            i = i + 1
+        i = i - 1
         if i < 0:
             return rootSystem, 0
         else:
-            tree = [ self.result ]
-            while tree[0].parentSystem != None:
-                tree.insert(0, tree[0].parentSystem)
-            new_sys = copy_constraint_system( tree[ self.input_levels[i] ] )
-            assert new_sys.numberOfParentSystems() == self.input_levels[i]
-
             new_vM = rootSystem.variableManager
-            old_vM = self.result.variableManager
-            for objName in old_vM.index.keys():
-                if objName in new_vM.index:
-                    i_new = new_vM.index[ objName ]
-                    i_old = old_vM.index[ objName ]
-                    new_vM.X[ i_new: i_new+6] = old_vM.X[ i_old: i_old+6 ]
+            for objName, values in self.placements.items():
+                if objName in new_vM.index and ( objectNames == None or objName in objectNames ):
+                    new_vM.setPlacementVariables( objName, new_vM.X, values )
                     #nessary to update X0 too, dont think so?
-            update_variableManagers( new_sys, new_vM, set() ) 
+            if self.copyOnWrite:
+                new_sys = self.snapshot.restore( self.input_levels[i], new_vM )
+            else:
+                tree = [ self.result ]
+                while tree[0].parentSystem != None:
+                    tree.insert(0, tree[0].parentSystem)
+                new_sys = copy_constraint_system( tree[ self.input_levels[i] ] )
+                update_variableManagers( new_sys, new_vM, set() )
+            assert new_sys.numberOfParentSystems() == self.input_levels[i]
 
             #use id to determin the memory location of a variable
             return new_sys, i+1
 
 
 
+    def holdsDocument( self, doc ):
+        return self.result != None and self.vM.doc is doc
+
+    def __getstate__( self ):
+        'used by saveCache, the snapshot is rebuilt from the cached systems in __setstate__'
+        if self.result != None and hasattr( self, 'snapshot' ):
+            self.snapshot.restore( len(self.snapshot.levels) - 1, self.vM ) #reset the shared nodes to there committed state
+        state = dict( self.__dict__ )
+        for attr_name in [ 'snapshot', 'record_levels', 'cacheInputs' ]: #shape versions are only valid within a FreeCAD session
+            state.pop( attr_name, None )
+        return state
+
+    def __setstate__( self, state ):
+        self.__dict__.update( state )
+        self.cacheInputs = {}
+        if self.result != None and self.copyOnWrite:
+            self.snapshot = ConstraintSystemSnapshot( self.result )
+
     def prepare( self ):
         'code called before constraint solving loop'
         self.record_levels = [] #used in finalize
@@ -77,6 +117,10 @@ class SolverCache:
         'call if constraints solved'
         self.vM = constraintSystem.variableManager
         self.result = constraintSystem
+        #recorded, as the cached nodes may be pointed to another variableManager before the next retrieve
+        self.placements = dict( ( objName, self.vM.placementVariables( objName, self.vM.X ) ) for objName in self.vM.index )
+        if self.copyOnWrite:
+            self.snapshot = ConstraintSystemSnapshot( constraintSystem )
         #update_variableManagers( constraintSystem, self.vM ) #ensures all system nodes point to same vM, with out this different vM will result from partially solved systems
         root = constraintSystem
         while root.parentSystem != None:
@@ -86,7 +130,200 @@ class SolverCache:
         #print(self.input_levels)
         del self.inputs[que_start:]
         for c in constraintObjectQue[que_start:]:
-            self.inputs.append( CacheInput(constraintSystem.variableManager, c) )
+            self.inputs.append( self.cacheInput( constraintSystem.variableManager, c ) )
+        digests = set( c.digest for c in self.inputs )
+        self.cacheInputs = dict( ( key, cacheInput ) for key, cacheInput in self.cacheInputs.items() if cacheInput.digest in digests ) #drop the inputs of constraint values no longer in use
+        self.memoryUsage = estimatedSize( self.snapshot if self.copyOnWrite else ConstraintSystemSnapshot( constraintSystem ) )
+        self.memoryUsage = self.memoryUsage + sum( getsizeof( c.__dict__ ) + getsizeof( c.shapeElement1.__dict__ ) + getsizeof( c.shapeElement2.__dict__ ) for c in self.inputs )
+
+class ComponentsCache:
+    '''
+    a SolverCache for each independent component of an assembly (see components.py).
+    As components do not share any constraints, editing a constraint only invalidates the cached solution of its own component,
+    while the solutions of the other components are reused completely.
+    This is invalidation per component, not per constraint: within the edited component every constraint after the edited one
+    is re-solved (see SolverCache.retrieve), so only assemblies made up of several components (see components.py) benefit.
+    '''
+    def __init__(self):
+        self.caches = {}
+        self.used = set()
+
+    def componentCache( self, constraintObjectQue ):
+        'components are identified by the name of their first constraint'
+        key = constraintObjectQue[0].Name
+        self.used.add( key )
+        if not key in self.caches:
+            self.caches[key] = SolverCache()
+        return self.caches[key]
+
+    def holdsDocument( self, doc ):
+        return any( c.holdsDocument( doc ) for c in self.caches.values() )
+
+    def prepare( self ):
+        self.used = set()
+
+    def commit( self ):
+        'drop the caches of components no longer in the assembly'
+        for key in list( self.caches.keys() ):
+            if not key in self.used:
+                del self.caches[key]
+        self.memoryUsage = sum( getattr( c, 'memoryUsage', 0 ) for c in self.caches.values() )
+
+class SolverCacheManager:
+    '''
+    solver caches for several documents, so that switching between open assemblies does not evict the cached solution of the other assembly.
+    Caches are keyed by document and base (fixed) object, and the least recently used caches are evicted once
+    the estimated size of all the caches exceeds memoryBudget.
+    '''
+    memoryBudget = 64 * 2**20 #bytes, as estimated by estimatedSize
+
+    def __init__( self, cacheClass=SolverCache ):
+        self.cacheClass = cacheClass
+        self.caches = {}
+        self.usage = [] #keys, least recently used first
+        self.stats = { 'hits':0, 'misses':0, 'evictions':0 }
+
+    def get( self, doc, baseObjectName=None ):
+        'returns the cache for doc, creating it if required'
+        key = ( doc.Name, baseObjectName )
+        if key in self.caches and self.caches[key].holdsDocument( doc ):
+            self.stats['hits'] += 1
+            self.usage.remove( key )
+        else: #includes a document which has been closed and reopened under the same name
+            self.stats['misses'] += 1
+            if key in self.caches:
+                self.usage.remove( key )
+            self.caches[key] = self.cacheClass()
+        self.usage.append( key )
+        return self.caches[key]
+
+    def memoryUsage( self ):
+        return sum( getattr( c, 'memoryUsage', 0 ) for c in self.caches.values() )
+
+    def evict( self ):
+        'drop least recently used caches until within memoryBudget, the most recently used cache is always kept'
+        while self.memoryUsage() > self.memoryBudget and len( self.usage ) > 1:
+            key = self.usage.pop( 0 )
+            debugPrint( 3, 'solver cache for %s evicted', str(key) )
+            del self.caches[key]
+            self.stats['evictions'] += 1
+
+    def clear( self ):
+        self.caches = {}
+        self.usage = []
+
+    def statsSummary( self ):
+        return 'solver cache hits %i, misses %i, evictions %i; %i caches using ~%1.1fMB' % ( self.stats['hits'], self.stats['misses'], self.stats['evictions'], len(self.caches), self.memoryUsage() / 2.0**20 )
+
+def estimatedSize( snapshot ):
+    'rough number of bytes held by the constraint system nodes and degrees-of-freedom recorded in snapshot'
+    size = 0
+    for level in snapshot.levels:
+        for obj, state in level:
+            size = size + getsizeof( state )
+            for v in state.values():
+                size = size + ( v.nbytes if isinstance( v, numpy.ndarray ) else getsizeof( v ) )
+    return size
+
+
+cacheFileSuffix = '.assembly2cache'
+cacheFileFormat = 3 #increment when the cached classes change in an incompatible way
+
+def cacheFilename( doc ):
+    'sidecar file next to the document, None if the document has not been saved yet'
+    if not getattr( doc, 'FileName', '' ):
+        return None
+    return os.path.splitext( doc.FileName )[0] + cacheFileSuffix
+
+class _DocumentPickler( pickle.Pickler ):
+    '''
+    FreeCAD documents and document objects cannot be pickled, so they are stored by name and looked up again on loading.
+    They are matched by name and not by id(), as the FreeCAD python wrappers of a document object are not stable identities.
+    '''
+    def __init__( self, f, doc ):
+        pickle.Pickler.__init__( self, f, pickle.HIGHEST_PROTOCOL )
+        self.doc = doc
+    def persistent_id( self, obj ):
+        if obj is self.doc or ( hasattr( obj, 'Objects' ) and getattr( obj, 'Name', None ) == self.doc.Name ):
+            return 'doc'
+        if hasattr( obj, 'Content' ) and hasattr( obj, 'Name' ) and self.doc.getObject( obj.Name ) != None:
+            return 'obj:' + obj.Name
+        return None
+
+_cacheModules = [ __name__ ] + [ m.__name__ for m in [ constraintSystemsModule, degreesOfFreedomModule, variableManagerModule, loopsModule ] ] #modules whose classes are held by the cache
+_numpyModules = [ 'numpy', 'numpy.core.multiarray', 'numpy.core.numeric', 'numpy._core.multiarray', 'numpy._core.numeric' ]
+_numpyGlobals = [ 'ndarray', 'dtype', '_reconstruct', 'scalar', '_frombuffer' ]
+_builtinModules = [ '__builtin__', 'builtins' ]
+_builtinGlobals = [ 'set', 'frozenset', 'complex' ]
+
+class _DocumentUnpickler( pickle.Unpickler ):
+    '''
+    Only the classes defined in the dof_reduction_solver modules held by the cache, numpy arrays and a few builtin types are loaded (see find_class),
+    so that a planted or shared cache file cannot be used to run arbitrary code when a document is opened.
+    '''
+    def __init__( self, f, doc ):
+        pickle.Unpickler.__init__( self, f )
+        self.doc = doc
+    def persistent_load( self, pid ):
+        if pid == 'doc':
+            return self.doc
+        obj = self.doc.getObject( pid[4:] )
+        if obj == None:
+            raise KeyError( '%s no longer in document' % pid[4:] )
+        return obj
+    def find_class( self, module, name ):
+        if not '.' in name: #a dotted name would be looked up attribute by attribute, e.g. cache.io.FileIO
+            if module in _cacheModules:
+                cls = pickle.Unpickler.find_class( self, module, name )
+                if inspect.isclass( cls ) and cls.__module__ == module: #defined in module, not imported into it
+                    return cls
+            elif ( module in _numpyModules and name in _numpyGlobals ) or ( module in _builtinModules and name in _builtinGlobals ):
+                return pickle.Unpickler.find_class( self, module, name )
+        raise pickle.UnpicklingError( 'solver cache file refers to %s.%s, which is not allowed' % ( module, name ) )
+
+def saveCache( cache, doc ):
+    '''
+    write cache (a SolverCache or ComponentsCache holding a solution for doc) to the sidecar file of doc,
+    so that the first solve after reopening the document can reuse it. Returns True if the cache was saved.
+    '''
+    filename = cacheFilename( doc )
+    if filename == None or not cache.holdsDocument( doc ):
+        return False
+    f = io.BytesIO()
+    try:
+        _DocumentPickler( f, doc ).dump( { 'format': cacheFileFormat, 'class': cache.__class__.__name__, 'cache': cache } )
+        with open( filename, 'wb' ) as cacheFile:
+            cacheFile.write( zlib.compress( f.getvalue() ) )
+    except ( pickle.PicklingError, TypeError, IOError, OSError ) as msg:
+        debugPrint( 1, 'unable to save solver cache to %s: %s', filename, msg )
+        return False
+    debugPrint( 3, 'solver cache saved to %s (%i bytes)', filename, os.path.getsize( filename ) )
+    return True
+
+def loadCache( cache, doc ):
+    '''
+    load the cache state saved by saveCache for doc into cache, if the sidecar file exists and is valid.
+    The cached constraint inputs and root parameters are still checked against the document by SolverCache.retrieve,
+    so a cache file which is out of date only results in the changed constraints being resolved.
+    Returns True if the cache was loaded.
+    '''
+    filename = cacheFilename( doc )
+    if filename == None or not os.path.exists( filename ):
+        return False
+    try:
+        with open( filename, 'rb' ) as cacheFile:
+            data = _DocumentUnpickler( io.BytesIO( zlib.decompress( cacheFile.read() ) ), doc ).load()
+    except Exception as msg: #corrupt file, or saved by an incompatible version of assembly2
+        debugPrint( 1, 'unable to load solver cache from %s: %s', filename, msg )
+        return False
+    if not isinstance( data, dict ) or data.get('format') != cacheFileFormat or data.get('class') != cache.__class__.__name__:
+        debugPrint( 3, 'solver cache in %s not compatible, ignoring', filename )
+        return False
+    cache.__dict__.clear()
+    cache.__dict__.update( data['cache'].__dict__ )
+    debugPrint( 3, 'solver cache loaded from %s', filename )
+    return True
+
 
 def rootParameters( sys ):
     if isinstance(sys, FixedObjectSystem):
@@ -95,78 +332,105 @@ def rootParameters( sys ):
         raise NotImplementedError('RootParameters for %s not support' % sys)
 
 
+def constraintArgs( constraint ):
+    if constraint.Type == 'plane':
+        return ( constraint.directionConstraint, constraint.offset.Value )
+    elif constraint.Type == 'angle_between_planes':
+        return ( constraint.angle.Value )
+    elif constraint.Type == 'axial':
+        return ( constraint.directionConstraint, constraint.lockRotation )
+    elif constraint.Type == 'circularEdge':
+        return ( constraint.directionConstraint, constraint.offset.Value, constraint.lockRotation )
+    elif  constraint.Type == 'sphericalSurface':
+        return ()
+    else:
+        raise NotImplementedError("CacheInput for constraint type %s not supported yet"  %  constraint.Type)
+
 class CacheInput:
     def __init__(self, vM, constraint ):
         self.constraintType = constraint.Type
-        if constraint.Type == 'plane':
-            self.constraintArgs = ( constraint.directionConstraint, constraint.offset.Value )
-        elif constraint.Type == 'angle_between_planes':
-            self.constraintArgs = ( constraint.angle.Value )
-        elif constraint.Type == 'axial':
-            self.constraintArgs = ( constraint.directionConstraint, constraint.lockRotation )
-        elif constraint.Type == 'circularEdge':
-            self.constraintArgs = ( constraint.directionConstraint, constraint.offset.Value, constraint.lockRotation )
-        elif  constraint.Type == 'sphericalSurface':
-            self.constraintArgs = ()
-        else:
-            raise NotImplementedError("CacheInput for constraint type %s not supported yet"  %  constraint.Type)
+        self.constraintArgs = constraintArgs( constraint )
         self.shapeElement1 = ShapeElementInfo(vM, constraint.Object1, constraint.SubElement1)
         self.shapeElement2 = ShapeElementInfo(vM, constraint.Object2, constraint.SubElement2)
+        self.fingerprint = ( self.constraintType, self.constraintArgs, self.shapeElement1.fingerprint, self.shapeElement2.fingerprint )
+        self.digest = hashlib.sha1( repr( self.fingerprint ).encode('utf-8') ).hexdigest() #unlike hash(), the same in every session, as required for cache files
     def __eq__(self, b):
-        return self.constraintType == b.constraintType and self.constraintArgs == b.constraintArgs and self.shapeElement1 == b.shapeElement1 and self.shapeElement2 == b.shapeElement2
+        return self.digest == b.digest
+    def __ne__(self, b):
+        return not self == b
+    def __hash__(self):
+        return hash( self.digest )
     def __repr__(self):
         return '<CacheInput %s constraint, constraint args %s, shapeElement1 %s, shapeElement2 %s>' % (self.constraintType, self.constraintArgs, self.shapeElement1, self.shapeElement2 )
-    
+
+fingerprintTolerance = 10**-5
+
+def quantize( v, tol=fingerprintTolerance ):
+    'values equal to within tol nearly always quantize to the same integers, values just either side of a rounding boundary do not, which only results in the constraint being resolved'
+    return tuple( int( round( x / tol ) ) for x in v )
+
 class ShapeElementInfo:
+    'sub-element position and axis relative to its object, reduced to a hashable fingerprint'
     def __init__(self, vM, objName, elementName):
         self.objName = objName
         obj = vM.doc.getObject( objName )
-        self.category = classifySubElement( obj, elementName )
-        self.pos =  vM.rotateAndMoveUndo( objName, getSubElementPos( obj, elementName ), vM.X0 )
+        self.category = subElementCategory( obj, elementName )
+        self.pos =  vM.rotateAndMoveUndo( objName, subElementPos( obj, elementName ), vM.X0 )
         if self.category in ['plane','cylindricalSurface','circularEdge','linearEdge']:
-            self.axis =  vM.rotateUndo( objName, getSubElementAxis( obj, elementName ), vM.X0 )
-    def __eq__(self, b, tol = 10 **-5):
-        if self.objName != b.objName:
-            return False
-        if self.category != b.category:
-            return False
-        if norm( self.pos - b.pos ) >= tol:
-            #print( norm( self.pos - b.pos ) )
-            return False
-        if hasattr(self,'axis'):
-            #print( dot( self.axis, b.axis ) )
-            return dot( self.axis, b.axis ) >= 1 - tol
-        else:
-            return True
+            self.axis =  vM.rotateUndo( objName, subElementAxis( obj, elementName ), vM.X0 )
+        self.fingerprint = ( self.objName, self.category, quantize( self.pos ), quantize( self.axis ) if hasattr(self, 'axis') else None )
+    def __eq__(self, b):
+        return self.fingerprint == b.fingerprint
+    def __ne__(self, b):
+        return not self == b
+    def __hash__(self):
+        return hash( self.fingerprint )
     def __str__(self):
         return '<ShapeElementInfo %s, category %s, pos %s, axis %s>' % (self.objName, self.category, self.pos, getattr(self,'axis',None))
 
+class ConstraintSystemSnapshot:
+    '''
+    Records the state of every node in a constraint system tree (including sub-systems and degrees-of-freedom), so that
+    on retrieval the cached nodes can be reset and shared with the new solve, instead of deep-copied.
+
+    When systems are updated, the attributes of nodes and degrees-of-freedom are reassigned rather than modified in-place
+    (for example AxisRotationDegreeOfFreedom.setAxis and LinearMotionDegreeOfFreedom.setDirection), so a shallow copy of each
+    objects __dict__ is sufficient, with the attribute values (numpy arrays, dof lists, ...) shared between the snapshot and the live objects.
+    '''
+    def __init__( self, sys ):
+        tree = [ sys ]
+        while tree[0].parentSystem != None:
+            tree.insert(0, tree[0].parentSystem)
+        self.tree = tree
+        self.levels = [] # self.levels[k] objects first reached from tree[k], with there recorded states
+        recorded = set()
+        for node in tree:
+            level = []
+            self.record( node, recorded, level )
+            self.levels.append( level )
 
+    def record( self, obj, recorded, level ):
+        recorded.add( id(obj) )
+        level.append( ( obj, dict( obj.__dict__ ) ) )
+        for attr_name, attr in obj.__dict__.items():
+            if attr_name == 'childSystem':
+                continue
+            for item in ( attr if isinstance( attr, list ) else [ attr ] ):
+                if ( hasattr( item, 'variableManager' ) or hasattr( item, 'vM' ) ) and not id(item) in recorded:
+                    self.record( item, recorded, level )
+
+    def restore( self, level, new_vM ):
+        'resets the nodes up to and including tree[level] to there recorded states, pointing them to new_vM. Returns tree[level]'
+        for objects in self.levels[ :level+1 ]:
+            for obj, state in objects:
+                obj.__dict__.clear()
+                obj.__dict__.update( state )
+                if 'variableManager' in state:
+                    obj.variableManager = new_vM
+                if hasattr( obj, 'migrate_to_new_variableManager' ):
+                    obj.migrate_to_new_variableManager( new_vM )
+        return self.tree[ level ]
 
-#copied and pasted from importPart
-class _SelectionWrapper:
-    'as to interface with assembly2lib classification functions'
-    def __init__(self, obj, subElementName):
-        assert obj != None
-        self.Object = obj
-        self.SubElementNames = [subElementName]
-def classifySubElement(  obj, subElementName ):
-    selection = _SelectionWrapper( obj, subElementName )
-    if planeSelected( selection ):
-        return 'plane'
-    elif cylindricalPlaneSelected( selection ):
-        return 'cylindricalSurface'
-    elif CircularEdgeSelected( selection ):
-        return 'circularEdge'
-    elif LinearEdgeSelected( selection ):
-        return 'linearEdge'
-    elif vertexSelected( selection ):
-        return 'vertex' #all vertex belong to Vertex classification
-    elif sphericalSurfaceSelected( selection ):
-        return 'sphericalSurface'
-    else:
-        return 'other'
-#/copy
 
 def copy_constraint_system( sys ):
     #preparing for copy
@@ -187,22 +451,22 @@ def copy_constraint_system( sys ):
     try:
         new_sys = copy.deepcopy( sys)
     except RuntimeError as msg:
-        debugPrint(1, '******** cache copy error: %s' % msg)
+        debugPrint( 1, '******** cache copy error: %s', msg )
         debugPrint(1,'trying to determine were the object causing the crash is')
         for node in tree:
             for attr_name in node.__dict__.keys():
                 attr =  getattr(node,attr_name)
                 if str( type( attr ) ) == "<type 'FeaturePython'>":
-                    debugPrint(1,"  %s.%s is <type 'FeaturePython'>" % (node,attr_name))
+                    debugPrint( 1, "  %s.%s is <type 'FeaturePython'>", node, attr_name )
                 if str(type(attr)) == "<type 'App.Document'>":
-                    debugPrint(1,"  %s.%s is <type 'App.Document'>" % (node,attr_name))
+                    debugPrint( 1, "  %s.%s is <type 'App.Document'>", node, attr_name )
                 if hasattr(attr,'__dict__'):
                     for sub_attr_name in attr.__dict__.keys():
                         sub_attr =  getattr(attr,sub_attr_name)
                         if str( type( sub_attr ) ) == "<type 'FeaturePython'>":
-                            debugPrint(1,"  %s.%s.%s is <type 'FeaturePython'>" % (node, attr_name, sub_attr_name ))
+                            debugPrint( 1, "  %s.%s.%s is <type 'FeaturePython'>", node, attr_name, sub_attr_name )
                         if str( type( sub_attr ) ) == "<type 'App.Document'>":
-                            debugPrint(1,"  %s.%s.%s is <type 'App.Document'>" % (node, attr_name, sub_attr_name ))
+                            debugPrint( 1, "  %s.%s.%s is <type 'App.Document'>", node, attr_name, sub_attr_name )
         raise NotImplementedError
     #readding removed objects to both sys and new sys
     sys.variableManager.doc = doc
@@ -221,7 +485,7 @@ def copy_constraint_system( sys ):
 def update_variableManagers( obj, new_vM, history ): #vanurable to circular references ...
     history.add( id(obj) )
     if hasattr(obj, 'variableManager'):
-        #debugPrint(4, '  %s.variableManager set to new vM' % str(obj) )
+        #debugPrint( 4, '  %s.variableManager set to new vM', str(obj) )
         obj.variableManager = new_vM
     for attr_name in obj.__dict__.keys():
         attr =  getattr(obj, attr_name)
@@ -237,4 +501,5 @@ def update_variableManagers( obj, new_vM, history ): #vanurable to circular refe
                 history.add( id(d) )
 
 
-defaultCache = SolverCache()
+defaultCacheManager = SolverCacheManager( SolverCache )
+defaultComponentsCacheManager = SolverCacheManager( ComponentsCache )
@@ -0,0 +1,180 @@
+'''
+Splitting an assembly into independent sub-assemblies (components) prior to solving.
+
+Parts are linked by the constraints between them, except via parts with a fixed position.
+Since fixed parts never move, parts which are only linked through a fixed base can be solved separately.
+Each component is solved as its own heirachical constraint system, so that the depth of the system heirachy
+(and therefore the cost of the update() cascades) grows with the component size instead of with the assembly size.
+
+Components can be solved in a worker process pool. Since FreeCAD documents cannot be pickled,
+this requires the workers to be forked from the current process, and is therefore not available on Windows.
+Forking is also not done when the FreeCAD GUI is running, as a forked copy of a Qt application is not safe to use.
+'''
+
+from assembly2.core import debugPrint, QtGui
+from assembly2.solvers.common import findBaseObject
+from .constraintSystems import *
+from . import profiler as profilerLib
+import os
+
+
+def constraintComponents( doc, constraintObjectQue ):
+    '''
+    returns a list of (objectNames, constraintObjects) for each independent component.
+    The order of doc.Objects is preserved for both the components and the constraints within each component.
+    Constraints between two fixed objects are grouped into a component of their own.
+    '''
+    parent = {}
+    fixed = {}
+    def root( objName ):
+        while parent[objName] != objName:
+            parent[objName] = parent[ parent[objName] ]
+            objName = parent[objName]
+        return objName
+    for c in constraintObjectQue:
+        for objName in [ c.Object1, c.Object2 ]:
+            if not objName in parent:
+                parent[objName] = objName
+                fixed[objName] = getattr( doc.getObject(objName), 'fixedPosition', False )
+    for c in constraintObjectQue:
+        if not fixed[c.Object1] and not fixed[c.Object2]:
+            parent[ root(c.Object1) ] = root(c.Object2)
+    keys = []
+    components = {}
+    for c in constraintObjectQue:
+        if not fixed[c.Object1]:
+            key = root(c.Object1)
+        elif not fixed[c.Object2]:
+            key = root(c.Object2)
+        else:
+            key = None
+        if not key in components:
+            keys.append(key)
+            components[key] = ( [], [] )
+        objectNames, constraints = components[key]
+        for objName in [ c.Object1, c.Object2 ]:
+            if not objName in objectNames:
+                objectNames.append( objName )
+        constraints.append( c )
+    return [ components[key] for key in keys ]
+
+
+def solveComponent( variableManager, objectNames, constraintObjectQue, printErrors=True, cache=None, loopClosure=False ):
+    '''
+    cache - optional SolverCache for this component, from which the solution for the unchanged constraints at the start of constraintObjectQue is reused.
+    returns constraintSystem, failedConstraint
+    '''
+    constraintSystem = FixedObjectSystem( variableManager, findBaseObject( variableManager.doc, objectNames ) )
+    if cache == None:
+        return addConstraints( constraintSystem, variableManager, constraintObjectQue, printErrors, loopClosure=loopClosure )
+    with profilerLib.span( 'retrieve', 'cache' ):
+        constraintSystem, que_start = cache.retrieve( constraintSystem, constraintObjectQue, objectNames )
+    debugPrint( 3, "~cached solution available for first %i out-off %i constraints of component", que_start, len(constraintObjectQue) )
+    cache.prepare()
+    constraintSystem, failedConstraint = addConstraints( constraintSystem, variableManager, constraintObjectQue[que_start:], printErrors, record=cache.record, loopClosure=loopClosure )
+    if failedConstraint == None:
+        with profilerLib.span( 'commit', 'cache' ):
+            cache.commit( constraintSystem, constraintObjectQue, que_start )
+    return constraintSystem, failedConstraint
+
+
+class ComponentSystems:
+    '''
+    result of solving each component of an assembly separately.
+    Offers the parts of the constraint system interface used on solver results ( variableManager, degreesOfFreedom, update, ...).
+    If the components where solved in worker processes, the systems and therefore degreesOfFreedom are not available,
+    only degreesOfFreedomCount (the number of degrees-of-freedom reported by the workers).
+    '''
+    def __init__( self, variableManager, systems, degreesOfFreedomCount=None ):
+        self.variableManager = variableManager
+        self.systems = systems
+        self.parentSystem = None
+        if degreesOfFreedomCount == None:
+            self.degreesOfFreedom = sum( [ s.degreesOfFreedom for s in systems ], [] )
+            self.degreesOfFreedomCount = len( self.degreesOfFreedom )
+        else:
+            self.degreesOfFreedomCount = degreesOfFreedomCount
+    def containtsObject( self, objName ):
+        return any( s.containtsObject( objName ) for s in self.systems )
+    def update( self ):
+        for s in self.systems:
+            s.update()
+    def str( self, indent='', addDOFs=False ):
+        txt = '%s<ComponentSystems %i components>' % ( indent, len(self.systems) )
+        if addDOFs:
+            txt = txt + ' %i degrees of freedom' % self.degreesOfFreedomCount
+        return txt
+    def strSystemTree( self, dofs=True ):
+        return '\n'.join( [ self.str() ] + [ s.strSystemTree( dofs ) for s in self.systems ] )
+
+
+_worker_args = None #set before forking the worker processes, as FreeCAD documents cannot be pickled
+
+def _solveComponent_worker( i ):
+    doc, components, printErrors, variableManager_class, loopClosure = _worker_args
+    objectNames, constraintObjectQue = components[i]
+    variableManager = variableManager_class( doc, objectNames )
+    constraintSystem, failedConstraint = solveComponent( variableManager, objectNames, constraintObjectQue, printErrors, loopClosure=loopClosure )
+    if failedConstraint != None:
+        return None, None, failedConstraint.Name
+    X_component = dict( ( objName, variableManager.placementVariables( objName, variableManager.X ) ) for objName in variableManager.index )
+    return X_component, len( constraintSystem.degreesOfFreedom ), None
+
+def forkedProcessPool( processes ):
+    'returns None if worker processes cannot be forked on this platform'
+    if not hasattr( os, 'fork' ):
+        return None
+    import multiprocessing
+    if hasattr( multiprocessing, 'get_context' ):
+        return multiprocessing.get_context('fork').Pool( processes )
+    return multiprocessing.Pool( processes ) #python2, fork is used on posix
+
+def solveComponents( doc, variableManager, components, printErrors=True, processes=1, cache=None, loopClosure=False ):
+    '''
+    solve each component, writing the results into variableManager.X.
+    processes > 1, solve components in parallel using a forked worker pool. In which case the constraint systems stay in the worker processes,
+    and the ComponentSystems returned only contains the placement variables and the number of degrees of freedom (see ComponentSystems).
+    Not done when the FreeCAD GUI is running, or with a cache.
+    cache - optional ComponentsCache, in which case the components are solved serially, as the cached systems are held by this process.
+    returns ComponentSystems, failedConstraint
+    '''
+    global _worker_args
+    pool = None
+    if processes > 1 and len(components) > 1:
+        if cache != None:
+            debugPrint( 2, 'solving components serially, as the cached constraint systems are held by this process (use_cache)' )
+        elif QtGui.qApp != None:
+            debugPrint( 2, 'solving components serially, as worker processes are not forked while the FreeCAD GUI is running' )
+        else:
+            _worker_args = doc, components, printErrors, variableManager.__class__, loopClosure #set before forking, so that the workers inherit them
+            pool = forkedProcessPool( min(processes, len(components)) )
+            if pool == None:
+                debugPrint( 2, 'solving components serially, as worker processes cannot be forked on this platform' )
+    if pool == None:
+        _worker_args = None
+        systems = []
+        if cache != None:
+            cache.prepare()
+        for objectNames, constraintObjectQue in components:
+            componentCache = cache.componentCache( constraintObjectQue ) if cache != None else None
+            constraintSystem, failedConstraint = solveComponent( variableManager, objectNames, constraintObjectQue, printErrors, componentCache, loopClosure )
+            if failedConstraint != None:
+                return None, failedConstraint
+            systems.append( constraintSystem )
+        if cache != None:
+            cache.commit()
+        return ComponentSystems( variableManager, systems ), None
+    try:
+        results = pool.map( _solveComponent_worker, range(len(components)) )
+    finally:
+        pool.close()
+        pool.join()
+        _worker_args = None
+    degreesOfFreedomCount = 0
+    for ( objectNames, constraintObjectQue ), ( X_component, componentDegreesOfFreedom, failedConstraintName ) in zip( components, results ):
+        if failedConstraintName != None:
+            return None, [ c for c in constraintObjectQue if c.Name == failedConstraintName ][0]
+        for objName, values in X_component.items():
+            variableManager.setPlacementVariables( objName, variableManager.X, values )
+        degreesOfFreedomCount += componentDegreesOfFreedom
+    return ComponentSystems( variableManager, [], degreesOfFreedomCount ), None
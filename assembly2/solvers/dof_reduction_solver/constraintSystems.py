@@ -24,11 +24,14 @@ see Assembly2/docs folder for more.
 from assembly2.core import *
 from assembly2.lib3D import *
 from assembly2.selection import *
+from assembly2.solvers.common import subElementPos, subElementAxis
 import numpy
 from numpy import pi, inf
 from numpy.linalg import norm
 from .solverLib import *
 from .degreesOfFreedom import *
+from . import profiler as profilerLib
+from .loops import loopObjects, LoopClosureEquations, independentColumns, residualSizes
 
 class Assembly2SolverError(Exception):
     def __init__(self, value):
@@ -36,14 +39,21 @@ class Assembly2SolverError(Exception):
     def __str__(self):
         return self.parameter
 
-#debugPrint, replaced to reduce overhead
-def dp( msg ):
-    FreeCAD.Console.PrintMessage(msg + '\n')
-# debugPrint(2, msg)   ----> if debugPrint.level >= 2: dp(msg) 
+#hot code, guard debugPrint so that the arguments are only evaluated if the message is printed (or traced)
+# debugPrint(2, msg, args)   ----> if debugPrint.guard >= 2: debugPrint(2, msg, args)
+
+updateStats = { 'updates':0, 'skipped':0 } #update() calls of constraint systems, and how many of them where skipped due to updateMemoization
+solutionStats = { 'analytical':0, 'numerical':0 } #how the constraint equations where solved in solveConstraintEq
+gradientCheckStats = { 'checks':0, 'failures':0 } #comparisons of constraintEq_grad against central differences, see analyticalGradientCheck
 
 class ConstraintSystemPrototype:
     label = '' #over-ride in inheritence
     solveConstraintEq_tol = 10**-9
+    updateMemoization = True #skip update() if the placement variables of the objects in the system have not changed since the last update
+    analyticalGradient = True #use constraintEq_grad instead of a gradient approximator when solving numerically
+    analyticalGradientCheck = False #if True, analytical gradients are compared against central differences and discrepancies printed
+    numericalSolver = 'newton' #or 'newton_broyden', 'levenberg_marquardt'; used when no analytical solution is available, see solverLib
+    numericalDegreesOfFreedom = 'trial' #or 'null_space'; how generateDegreesOfFreedomNumerically reduces the degrees-of-freedom
     def __init__(self, parentSystem, variableManager, constraintObj, constraintValue ):
         self.parentSystem = parentSystem
         self.variableManager = variableManager
@@ -72,10 +82,10 @@ class ConstraintSystemPrototype:
                 self.sys2 = FreeObjectSystem( variableManager, sys2ObjName )
         else:
             self.sys2 = EmptySystem()
-        if debugPrint.level >= 4: dp('%s - sys2 %s' % (self.label, self.sys2.str() ) )
+        if debugPrint.guard >= 4: debugPrint( 4, '%s - sys2 %s', self.label, self.sys2.str() )
         self.init2()
         self.solveConstraintEq()      
-        if debugPrint.level >= 3 : dp('  resulting system:\n%s' % self.str(indent=' '*4, addDOFs=debugPrint.level>3))
+        if debugPrint.guard >= 3: debugPrint( 3, '  resulting system:\n%s', self.str(indent=' '*4, addDOFs=debugPrint.level>3) )
         
     def init2(self):
         pass
@@ -91,39 +101,53 @@ class ConstraintSystemPrototype:
     def solveConstraintEq( self ):
         tol = self.solveConstraintEq_tol
         PLO = 0 if not self.childSystem else 1 #print level offset
+        profiler = profilerLib.active
+        if profiler is not None:
+            profiler.begin( self.constraintObj.Name, 'solveConstraintEq', system=self.label, objects=[ self.obj1Name, self.obj2Name ] )
         if abs( self.constraintEq_value( self.variableManager.X) ) > tol: #constraint violated
-            self.solveConstraintEq_dofs = [ d for d in self.parentSystem.degreesOfFreedom + self.sys2.degreesOfFreedom  if not getattr(d,'locked',False) ]
+            self.solveConstraintEq_dofs = self.constraintEq_dofs()
             if len(self.solveConstraintEq_dofs) == 0: 
                 raise Assembly2SolverError("%s no degrees-of-freedom to adjust to satify constraints:\n%s" % (self.str(), self.strSystemTree()))
             else:
                 if self.analyticalSolution(): #if analytical solution then will update X
                 #if False:
+                    solutionStats['analytical'] += 1
+                    if profiler is not None: profiler.annotate( solution='analytical' )
                     #self.analyticalSolution() #forcing analytical solution to run twice as to decrease numerical error
                     if abs( self.constraintEq_value(self.variableManager.X) ) > tol:
-                        if debugPrint.level >= 4+PLO: dp('  **numerical round off error in analytical solution repeating')
+                        if debugPrint.guard >= 4+PLO: debugPrint( 4+PLO, '  **numerical round off error in analytical solution repeating' )
                         self.analyticalSolution()
                 else: #numerical solution
+                    solutionStats['numerical'] += 1
+                    if profiler is not None: profiler.annotate( solution='numerical' )
                     Y0 =      [ d.getValue() for d in self.solveConstraintEq_dofs ]
-                    if debugPrint.level >= 4+PLO: dp('%s: attempting to find solution numerically' % (self.str()))
-                    yOpt = solve_via_Newtons_method( 
-                        self.constraintEq_f, 
-                        Y0, #Y0, 
-                        [ d.maxStep() for d in self.solveConstraintEq_dofs ], #maxStep, while not really, more like recommended max step...
+                    if debugPrint.guard >= 4+PLO: debugPrint( 4+PLO, '%s: attempting to find solution numerically', self.str() )
+                    solverArgs = dict(
+                        grad_f = self.constraintEq_grad if self.analyticalGradient else None,
                         f_tol=tol, 
                         x_tol=0, 
                         maxIt=42, 
-                        randomPertubationCount=2, 
-                        lineSearchIt=10,
                         debugPrintLevel=debugPrint.level-2-PLO, 
                         printF= lambda txt: debugPrint(2, txt ),
-                        record = not self.childSystem #only record top level optimization.
+                        record = not self.childSystem or profiler is not None #only record top level optimization, unless profiling
+                        )
+                    if self.numericalSolver == 'levenberg_marquardt':
+                        solver = solve_via_levenberg_marquardt
+                    else:
+                        solver = solve_via_Newtons_method
+                        solverArgs.update( randomPertubationCount=2, lineSearchIt=10, broydenUpdates = self.numericalSolver == 'newton_broyden' )
+                    yOpt = solver( 
+                        self.constraintEq_f, 
+                        Y0, #Y0, 
+                        [ d.maxStep() for d in self.solveConstraintEq_dofs ], #maxStep, while not really, more like recommended max step...
+                        **solverArgs
                         )
                     self.constraintEq_setY(yOpt) #this will automatically update X
             if abs( self.constraintEq_value(self.variableManager.X) ) > tol:
                 raise Assembly2SolverError("%s abs( self.constraintEq_value(self.X) ) > tol [%e > %e]. Constraint Tree:\n%s" % (self.str(), abs( self.constraintEq_value(self.variableManager.X) ), tol, self.strSystemTree()))
         else:
             pass
-            #debugPrint(4+PLO, '    solveConstraintEq for %s already satisfied, neither numerical or analytical solution required' % self.str())
+            #debugPrint( 4+PLO, '    solveConstraintEq for %s already satisfied, neither numerical or analytical solution required', self.str() )
         if not hasattr( self, 'degreesOfFreedom' ):
             self.dof_updated_analytically = self.generateDegreesOfFreedomAnalytically( ) #Analytical, as in preprogrammed  solution available.
             if not self.dof_updated_analytically:
@@ -133,6 +157,12 @@ class ConstraintSystemPrototype:
                 self.updateDegreesOfFreedomAnalytically( )
             else:
                 self.updateDegreesOfFreedomNumerically( )
+        if profiler is not None:
+            profiler.end( dofs_analytical=self.dof_updated_analytically )
+
+    def constraintEq_dofs( self ):
+        'the degrees-of-freedom adjusted by solveConstraintEq to satisfy the constraint'
+        return [ d for d in self.parentSystem.degreesOfFreedom + self.sys2.degreesOfFreedom  if not getattr(d,'locked',False) ]
 
     def constraintEq_setY(self, Y):
         for d,y in zip( self.solveConstraintEq_dofs, Y):
@@ -141,20 +171,118 @@ class ConstraintSystemPrototype:
         self.sys2.update()
 
     def update(self):
+        vM = self.variableManager
+        memo = getattr( self, 'updateMemo', None ) if self.updateMemoization else None
+        if memo != None and memo[0] is vM and numpy.array_equal( vM.X[memo[1]], memo[2] ):
+            updateStats['skipped'] += 1
+            return
+        updateStats['updates'] += 1
+        profiler = profilerLib.active
+        if profiler is not None:
+            profiler.updateStarted()
         if self.parentSystem != None:
             self.parentSystem.update()
         self.solveConstraintEq()  
+        if profiler is not None:
+            profiler.updateFinished()
+        if self.updateMemoization:
+            inds = memo[1] if memo != None and memo[0] is vM else self.updateMemo_indexes()
+            self.updateMemo = ( vM, inds, vM.X[inds] )
+
+    def updateMemo_indexes( self ):
+        '''
+        indexes of the placement variables of all objects in the system.
+        The solution of a system (and of its parent systems) only depends on these placement variables,
+        so that update() only needs to be repeated if one of them has changed.
+        '''
+        objectNames = set()
+        sys = self
+        while sys != None:
+            for attr in [ 'obj1Name', 'obj2Name', 'objName' ]:
+                if hasattr( sys, attr ):
+                    objectNames.add( getattr( sys, attr ) )
+            sys = sys.parentSystem
+        index = self.variableManager.index
+        return numpy.array( sorted( index[objName] + j for objName in objectNames for j in range(6) ), dtype=int )
 
     def constraintEq_f( self, Y ):
         #print(self.variableManager.X)
         self.constraintEq_setY(Y)
         f_X = self.constraintEq_value(self.variableManager.X)
         PLO = 0 if not self.childSystem else 1 #print level offset
-        if debugPrint.level >= 6+PLO: dp('constraintEq_f, X %s, f(X) %s' % (self.variableManager.X,f_X))
+        if debugPrint.guard >= 6+PLO: debugPrint( 6+PLO, 'constraintEq_f, X %s, f(X) %s', self.variableManager.X, f_X )
         return f_X
     def constraintEq_value( self, X ):
         raise Assembly2SolverError('ConstraintSystemPrototype not supposed to be called directly')
 
+    def constraintEq_derivative( self, X, objName, v, w ):
+        '''
+        derivative of constraintEq_value when objName is moved with a linear velocity v and
+        an angular velocity w (rotation about objName's placement base), see degreesOfFreedom motionVectors.
+        '''
+        raise Assembly2SolverError('ConstraintSystemPrototype not supposed to be called directly')
+
+    def constraintEq_grad( self, Y ):
+        '''
+        gradient of constraintEq_f at Y. Entries for dofs acting on obj1 or obj2 are determined analytically, provided that the
+        parentSystem.update() cascade does not move obj1 or obj2 as well (see constraintEq_analyticalDofs).
+        Otherwise, and for the remaining dofs which only influence the constraint value via parentSystem.update(), central differences are used.
+        '''
+        self.constraintEq_setY(Y)
+        Y = numpy.array(Y, dtype=float)
+        analyticalDofs = self.constraintEq_analyticalDofs( Y )
+        X = self.variableManager.X.copy()
+        eps = 10**-6
+        grad = numpy.zeros( len(Y) )
+        numeric_inds = []
+        for j, ( d, analytical ) in enumerate( zip( self.solveConstraintEq_dofs, analyticalDofs ) ):
+            if analytical:
+                v, w = d.motionVectors()
+                grad[j] = self.constraintEq_derivative( X, d.objName, v, w )
+            else:
+                numeric_inds.append(j)
+        for j in numeric_inds:
+            grad[j] = ( self.constraintEq_f( addEps(Y, j, eps) ) - self.constraintEq_f( addEps(Y, j, -eps) ) ) / (2*eps)
+        if self.analyticalGradientCheck and abs( self.constraintEq_f(Y) ) > 10**-4: #close to zero the central differences of norm based values (i.e. VertexUnion) are unreliable
+            grad_cd = GradientApproximatorCentralDifference( self.constraintEq_f )( Y )
+            error = abs(grad - grad_cd).max()
+            gradientCheckStats['checks'] += 1
+            if error > 10**-4 * max( 1, abs(grad_cd).max() ):
+                gradientCheckStats['failures'] += 1
+                debugPrint( 0, '%s analytical gradient check failed, max error %e:\n  analytical %s\n  central difference %s', self.str(), error, grad, grad_cd )
+            elif debugPrint.guard >= 4:
+                debugPrint( 4, '%s analytical gradient check passed, max error %e', self.str(), error )
+            self.constraintEq_setY(Y)
+        self.constraintEq_grad_last = ( self.solveConstraintEq_dofs, numpy.array(Y, dtype=float), grad ) #reused by generateDegreesOfFreedomNullSpace
+        return grad
+
+    def constraintEq_analyticalDofs( self, Y ):
+        '''
+        for each of the solveConstraintEq_dofs, True if its entry in constraintEq_grad can be determined analytically, i.e. the dof acts on obj1 or obj2
+        and parentSystem.update() does not move obj1 or obj2 further when the dof is changed. Since sys2 is a fixed or free object system,
+        sys2.update() never moves them. Worked out once for each set of solveConstraintEq_dofs, by perturbing the parent system dofs at Y.
+        '''
+        memo = getattr( self, 'analyticalDofs_memo', None )
+        if memo != None and memo[0] is self.solveConstraintEq_dofs:
+            return memo[1]
+        vM = self.variableManager
+        objInds = numpy.array([ vM.index[objName] + i for objName in [ self.obj1Name, self.obj2Name ] for i in range(6) ])
+        parentDofs = self.parentSystem.degreesOfFreedom
+        analyticalDofs = []
+        for j, d in enumerate( self.solveConstraintEq_dofs ):
+            if d.objName != self.obj1Name and d.objName != self.obj2Name:
+                analyticalDofs.append( False )
+            elif not any( d is d_p for d_p in parentDofs ):
+                analyticalDofs.append( True )
+            else:
+                d.setValue( Y[j] + 10**-6 )
+                X_obj = vM.X[objInds].copy()
+                self.parentSystem.update()
+                analyticalDofs.append( numpy.array_equal( vM.X[objInds], X_obj ) )
+                self.constraintEq_setY( Y )
+        self.analyticalDofs_memo = ( self.solveConstraintEq_dofs, analyticalDofs )
+        return analyticalDofs
+
     def analyticalSolution(self):
         return False
 
@@ -166,11 +294,11 @@ class ConstraintSystemPrototype:
 
     def getPos(self, objName, subElement):
         obj =  self.variableManager.doc.getObject( objName )
-        return getSubElementPos(obj, subElement)
+        return subElementPos(obj, subElement)
 
     def getAxis(self, objName, subElement):
         obj =  self.variableManager.doc.getObject( objName )
-        return getSubElementAxis(obj, subElement)
+        return subElementAxis(obj, subElement)
 
     def str(self, indent='', addDOFs=False):
         txt = '%s<%s System %s:%s-%s:%s heirachy %i>' % (indent, self.label, self.obj1Name, self.subElement1, self.obj2Name, self.subElement2, self.numberOfParentSystems())
@@ -200,7 +328,9 @@ class ConstraintSystemPrototype:
         return txt
 
     def generateDegreesOfFreedomNumerically(self ):
-        if debugPrint.level >= 4: dp('  attempting to generate new degrees-of-freedom numerically')
+        if debugPrint.guard >= 4: debugPrint( 4, '  attempting to generate new degrees-of-freedom numerically' )
+        if self.numericalDegreesOfFreedom == 'null_space':
+            return self.generateDegreesOfFreedomNullSpace()
         D = self.parentSystem.degreesOfFreedom + self.sys2.degreesOfFreedom
         self.solveConstraintEq_dofs = D #if not d.assignedValue check unnessary as generateDegreesOfFreedomNumerically is only called on top level
         if len(D) == 0:
@@ -211,42 +341,47 @@ class ConstraintSystemPrototype:
             X_org = self.variableManager.X.copy()
             yOpt = [ d.getValue() for d in self.solveConstraintEq_dofs ] #values update in solve equation.
             df_dy = GradientApproximatorForwardDifference(self.constraintEq_f)(numpy.array(yOpt))
-            #debugPrint(5, '  df_dy == %s' % str(df_dy))
+            #debugPrint( 5, '  df_dy == %s', str(df_dy) )
             self.variableManager.X = X_org.copy()
             if all(df_dy == 0):
-                if debugPrint.level >= 4: dp('  generateDegreesOfFreedomNumerically, all(df_dy == 0), so assuming constraint is reduntant.')
+                if debugPrint.guard >= 4: debugPrint( 4, '  generateDegreesOfFreedomNumerically, all(df_dy == 0), so assuming constraint is reduntant.' )
                 self.generateDegreesOfFreedomNumerically_case = 0
                 self.degreesOfFreedom = D
                 return
             else:
                 removeInd = None
                 if len(df_dy) - sum(df_dy == 0) == 1:
-                    if debugPrint.level >= 4: dp('  generateDegreesOfFreedomNumerically, len(df_dy) - sum(df_dy == 0) == 1, removing dof with gradient != 0')
+                    if debugPrint.guard >= 4: debugPrint( 4, '  generateDegreesOfFreedomNumerically, len(df_dy) - sum(df_dy == 0) == 1, removing dof with gradient != 0' )
                     removeInd = list(df_dy == 0).index(False)
                 elif len(df_dy) - sum(abs(df_dy) < max(abs(df_dy))*1e-6) == 1:
-                    if debugPrint.level >= 4: dp('  generateDegreesOfFreedomNumerically, len(df_dy) - sum(abs(df_dy) < max(abs(df_dy))*1e-6) == 1, removing dof with largest gradient')
+                    if debugPrint.guard >= 4: debugPrint( 4, '  generateDegreesOfFreedomNumerically, len(df_dy) - sum(abs(df_dy) < max(abs(df_dy))*1e-6) == 1, removing dof with largest gradient' )
                     removeInd = list( abs(df_dy) == max(abs(df_dy)) ).index(True)
                 if removeInd != None:
                     self.generateDegreesOfFreedomNumerically_case = 0
-                    if debugPrint.level >= 4: dp('    removing %s' % D[removeInd])
+                    if debugPrint.guard >= 4: debugPrint( 4, '    removing %s', D[removeInd] )
                     self.degreesOfFreedom = [ d for i,d in enumerate(D) if i != removeInd ]
                     return
                 else:
-                     if debugPrint.level >= 4: dp('  generateDegreesOfFreedomNumerically, trivial reductions failed; attempting to determine non-perfect DOF by trail and error.')
+                     if debugPrint.guard >= 4: debugPrint( 4, '  generateDegreesOfFreedomNumerically, trivial reductions failed; attempting to determine non-perfect DOF by trail and error.' )
                      active_D = [ d for d, df_dy_i in zip(self.solveConstraintEq_dofs,df_dy) if abs(df_dy_i) > 1e-6 ]
                      dormant_D = [ d for d, df_dy_i in zip(self.solveConstraintEq_dofs,df_dy) if abs(df_dy_i) <= 1e-6 ]
-                     if debugPrint.level >= 4: dp('    len(active_D) %i, len(dormant_D) %i' % (len(active_D),len((dormant_D))))
+                     if debugPrint.guard >= 4: debugPrint( 4, '    len(active_D) %i, len(dormant_D) %i', len(active_D), len((dormant_D)) )
                      self.degreesOfFreedom = [] #prevent coming solve calls from entering this function agoin
                      self.generateDegreesOfFreedomNumerically_case = 0 # "
+                     lockedDormant_D = dormant_D if self.variableManager.lockDormantDofs else []
+                     for d in lockedDormant_D: #dormant DOFs are passed through, so do not let them satisfy the constraint during the trails
+                         d.locked = True
                      for i in range(len(active_D)):
                          active_D[i].setValue( active_D[i].getValue() + 0.1 ) #delta = 0.1
                          active_D[i].locked = True
                          try:
                              self.solveConstraintEq()
                          except Assembly2SolverError:
-                             if debugPrint.level >= 4: dp('unable to solve system after the locking the first %i DOFs, therefore passing through %i/%i of active_DOF' % (i+1,i,len(active_D)))
+                             if debugPrint.guard >= 4: debugPrint( 4, 'unable to solve system after the locking the first %i DOFs, therefore passing through %i/%i of active_DOF', i+1, i, len(active_D) )
                              for j in range(i+1):
                                  active_D[i].locked = False
+                             for d in lockedDormant_D:
+                                 d.locked = False
                              self.variableManager.X = X_org
                              self.degreesOfFreedom = active_D[:i] + dormant_D
                              return 
@@ -254,6 +389,54 @@ class ConstraintSystemPrototype:
                 
         raise NotImplementedError('generateDegreesOfFreedomNumerically Logic not programmed for the reduction of degrees of freedom with df_dy=%s, self.solveConstraintEq_dofs:\n%s' % (df_dy,'\n'.join(d.str('  ') for d in self.solveConstraintEq_dofs )))
 
+    def generateDegreesOfFreedomNullSpace( self ):
+        '''
+        the new degrees-of-freedom span the null space of the constraint equation's jacobian (with respect to the parent dofs, scaled by their maxSteps), determined by SVD.
+        Dofs not influencing the constraint are passed through, and null space directions along a single dof reuse that dof;
+        the other directions become NullSpaceDegreeOfFreedom's (or LinearMotionDegreeOfFreedom's when only translating one object).
+        The jacobian of the last numerical solve (see constraintEq_grad) is reused if it was evaluated for these dofs near their current values.
+        '''
+        D = self.parentSystem.degreesOfFreedom + self.sys2.degreesOfFreedom
+        self.generateDegreesOfFreedomNumerically_case = 0
+        if len(D) == 0:
+            self.degreesOfFreedom = D
+            return
+        Y = numpy.array([ d.getValue() for d in D ])
+        maxStep = numpy.array([ d.maxStep() for d in D ])
+        last = getattr( self, 'constraintEq_grad_last', None )
+        if last != None and last[0] == D and abs( ( last[1] - Y ) / maxStep ).max() < 10**-2:
+            if debugPrint.guard >= 4: debugPrint( 4, '  generateDegreesOfFreedomNullSpace, reusing the jacobian of the last numerical solve' )
+            J = last[2]
+        else:
+            X_org = self.variableManager.X.copy()
+            self.solveConstraintEq_dofs = D
+            J = self.constraintEq_grad( Y ) if self.analyticalGradient else GradientApproximatorCentralDifference( self.constraintEq_f )( Y )
+            self.variableManager.X = X_org
+        if hasattr( self, 'constraintEq_grad_last' ):
+            del self.constraintEq_grad_last #only valid for the solve it was recorded in
+        J_scaled = numpy.atleast_2d( J ) * maxStep
+        J_max = abs( J_scaled ).max()
+        active = [ j for j in range(len(D)) if J_max > 0 and abs( J_scaled[:,j] ).max() > 10**-6 * J_max ]
+        self.degreesOfFreedom = [ d for j, d in enumerate(D) if not j in active ]
+        if len(active) == 0:
+            if debugPrint.guard >= 4: debugPrint( 4, '  generateDegreesOfFreedomNullSpace, jacobian == 0, so assuming constraint is reduntant.' )
+            return
+        N = nullSpace( J_scaled[:,active] )
+        if debugPrint.guard >= 4: debugPrint( 4, '  generateDegreesOfFreedomNullSpace, %i dofs influence the constraint, null space dimension %i', len(active), N.shape[1] )
+        for n in N.transpose():
+            n[ abs(n) < 10**-12 ] = 0
+            dofs = [ D[j] for j, c in zip( active, n ) if c != 0 ]
+            direction = [ c * maxStep[j] for j, c in zip( active, n ) if c != 0 ]
+            if len(dofs) == 1:
+                self.degreesOfFreedom.append( dofs[0] )
+            elif len( set( d.objName for d in dofs ) ) == 1 and not any( d.rotational() for d in dofs ):
+                d = LinearMotionDegreeOfFreedom( self, dofs[0].objName )
+                d.setDirection( normalize( sum( c * m.motionVectors()[0] for m, c in zip( dofs, direction ) ) ) )
+                self.degreesOfFreedom.append( d )
+            else:
+                self.degreesOfFreedom.append( NullSpaceDegreeOfFreedom( self, dofs, direction ) )
+        if debugPrint.guard >= 4: debugPrint( 4, '  resulting degrees-of-freedom:\n%s', '\n'.join( d.str('    ') for d in self.degreesOfFreedom ) )
+
     def updateDegreesOfFreedomNumerically( self ):
         if self.generateDegreesOfFreedomNumerically_case == 0:
             return 
@@ -307,7 +490,7 @@ class AxisAlignmentUnion(ConstraintSystemPrototype):
         #get rotation r(relative) to objects initial placement.
         self.a1_r = vM.rotateUndo( self.obj1Name, self.getAxis(self.obj1Name, self.subElement1), vM.X0 )
         self.a2_r = vM.rotateUndo( self.obj2Name, self.getAxis(self.obj2Name, self.subElement2), vM.X0 )
-        #if debugPrint.level >= 4: dp('    a1_r %s, a2_r %s, directionConstraintFlag %s' % (self.a1_r, self.a2_r, self.constraintValue))
+        #if debugPrint.guard >= 4: debugPrint( 4, '    a1_r %s, a2_r %s, directionConstraintFlag %s', self.a1_r, self.a2_r, self.constraintValue )
 
     def constraintEq_value( self, X ):
         vM = self.variableManager
@@ -322,12 +505,31 @@ class AxisAlignmentUnion(ConstraintSystemPrototype):
         else:
             return (1 + ax_prod)
 
+    def axesProduct_derivative( self, X, objName, w ):
+        vM = self.variableManager
+        a = vM.rotate( self.obj1Name, self.a1_r, X )
+        b = vM.rotate( self.obj2Name, self.a2_r, X )
+        if objName == self.obj1Name:
+            return dotProduct( crossProduct(w, a), b ), dotProduct( a,b )
+        else:
+            return dotProduct( a, crossProduct(w, b) ), dotProduct( a,b )
+
+    def constraintEq_derivative( self, X, objName, v, w ):
+        d_ax_prod, ax_prod = self.axesProduct_derivative( X, objName, w )
+        directionConstraintFlag = self.constraintValue
+        if directionConstraintFlag == "none" : 
+            return -numpy.sign(ax_prod) * d_ax_prod
+        elif directionConstraintFlag == "aligned":
+            return -d_ax_prod
+        else:
+            return d_ax_prod
+
     def analyticalSolution(self):
         D = self.solveConstraintEq_dofs #degrees of freedom
         for objName in [self.obj1Name, self.obj2Name]:
             matches = [d for d in D if d.objName == objName and d.rotational() ]
             if len(matches) == 3:
-                if debugPrint.level >= 3: dp('%s analyticalSolution available: %s has free rotation.'% (self.label, objName))
+                if debugPrint.guard >= 3: debugPrint( 3, '%s analyticalSolution available: %s has free rotation.', self.label, objName )
                 vM = self.variableManager
                 if objName == self.obj1Name: #then object1 has has free rotation
                     v = self.a1_r
@@ -335,17 +537,14 @@ class AxisAlignmentUnion(ConstraintSystemPrototype):
                 else:
                     v = self.a2_r
                     v_ref = vM.rotate( self.obj1Name, self.a1_r, vM.X )
-                if debugPrint.level >= 4: dp('    v %s, v_ref %s, directionConstraintFlag %s' % (v, v_ref, self.constraintValue))
+                if debugPrint.guard >= 4: debugPrint( 4, '    v %s, v_ref %s, directionConstraintFlag %s', v, v_ref, self.constraintValue )
                 axis, angle = rotation_required_to_rotate_a_vector_to_be_aligned_to_another_vector( v, v_ref )
                 angle = self.analyticalSolutionAdjustAngle( angle, axis, v, v_ref )
-                if debugPrint.level >= 4: dp('    analyticalSolution:  axis %s, angle %s.'% (axis, angle))
+                if debugPrint.guard >= 4: debugPrint( 4, '    analyticalSolution:  axis %s, angle %s.', axis, angle )
                 #v_rotated = dotProduct( axis_rotation_matrix( angle, *axis), v)
-                #if debugPrint.level >= 4: dp('    v_rotated %s' % v_rotated )
-                azi, ela = axis_to_azimuth_and_elevation_angles(*axis)
+                #if debugPrint.guard >= 4: debugPrint( 4, '    v_rotated %s', v_rotated )
                 assert matches[0].ind % 6 == 3 and matches[1].ind % 6 == 4 and matches[2].ind % 6 == 5
-                matches[0].setValue(azi)
-                matches[1].setValue(ela)
-                matches[2].setValue(angle)
+                vM.setRotation( objName, axis, angle )
                 self.parentSystem.update() # required other constraints may effect by parts rotation ....
                 self.sys2.update()
                 return True
@@ -365,7 +564,7 @@ class AxisAlignmentUnion(ConstraintSystemPrototype):
                 # problem for angleUnions in this case, therefore checking at end if analytical solution will work at end.
                 v_angle = d.vectorsAngleInDofsCoordinateSystem( v ) #determining v_angle, v's angle will not be zero!!! THIS CAUSED ME GREY HAIR lol:)
                 v_ref_angle = d.vectorsAngleInDofsCoordinateSystem( v_ref ) 
-                if debugPrint.level >= 4: dp('  %s-%s analyticalSolution possibly available, v_angle %f, v_ref_angle %f'% (self.label, objName, v_angle, v_ref_angle))
+                if debugPrint.guard >= 4: debugPrint( 4, '  %s-%s analyticalSolution possibly available, v_angle %f, v_ref_angle %f', self.label, objName, v_angle, v_ref_angle )
                 if self.label == 'AxisAlignmentUnion':
                     directionConstraintFlag = self.constraintValue
                     if directionConstraintFlag == "aligned":
@@ -381,7 +580,7 @@ class AxisAlignmentUnion(ConstraintSystemPrototype):
                     #we want v_angle - v_ref_angle = self.constraintValue
                     actualDiff =  v_angle - v_ref_angle
                     diff = actualDiff - self.constraintValue
-                    #if debugPrint.level >= 4: dp('    angle diff %f' % diff)
+                    #if debugPrint.guard >= 4: debugPrint( 4, '    angle diff %f', diff )
                     d.setValue( v_ref_angle - v_angle - self.constraintValue )
                 else: 
                     raise NotImplementedError
@@ -390,13 +589,13 @@ class AxisAlignmentUnion(ConstraintSystemPrototype):
                 self.sys2.update()
                 #print(d)
                 #checking if solution worked
-                #if debugPrint.level >= 4: dp('    v_angle  %f  v_ref_angle  %f  self.constraintValue %s' % (d.vectorsAngleInDofsCoordinateSystem( v),d.vectorsAngleInDofsCoordinateSystem( v_ref ),self.constraintValue))
+                #if debugPrint.guard >= 4: debugPrint( 4, '    v_angle  %f  v_ref_angle  %f  self.constraintValue %s', d.vectorsAngleInDofsCoordinateSystem( v), d.vectorsAngleInDofsCoordinateSystem( v_ref ), self.constraintValue )
                 error = abs(self.constraintEq_value(vM.X))
                 if error < 10**-9:
-                    if debugPrint.level >= 4: dp('    %s-%s  analyticalSolution solution worked, error %e'% (self.label, objName, error))
+                    if debugPrint.guard >= 4: debugPrint( 4, '    %s-%s  analyticalSolution solution worked, error %e', self.label, objName, error )
                     return True
                 else:
-                    if debugPrint.level >= 4: dp('    %s-%s  analyticalSolution solution failed, error %e'% (self.label, objName, error))
+                    if debugPrint.guard >= 4: debugPrint( 4, '    %s-%s  analyticalSolution solution failed, error %e', self.label, objName, error )
                 #d = matches[0]
                 ##q_0, q_1, q_2, q_3 =  d.Q1 
                 #vM = self.variableManager
@@ -411,18 +610,18 @@ class AxisAlignmentUnion(ConstraintSystemPrototype):
                 #axis, angle = rotation_required_to_rotate_a_vector_to_be_aligned_to_another_vector( v, v_ref)
                 #alignmentError = 1 - abs(dotProduct(axis, d.axis))
                 #if abs(angle) < 10**-6 or abs(angle -pi) < 10**-6: #then v == v_ref, then random perpendicular axis returned 2 lines up
-                #    if debugPrint.level >= 4: dp('  %s-%s analyticalSolution correcting error on account of v and v_ref being on same axis'% (self.label, objName))
+                #    if debugPrint.guard >= 4: debugPrint( 4, '  %s-%s analyticalSolution correcting error on account of v and v_ref being on same axis', self.label, objName )
                 #    axis = d.axis
                 #    alignmentError = 0
-                #if debugPrint.level >= 4: dp('  %s-%s analyticalSolution alignment error %e, angle %f'% (self.label, objName, alignmentError, angle))
+                #if debugPrint.guard >= 4: debugPrint( 4, '  %s-%s analyticalSolution alignment error %e, angle %f', self.label, objName, alignmentError, angle )
                 #if alignmentError < self.solveConstraintEq_tol:
-                #    if debugPrint.level >= 3: dp('  %s analyticalSolution available: %s has free rotation about the required axis.'% (self.label, objName))
+                #    if debugPrint.guard >= 3: debugPrint( 3, '  %s analyticalSolution available: %s has free rotation about the required axis.', self.label, objName )
                 #    #if dotProduct(axis, d.axis) < 0: #no longer required since d.axis added to rotation_required_to_rotate_a_vector_to_be_aligned_to_another_vector()
                 #    #    axis = -axis
                 #    #    angle = -angle
                 #    angle = self.analyticalSolutionAdjustAngle( angle, axis, v, v_ref )
-                #    if debugPrint.level >= 4: dp('    analyticalSolution:  axis %s, angle %s.'% (axis, angle))
-                #    if debugPrint.level >= 4: dp('d %s' % d)
+                #    if debugPrint.guard >= 4: debugPrint( 4, '    analyticalSolution:  axis %s, angle %s.', axis, angle )
+                #    if debugPrint.guard >= 4: debugPrint( 4, 'd %s', d )
                 #    d.setValue(d.getValue() + angle)
                 #    self.parentSystem.update()
                 #    self.sys2.update()
@@ -451,7 +650,7 @@ class AxisAlignmentUnion(ConstraintSystemPrototype):
         for objName in [self.obj1Name, self.obj2Name]:
             matches = [d for d in dofs if d.objName == objName and d.rotational() ]
             if len(matches) == 3:
-                if debugPrint.level >= 4: dp('%s Logic "%s": reducing from 3 to 1 rotational degree of freedom (2 rotation degrees fixed in defining axis of rotation)' % (self.label, objName))
+                if debugPrint.guard >= 4: debugPrint( 4, '%s Logic "%s": reducing from 3 to 1 rotational degree of freedom (2 rotation degrees fixed in defining axis of rotation)', self.label, objName )
                 self.degreesOfFreedom = [ d for d in dofs if not d in matches ]
                 self.degreesOfFreedom.append( AxisRotationDegreeOfFreedom( self, objName) )
                 self.degreesOfFreedom_updateInd = len(self.degreesOfFreedom) -1
@@ -461,18 +660,18 @@ class AxisAlignmentUnion(ConstraintSystemPrototype):
                 vM = self.variableManager
                 a = vM.rotate( self.obj1Name, self.a1_r, vM.X )
                 if 1 - abs(dotProduct(a, matches[0].axis)) < self.solveConstraintEq_tol: #
-                    if debugPrint.level >= 4: dp('%s Logic "%s": AxisRotationDegreeOfFreedom with same axis already exists not reducing dofs for part' % (self.label, objName))
+                    if debugPrint.guard >= 4: debugPrint( 4, '%s Logic "%s": AxisRotationDegreeOfFreedom with same axis already exists not reducing dofs for part', self.label, objName )
                     self.degreesOfFreedom_updateInd = -1
                     self.degreesOfFreedom = dofs
                     success = True
                 else:
-                    if debugPrint.level >= 4: dp('%s Logic "%s": 2 different rotation axis specified, therefore fixing rotation (0 rotational degrees of freedom)' % (self.label, objName))
+                    if debugPrint.guard >= 4: debugPrint( 4, '%s Logic "%s": 2 different rotation axis specified, therefore fixing rotation (0 rotational degrees of freedom)', self.label, objName )
                     self.degreesOfFreedom = [ d for d in dofs if not d in matches ]
                     self.degreesOfFreedom_updateInd = -1
                     success = True
                     break
             elif len(matches) == 0:
-                if debugPrint.level >= 4: dp('%s Logic "%s": no rotational degrees of freedom ignoring.' % (self.label, objName))
+                if debugPrint.guard >= 4: debugPrint( 4, '%s Logic "%s": no rotational degrees of freedom ignoring.', self.label, objName )
                 #    self.degreesOfFreedom = dofs
                 #    self.degreesOfFreedom_updateInd = -1
                 #    success = True
@@ -486,7 +685,7 @@ class AxisAlignmentUnion(ConstraintSystemPrototype):
         if success:
             self.updateDegreesOfFreedomAnalytically()
         #else:
-        #    if debugPrint.level >= 3: dp('%s.generateDegreesOfFreedomAnalytical Logic not programmed for the reduction of degrees of freedom of:\n%s' % (self.label,'\n'.join(d.str('  ') for d in dofs ))
+        #    if debugPrint.guard >= 3: debugPrint( 3, '%s.generateDegreesOfFreedomAnalytical Logic not programmed for the reduction of degrees of freedom of:\n%s', self.label, '\n'.join(d.str('  ') for d in dofs ) )
         return success
         
     def updateDegreesOfFreedomAnalytically( self ):
@@ -507,6 +706,9 @@ class AngleUnion(AxisAlignmentUnion):
         a = vM.rotate( self.obj1Name, self.a1_r, X )
         b = vM.rotate( self.obj2Name, self.a2_r, X )
         return cos(self.constraintValue) - dotProduct( a,b )
+
+    def constraintEq_derivative( self, X, objName, v, w ):
+        return -self.axesProduct_derivative( X, objName, w )[0]
         # for another day
         #c = crossProduct( a, b)
         #if norm(c) > 0:
@@ -542,21 +744,34 @@ class PlaneOffsetUnion(ConstraintSystemPrototype):
         dist = dotProduct(a, pos1 - pos2) #distance between planes
         return dist - self.constraintValue
 
+    def constraintEq_derivative( self, X, objName, v, w ):
+        vM = self.variableManager
+        a = vM.rotate( self.obj1Name, self.a1_r, X )
+        pos1 = vM.rotateAndMove( self.obj1Name, self.pos1_r, X )
+        pos2 = vM.rotateAndMove( self.obj2Name, self.pos2_r, X )
+        i = vM.index[objName]
+        if objName == self.obj1Name:
+            d_pos1 = v + crossProduct( w, pos1 - X[i:i+3] )
+            return dotProduct( crossProduct(w, a), pos1 - pos2 ) + dotProduct( a, d_pos1 )
+        else:
+            d_pos2 = v + crossProduct( w, pos2 - X[i:i+3] )
+            return -dotProduct( a, d_pos2 )
+
     def analyticalSolution(self):
         D = self.solveConstraintEq_dofs #degrees of freedom
         for objName in [self.obj1Name, self.obj2Name]:
             matches = [d for d in D if d.objName == objName and not d.rotational() ]
             if len(matches) > 0:
-                #if debugPrint.level >= 4: dp('    %s %s has linear displacement degrees of freedom, checking for analyticalSolution.'% (self.label, objName))
+                #if debugPrint.guard >= 4: debugPrint( 4, '    %s %s has linear displacement degrees of freedom, checking for analyticalSolution.', self.label, objName )
                 vM = self.variableManager
                 a = vM.rotate( self.obj1Name, self.a1_r, vM.X )
                 for j in reversed(range(len(matches))):
                     if abs( dot(a, matches[j].directionVector) ) < 10**-9:
                         del matches[j]
                 if len(matches) == 0 :
-                    if debugPrint.level >= 4: dp('    %s %s aborting analytical solution, since dof perpindicular to required displacement.'% (self.label, objName))
+                    if debugPrint.guard >= 4: debugPrint( 4, '    %s %s aborting analytical solution, since dof perpindicular to required displacement.', self.label, objName )
                     continue 
-                if debugPrint.level >= 3: dp('    %s analyticalSolution available by moving %s.'% (self.label, objName))
+                if debugPrint.guard >= 3: debugPrint( 3, '    %s analyticalSolution available by moving %s.', self.label, objName )
                 pos1 = vM.rotateAndMove( self.obj1Name, self.pos1_r, vM.X )
                 pos2 = vM.rotateAndMove( self.obj2Name, self.pos2_r, vM.X )
                 error =  dotProduct(a, pos1 - pos2) - self.constraintValue
@@ -580,7 +795,7 @@ class PlaneOffsetUnion(ConstraintSystemPrototype):
         for objName in [self.obj1Name, self.obj2Name]:
             matches = [d for d in dofs if d.objName == objName and not d.rotational() ]
             if len(matches) == 3:
-                if debugPrint.level >= 4: dp('PlaneOffsetUnion Logic: %s - reducing linear displacement degrees of freedom from 3 to 2' % objName)
+                if debugPrint.guard >= 4: debugPrint( 4, 'PlaneOffsetUnion Logic: %s - reducing linear displacement degrees of freedom from 3 to 2', objName )
                 self.degreesOfFreedom = [ d for d in dofs if not d in matches ]
                 self.degreesOfFreedom.append( LinearMotionDegreeOfFreedom( self, objName) )
                 self.degreesOfFreedom.append( LinearMotionDegreeOfFreedom( self, objName) )
@@ -593,12 +808,12 @@ class PlaneOffsetUnion(ConstraintSystemPrototype):
                 c = crossProduct( matches[0].directionVector, matches[1].directionVector)
                 planeNormalMatches = c/norm(c)
                 if norm(planeNormalVector - planeNormalMatches) < 10 **-6: #then constraint redudant
-                    if debugPrint.level >= 4: dp('PlaneOffsetUnion Logic: %s - plane constraint with normal already exist, not reducing dofs for part' % objName)
+                    if debugPrint.guard >= 4: debugPrint( 4, 'PlaneOffsetUnion Logic: %s - plane constraint with normal already exist, not reducing dofs for part', objName )
                     #self.degreesOfFreedom =  dofs
                     #self.dofs_removed = []
                     #success = True
                 else:
-                    if debugPrint.level >= 4: dp('PlaneOffsetUnion Logic: %s - reducing linear displacement degrees of freedom from 2 to 1' % objName)
+                    if debugPrint.guard >= 4: debugPrint( 4, 'PlaneOffsetUnion Logic: %s - reducing linear displacement degrees of freedom from 2 to 1', objName )
                     self.degreesOfFreedom = [ d for d in dofs if not d in matches ]
                     self.degreesOfFreedom.append( LinearMotionDegreeOfFreedom( self, objName ) )
                     self.dofs_removed = matches
@@ -608,12 +823,12 @@ class PlaneOffsetUnion(ConstraintSystemPrototype):
                 vM = self.variableManager
                 planeNormalVector = vM.rotate( self.obj1Name, self.a1_r, vM.X )
                 if abs(dotProduct( planeNormalVector, matches[0].directionVector)) < 10 **-6: #then constraint redudant
-                    if debugPrint.level >= 4: dp('PlaneOffsetUnion Logic: %s - planeNormal constraint does not effect remaining dof -> no dof reduction.' % objName)
+                    if debugPrint.guard >= 4: debugPrint( 4, 'PlaneOffsetUnion Logic: %s - planeNormal constraint does not effect remaining dof -> no dof reduction.', objName )
                     #self.degreesOfFreedom =  dofs
                     #self.dofs_removed = []
                     #success = True
                 else:
-                    if debugPrint.level >= 4: dp('PlaneOffsetUnion Logic: %s - reducing linear displacement degrees of freedom from 1 to 0' % objName)
+                    if debugPrint.guard >= 4: debugPrint( 4, 'PlaneOffsetUnion Logic: %s - reducing linear displacement degrees of freedom from 1 to 0', objName )
                     self.degreesOfFreedom = [ d for d in dofs if not d in matches ]
                     self.dofs_removed = matches
                     success = True
@@ -666,19 +881,39 @@ class AxisDistanceUnion(ConstraintSystemPrototype):
         #   is sensitive to axis misalignment, which is should not be because, axis alignment should be taken care of in the axis alignment constraint. Therefore
         dist = distance_between_axis_and_point( pos1, a1, pos2 )
         if numpy.isnan(dist):
-            if debugPrint.level >= 1: dp('numpy.isnan(dist)')
-            if debugPrint.level >= 1: dp('  locals %s' % formatDictionary(locals(),' '*6) )
-            if debugPrint.level >= 1: dp('  %s.__dict %s' % (self.label, formatDictionary( self.__dict__,' '*6 ) ) )   
+            if debugPrint.guard >= 1: debugPrint( 1, 'numpy.isnan(dist)' )
+            if debugPrint.guard >= 1: debugPrint( 1, '  locals %s', formatDictionary(locals(),' '*6) )
+            if debugPrint.guard >= 1: debugPrint( 1, '  %s.__dict %s', self.label, formatDictionary( self.__dict__,' '*6 ) )
             raise ValueError(' assembly2 AxisDistanceUnion numpy.isnan(dist) check console for details')
         return dist - self.constraintValue
 
+    def constraintEq_derivative( self, X, objName, v, w ):
+        vM = self.variableManager
+        a1 = vM.rotate( self.obj1Name, self.a1_r, X )
+        pos1 = vM.rotateAndMove( self.obj1Name, self.pos1_r, X )
+        pos2 = vM.rotateAndMove( self.obj2Name, self.pos2_r, X )
+        d = pos2 - pos1
+        offset = d - dotProduct(a1,d)*a1 #as in distance_between_axis_and_point
+        dist = norm(offset)
+        if dist == 0:
+            return 0.0
+        i = vM.index[objName]
+        if objName == self.obj1Name:
+            d_a1 = crossProduct( w, a1 )
+            d_d = -( v + crossProduct( w, pos1 - X[i:i+3] ) )
+        else:
+            d_a1 = numpy.zeros(3)
+            d_d = v + crossProduct( w, pos2 - X[i:i+3] )
+        d_offset = d_d - ( dotProduct(d_a1, d) + dotProduct(a1, d_d) )*a1 - dotProduct(a1,d)*d_a1
+        return dotProduct( offset, d_offset ) / dist
+
     def analyticalSolution(self):
         if  self.constraintValue == 0:
             D = self.solveConstraintEq_dofs #degrees of freedom
             for objName in [self.obj1Name, self.obj2Name]:
                 matches = [d for d in D if d.objName == objName and not d.rotational() ]
                 if len(matches) > 0:
-                    if debugPrint.level >= 4: dp('    %s %s has linear displacement degrees of freedom, checking for analyticalSolution.'% (self.label, objName))
+                    if debugPrint.guard >= 4: debugPrint( 4, '    %s %s has linear displacement degrees of freedom, checking for analyticalSolution.', self.label, objName )
                     vM = self.variableManager
                     a = vM.rotate( self.obj1Name, self.a1_r, vM.X )
                     pos1 = vM.rotateAndMove( self.obj1Name, self.pos1_r, vM.X )
@@ -689,14 +924,14 @@ class AxisDistanceUnion(ConstraintSystemPrototype):
                     requiredDisp = a_v*error
                     if objName == self.obj1Name:
                         requiredDisp = -requiredDisp
-                    if debugPrint.level >= 4: dp('    requiredDisp %s' % requiredDisp )
+                    if debugPrint.guard >= 4: debugPrint( 4, '    requiredDisp %s', requiredDisp )
                     V = [ dot( m.directionVector, requiredDisp ) for m in matches ]
                     #for m,v in zip(matches,V):
                     #    print(m,v)
                     #debugPrint(4,str(V))
                     actualDisp = sum( v*m.directionVector for m,v in zip(matches,V) )
                     if abs(dot(a_v,requiredDisp) - dot(a_v,actualDisp)) < 10**-9:
-                        if debugPrint.level >= 3: dp('    %s analyticalSolution available by moving %s.'% (self.label, objName))
+                        if debugPrint.guard >= 3: debugPrint( 3, '    %s analyticalSolution available by moving %s.', self.label, objName )
                         for m,v in zip(matches,V):
                             m.setValue( m.getValue() + v  )
                         self.parentSystem.update() 
@@ -718,7 +953,7 @@ class AxisDistanceUnion(ConstraintSystemPrototype):
         for objName in [self.obj1Name, self.obj2Name]:
             matches = [d for d in dofs if d.objName == objName and not d.rotational() ]
             if len(matches) == 3:
-                if debugPrint.level >= 4: dp('%s Logic: %s - reducing linear displacement degrees of freedom from 3 to 1' % (self.label, objName))
+                if debugPrint.guard >= 4: debugPrint( 4, '%s Logic: %s - reducing linear displacement degrees of freedom from 3 to 1', self.label, objName )
                 self.degreesOfFreedom = [ d for d in dofs if not d in matches ]
                 self.degreesOfFreedom.append( LinearMotionDegreeOfFreedom( self, objName) )
                 self.dof_added = True
@@ -728,24 +963,24 @@ class AxisDistanceUnion(ConstraintSystemPrototype):
                 c = crossProduct( matches[0].directionVector, matches[1].directionVector)
                 planeNormalMatches = c/norm(c)
                 if abs(dotProduct( axisVector, planeNormalMatches)) < 10 **-6: #then co-planar
-                    if debugPrint.level >= 4: dp('%s Logic: %s axis in movement plane, therefore linear degrees of freedom reduced from 2 to 1' % (self.label, objName))
+                    if debugPrint.guard >= 4: debugPrint( 4, '%s Logic: %s axis in movement plane, therefore linear degrees of freedom reduced from 2 to 1', self.label, objName )
                     self.degreesOfFreedom = [ d for d in dofs if not d in matches ]
                     self.degreesOfFreedom.append( LinearMotionDegreeOfFreedom( self, objName) )
                     self.dof_added = True
                     success = True
                     break
                 else:
-                    if debugPrint.level >= 4: dp('%s Logic: %s axis not in movement plane, therefore linear degrees of freedom reduced from 2 to 0' % (self.label, objName))
+                    if debugPrint.guard >= 4: debugPrint( 4, '%s Logic: %s axis not in movement plane, therefore linear degrees of freedom reduced from 2 to 0', self.label, objName )
                     self.degreesOfFreedom =  [ d for d in dofs if not d in matches ]
                     success = True
                     break
             elif len(matches) == 1: 
                 if abs(dotProduct(axisVector , matches[0].directionVector)) < 10 **-6: #then constraint redudant
-                    if debugPrint.level >= 4: dp('%s Logic: %s - axis movement constraint does not effect remaining dof -> no dof reduction.' % (self.label, objName))
+                    if debugPrint.guard >= 4: debugPrint( 4, '%s Logic: %s - axis movement constraint does not effect remaining dof -> no dof reduction.', self.label, objName )
                     #self.degreesOfFreedom =  dofs
                     #success = True
                 else:
-                    if debugPrint.level >= 4: dp('%s Logic: %s - axis movement constraint different from last linear displacement degree of freedom -> reducing degrees of freedom from 1 to 0' % (self.label, objName))
+                    if debugPrint.guard >= 4: debugPrint( 4, '%s Logic: %s - axis movement constraint different from last linear displacement degree of freedom -> reducing degrees of freedom from 1 to 0', self.label, objName )
                     self.degreesOfFreedom = [ d for d in dofs if not d in matches ]
                     success = True
                     break
@@ -784,26 +1019,40 @@ class VertexUnion(ConstraintSystemPrototype):
         pos2 = vM.rotateAndMove( self.obj2Name, self.pos2_r, X )
         return norm(pos1 - pos2)
 
+    def constraintEq_derivative( self, X, objName, v, w ):
+        vM = self.variableManager
+        pos1 = vM.rotateAndMove( self.obj1Name, self.pos1_r, X )
+        pos2 = vM.rotateAndMove( self.obj2Name, self.pos2_r, X )
+        dist = norm(pos1 - pos2)
+        if dist == 0:
+            return 0.0
+        i = vM.index[objName]
+        if objName == self.obj1Name:
+            d_pos = v + crossProduct( w, pos1 - X[i:i+3] )
+        else:
+            d_pos = -( v + crossProduct( w, pos2 - X[i:i+3] ) )
+        return dotProduct( pos1 - pos2, d_pos ) / dist
+
     def analyticalSolution(self):
         D = self.solveConstraintEq_dofs #degrees of freedom
         for objName in [self.obj1Name, self.obj2Name]:
             matches = [d for d in D if d.objName == objName and not d.rotational() ]
             if len(matches) > 0 : 
-                if debugPrint.level >= 4: dp('    %s %s has linear displacement degrees of freedom, checking for analyticalSolution.'% (self.label, objName))
+                if debugPrint.guard >= 4: debugPrint( 4, '    %s %s has linear displacement degrees of freedom, checking for analyticalSolution.', self.label, objName )
                 vM = self.variableManager
                 pos1 = vM.rotateAndMove( self.obj1Name, self.pos1_r, vM.X )
                 pos2 = vM.rotateAndMove( self.obj2Name, self.pos2_r, vM.X )
                 requiredDisp = pos1 - pos2
                 if objName == self.obj1Name:
                     requiredDisp = -requiredDisp
-                if debugPrint.level >= 4: dp('    requiredDisp %s' % requiredDisp )
+                if debugPrint.guard >= 4: debugPrint( 4, '    requiredDisp %s', requiredDisp )
                 V = [ dot( m.directionVector, requiredDisp ) for m in matches ]
                 #for m,v in zip(matches,V):
                 #    print(m,v)
                 #debugPrint(4,str(V))
                 actualDisp = sum( v*m.directionVector for m,v in zip(matches,V) )
                 if norm( requiredDisp - actualDisp) < 10**-9:
-                    if debugPrint.level >= 3: dp('    %s analyticalSolution available by moving %s.'% (self.label, objName))
+                    if debugPrint.guard >= 3: debugPrint( 3, '    %s analyticalSolution available by moving %s.', self.label, objName )
                     for m,v in zip(matches,V):
                         m.setValue( m.getValue() + v  )
                         #print(m)
@@ -822,7 +1071,7 @@ class VertexUnion(ConstraintSystemPrototype):
         for objName in [self.obj1Name, self.obj2Name]:
             matches = [d for d in D if d.objName == objName and not d.rotational() ]
             if len(matches) == 3: #todo somehow add support for 3,2 cases
-                if debugPrint.level >= 3: dp('  VertexUnion Logic: %s removing all 3 movement degrees of freedom' % objName )
+                if debugPrint.guard >= 3: debugPrint( 3, '  VertexUnion Logic: %s removing all 3 movement degrees of freedom', objName )
                 self.degreesOfFreedom = [ d for d in D if not d in matches ] 
                 success = True
                 break
@@ -850,16 +1099,19 @@ class LockRelativeAxialRotationUnion(ConstraintSystemPrototype):
     def constraintEq_value( self, X ):
         return 0
 
+    def constraintEq_derivative( self, X, objName, v, w ):
+        return 0
+
     def generateDegreesOfFreedomAnalytically( self ):
         #only works for simple case described below
         D = self.parentSystem.degreesOfFreedom + self.sys2.degreesOfFreedom
         matches = [d for d in D if d.objName == self.objectToLock and isinstance(d,AxisRotationDegreeOfFreedom ) ]
         if len(matches) == 1:
-            if debugPrint.level >= 4: dp('%s Logic: removing axis rotation dof of %s' % (self.label, self.objectToLock))
+            if debugPrint.guard >= 4: debugPrint( 4, '%s Logic: removing axis rotation dof of %s', self.label, self.objectToLock )
             self.degreesOfFreedom = [ d for d in D if not d in matches ] 
         else:
             self.degreesOfFreedom = D
-            if debugPrint.level >= 3: dp('%s Logic Failure, unable to remove relative rotation degree of freedom' % (self.label))
+            if debugPrint.guard >= 3: debugPrint( 3, '%s Logic Failure, unable to remove relative rotation degree of freedom', self.label )
         return True
 
 
@@ -886,7 +1138,7 @@ class AddFreeObjectsUnion(ConstraintSystemPrototype): #for adding free objects t
         self.childSystem = None
         parentSystem.childSystem = self
         self.solveConstraintEq()      
-        if debugPrint.level >= 3 : dp('AddFreeObjectsUnion resulting system:\n%s' % self.str(indent=' '*4, addDOFs=debugPrint.level>3))
+        if debugPrint.guard >= 3: debugPrint( 3, 'AddFreeObjectsUnion resulting system:\n%s', self.str(indent=' '*4, addDOFs=debugPrint.level>3) )
 
     def constraintEq_value( self, X ):
         return 0
@@ -897,3 +1149,119 @@ class AddFreeObjectsUnion(ConstraintSystemPrototype): #for adding free objects t
         
     def updateDegreesOfFreedomAnalytically( self):
         pass
+
+
+class LoopClosureUnion(ConstraintSystemPrototype):
+    '''
+    for a constraint closing a loop (see loops.py), solves all of its equations simultaneously using the degrees-of-freedom of the parts in the loop.
+    constraintEq_f returns the vector of closure residuals, which solveConstraintEq's numerical solver solves as a block.
+    The residuals are scaled so that each equation is satisfied to within the tolerance of the union it replaces.
+    The dependent degrees-of-freedom (linearly independent columns of the closure equations Jacobian) are removed,
+    and adjusted during update() to keep the loop closed.
+    constraintValue - names of the parts in the loop
+    '''
+    label = 'LoopClosureUnion'
+
+    def init2(self):
+        self.closure = LoopClosureEquations( self.variableManager, self.constraintObj )
+        unionTolerances = {
+            'axisAlignment': ( 2*AxisAlignmentUnion.solveConstraintEq_tol )**0.5, #1 - dot(a1,a2) ~= norm(a1-a2)**2/2
+            'planeOffset': PlaneOffsetUnion.solveConstraintEq_tol,
+            'axisDistance': AxisDistanceUnion.solveConstraintEq_tol,
+            'angle': AngleUnion.solveConstraintEq_tol,
+            'vertex': VertexUnion.solveConstraintEq_tol,
+            }
+        self.residualScale = numpy.array( sum( [ [ self.solveConstraintEq_tol / unionTolerances[name] ] * residualSizes[name] for name, value in self.closure.equations ], [] ) )
+
+    def constraintEq_value( self, X ):
+        return abs( self.closure.residuals( self.variableManager, X ) * self.residualScale ).max()
+
+    def constraintEq_f( self, Y ):
+        self.constraintEq_setY(Y)
+        return self.closure.residuals( self.variableManager, self.variableManager.X ) * self.residualScale
+
+    def constraintEq_grad( self, Y ):
+        '''
+        central differences, with a step large enough for the parent systems to be re-solved,
+        otherwise degrees-of-freedom which the parent systems override appear to influence the closure.
+        '''
+        return numpy.atleast_2d( GradientApproximatorCentralDifference( self.constraintEq_f )( numpy.array(Y, dtype=float), eps=10**-4 ) )
+
+    def loopDegreesOfFreedom( self ):
+        return [ d for d in self.parentSystem.degreesOfFreedom + self.sys2.degreesOfFreedom if d.objName in self.constraintValue and not getattr(d,'locked',False) ]
+
+    def constraintEq_dofs( self ):
+        if hasattr( self, 'degreesOfFreedom' ): #only the dependent dofs, the others are passed on to the child systems
+            return [ d for d in self.dependentDofs if not getattr(d,'locked',False) ]
+        return self.loopDegreesOfFreedom()
+
+    def generateDegreesOfFreedomAnalytically( self ):
+        return False
+
+    def generateDegreesOfFreedomNumerically( self ):
+        D = self.parentSystem.degreesOfFreedom + self.sys2.degreesOfFreedom
+        loopDofs = self.loopDegreesOfFreedom()
+        self.dependentDofs = []
+        self.generateDegreesOfFreedomNumerically_case = 0 #dependentDofs are adjusted by solveConstraintEq, nothing to update
+        if len(loopDofs) > 0:
+            X_org = self.variableManager.X.copy()
+            self.solveConstraintEq_dofs = loopDofs
+            J = self.constraintEq_grad( [ d.getValue() for d in loopDofs ] )
+            self.variableManager.X = X_org
+            J_scaled = J / self.residualScale[:,numpy.newaxis] * numpy.array([ d.maxStep() for d in loopDofs ])
+            self.dependentDofs = [ loopDofs[j] for j in independentColumns( J_scaled, tol=10**-3 ) ]
+            if debugPrint.guard >= 4: debugPrint( 4, '  %s: closure jacobian rank %i, removing %s', self.label, len(self.dependentDofs), ', '.join( d.str() for d in self.dependentDofs ) )
+        self.degreesOfFreedom = [ d for d in D if not d in self.dependentDofs ]
+
+
+def addConstraints( constraintSystem, variableManager, constraintObjectQue, printErrors=True, record=None, loopClosure=False ):
+    '''
+    adds the constraints in constraintObjectQue one at a time to constraintSystem.
+    returns constraintSystem, failedConstraint; where failedConstraint is None if all constraints where solved.
+    record - optional function called with the constraint system after each constraint is added (i.e. cache.record)
+    loopClosure - add constraints closing a loop as a LoopClosureUnion, instead of as the unions for the constraint type
+    '''
+    for constraintObj in constraintObjectQue:
+        if debugPrint.guard >= 3: debugPrint( 3, '  parsing %s, type:%s', constraintObj.Name, constraintObj.Type )
+        try:
+            cArgs = [variableManager, constraintObj]
+            loop = loopObjects( constraintSystem, variableManager.doc, constraintObj ) if loopClosure else None
+            if not constraintSystem.containtsObject( constraintObj.Object1) and not constraintSystem.containtsObject( constraintObj.Object2):
+                constraintSystem = AddFreeObjectsUnion(constraintSystem, *cArgs)
+            if loop != None:
+                if debugPrint.guard >= 3: debugPrint( 3, '  %s closes the loop %s', constraintObj.Name, ', '.join(loop) )
+                constraintSystem = LoopClosureUnion(constraintSystem, *cArgs, constraintValue = loop )
+                if constraintObj.Type in ['axial', 'circularEdge'] and constraintObj.lockRotation: constraintSystem =  LockRelativeAxialRotationUnion(constraintSystem,  *cArgs, constraintValue = 0)
+            elif constraintObj.Type == 'plane':
+                if constraintObj.SubElement2.startswith('Face'): #otherwise vertex
+                    constraintSystem = AxisAlignmentUnion(constraintSystem, *cArgs,  constraintValue = constraintObj.directionConstraint )
+                constraintSystem = PlaneOffsetUnion(constraintSystem,  *cArgs, constraintValue = constraintObj.offset.Value)
+            elif constraintObj.Type == 'angle_between_planes':
+                constraintSystem = AngleUnion(constraintSystem,  *cArgs, constraintValue = constraintObj.angle.Value*pi/180 )
+            elif constraintObj.Type == 'axial':
+                constraintSystem = AxisAlignmentUnion(constraintSystem,  *cArgs, constraintValue = constraintObj.directionConstraint)
+                constraintSystem =  AxisDistanceUnion(constraintSystem,  *cArgs, constraintValue = 0)
+                if constraintObj.lockRotation: constraintSystem =  LockRelativeAxialRotationUnion(constraintSystem,  *cArgs, constraintValue = 0)
+            elif constraintObj.Type == 'circularEdge':
+                constraintSystem = AxisAlignmentUnion(constraintSystem,  *cArgs, constraintValue=constraintObj.directionConstraint)
+                constraintSystem = AxisDistanceUnion(constraintSystem,  *cArgs, constraintValue=0)
+                constraintSystem = PlaneOffsetUnion(constraintSystem,  *cArgs, constraintValue=constraintObj.offset.Value)
+                if constraintObj.lockRotation: constraintSystem =  LockRelativeAxialRotationUnion(constraintSystem,  *cArgs, constraintValue = 0)
+            elif constraintObj.Type == 'sphericalSurface':
+                constraintSystem = VertexUnion(constraintSystem,  *cArgs, constraintValue=0)
+            else:
+                raise NotImplementedError('constraintType %s not supported yet' % constraintObj.Type)
+            if record != None:
+                record( constraintSystem )
+        except Assembly2SolverError as e:
+            if printErrors:
+                FreeCAD.Console.PrintError('UNABLE TO SOLVE CONSTRAINTS! info:')
+                FreeCAD.Console.PrintError(e)
+            return constraintSystem, constraintObj
+        except:
+            if printErrors:
+                import traceback
+                FreeCAD.Console.PrintError('UNABLE TO SOLVE CONSTRAINTS! info:')
+                FreeCAD.Console.PrintError( traceback.format_exc())
+            return constraintSystem, constraintObj
+    return constraintSystem, None
@@ -24,6 +24,11 @@ class PlacementDegreeOfFreedom:
             return pi/5
     def rotational(self):
         return self.ind % 6 > 2
+    def motionVectors(self):
+        'returns v, w; the linear and angular velocity of the object (rotation about its placement base) resulting from a unit change in the dof value'
+        if self.ind % 6 < 3:
+            return self.directionVector, numpy.zeros(3)
+        return numpy.zeros(3), self.vM.angularVelocities( self.objName, self.vM.X )[ self.ind % 6 - 3 ]
     def migrate_to_new_variableManager( self, new_vM):
         self.vM = new_vM
         self.ind =  new_vM.index[self.objName] + self.object_dof
@@ -53,6 +58,8 @@ class LinearMotionDegreeOfFreedom:
         return maxStep_linearDisplacement #inf
     def rotational(self):
         return False
+    def motionVectors(self):
+        return self.directionVector, numpy.zeros(3)
     def migrate_to_new_variableManager( self, new_vM):
         self.vM = new_vM
         self.objInd =  new_vM.index[self.objName]
@@ -86,6 +93,7 @@ class AxisRotationDegreeOfFreedom:
             self.axis = axis
             axis2, angle2 = rotation_required_to_rotate_a_vector_to_be_aligned_to_another_vector( axis_r, axis )
             self.R_to_align_axis = axis_rotation_matrix(  angle2, *axis2 )
+            self.Q_to_align_axis = numpy.array( quaternion2( angle2, *axis2 ) )
             if check_R_to_align_axis:
                 print('NOTE: checking AxisRotationDegreeOfFreedom self.R_to_align_axis')
                 if norm(  dotProduct(self.R_to_align_axis, axis_r) - axis ) > 10**-12:
@@ -118,8 +126,7 @@ class AxisRotationDegreeOfFreedom:
                 )
 
     def getValue( self, refApproach=True, tol=10**-7 ):
-        i = self.objInd
-        R_effective = azimuth_elevation_rotation_matrix( *self.vM.X[i+3:i+6] )
+        R_effective = self.vM.rotationMatrices( self.objName, self.vM.X )[0]
         if refApproach:
             v = dotProduct( R_effective, self.x_ref_r)
             if tol != None and abs( dotProduct(v, self.axis) ) > tol:
@@ -136,21 +143,15 @@ class AxisRotationDegreeOfFreedom:
         return angle
             
     def setValue( self, angle):
-        R_about_axis = axis_rotation_matrix( angle, *self.axis )
-        R = dotProduct(R_about_axis, self.R_to_align_axis)
-        axis, angle = rotation_matrix_axis_and_angle( R )
-        #todo, change to quaternions
-        #Q2 = quaternion2( self.value, *self.axis )
-        #q0,q1,q2,q3 = quaternion_multiply( Q2, self.Q1 )
-        #axis, angle = quaternion_to_axis_and_angle( q1, q2, q3, q0 )
-        azi, ela = axis_to_azimuth_and_elevation_angles(*axis)
-        i = self.objInd
-        self.vM.X[i+3:i+6] = azi, ela, angle
+        'R_effective = R_about_axis * R_to_align_axis; with the QuaternionVariableManager this is done through quaternion composition'
+        self.vM.setRotation( self.objName, self.axis, angle, self.R_to_align_axis, self.Q_to_align_axis )
 
     def maxStep(self):             
         return pi/5
     def rotational(self):
         return True
+    def motionVectors(self):
+        return numpy.zeros(3), self.axis
     def migrate_to_new_variableManager( self, new_vM):
         self.vM = new_vM
         self.objInd =  new_vM.index[self.objName]
@@ -160,3 +161,42 @@ class AxisRotationDegreeOfFreedom:
         return self.str()
 
 
+class NullSpaceDegreeOfFreedom:
+    '''
+    moves a set of degrees-of-freedom (possibly of several objects) together, along a null space direction of the
+    constraint equation's jacobian, see ConstraintSystemPrototype.generateDegreesOfFreedomNullSpace.
+    direction - change in each of the dofs values per unit change in value. The value is relative, 0 when created.
+    '''
+    def __init__(self, parentSystem, dofs, direction):
+        self.system = parentSystem
+        self.vM = parentSystem.variableManager
+        self.dofs = dofs
+        self.direction = direction
+        self.value = 0.0
+        objNames = sorted( set( d.objName for d in dofs ) )
+        self.objName = objNames[0] if len(objNames) == 1 else None #None if several objects are moved, so that the analytical solutions ignore it
+    def getValue( self ):
+        return self.value
+    def setValue( self, value ):
+        delta = value - self.value
+        for d, v in zip( self.dofs, self.direction ):
+            d.setValue( d.getValue() + delta*v )
+        self.value = value
+    def maxStep(self):
+        return 1.0 #direction is scaled by the dofs maxSteps
+    def rotational(self):
+        return any( d.rotational() for d in self.dofs )
+    def motionVectors(self):
+        v, w = numpy.zeros(3), numpy.zeros(3)
+        for d, c in zip( self.dofs, self.direction ):
+            v_d, w_d = d.motionVectors()
+            v, w = v + c*v_d, w + c*w_d
+        return v, w
+    def migrate_to_new_variableManager( self, new_vM):
+        self.vM = new_vM
+        for d in self.dofs:
+            d.migrate_to_new_variableManager( new_vM )
+    def str(self, indent=''):
+        return '%s<NullSpace DegreeOfFreedom %s value:%f>' % (indent, ' '.join( '%+1.3f*%s' % (c, d.str().strip('<>')) for d, c in zip( self.dofs, self.direction ) ), self.getValue())
+    def __repr__(self):
+        return self.str()
@@ -0,0 +1,151 @@
+'''
+Closed kinematic loops, i.e. cycles in the graph of parts linked by constraints (fixed parts acting as a single ground part).
+
+A constraint closing a loop links two parts which are both already positioned by the constraint system.
+Adding it as a chain of unions (AxisAlignmentUnion, AxisDistanceUnion, ...) requires each union's scalar equation to be solved
+using the parent system's degrees-of-freedom, while the parent systems keep re-positioning the other parts in the loop.
+This is slow, and frequently fails since a single scalar equation such as an axis distance cannot capture the closure (2 equations).
+
+Instead the solver can add a LoopClosureUnion (see constraintSystems.py), which solves the closure equations of the constraint
+simultaneously, as a small least-squares problem in the degrees-of-freedom of the parts in the loop.
+'''
+
+import numpy
+from numpy.linalg import norm
+from assembly2.lib3D import crossProduct, dotProduct
+from assembly2.solvers.common import subElementPos, subElementAxis
+
+
+def loopObjects( constraintSystem, doc, constraintObj ):
+    '''
+    if constraintObj closes a loop in constraintSystem, returns the names of the non-fixed parts in the (shortest) loop, else None.
+    Constraints already linking the same 2 parts are not counted, as adding a second constraint to a pair of parts does not close a loop.
+    '''
+    ground = set()
+    edges = []
+    sys = constraintSystem
+    while sys != None:
+        if hasattr( sys, 'obj1Name' ):
+            edges.append( ( sys.obj1Name, sys.obj2Name ) )
+        elif hasattr( sys, 'objName' ):
+            ground.add( sys.objName ) #base object of the system, treated as fixed
+        sys = sys.parentSystem
+    def node( objName ):
+        if objName in ground or getattr( doc.getObject( objName ), 'fixedPosition', False ):
+            return None #ground
+        return objName
+    start, end = node( constraintObj.Object1 ), node( constraintObj.Object2 )
+    if start == end: #both fixed
+        return None
+    placed = set( [ None ] + [ node(objName) for e in edges for objName in e ] )
+    if not start in placed or not end in placed:
+        return None
+    pair = set( [ start, end ] )
+    neighbours = {}
+    for a, b in edges:
+        a, b = node(a), node(b)
+        if a != b and set( [a, b] ) != pair:
+            neighbours.setdefault( a, set() ).add( b )
+            neighbours.setdefault( b, set() ).add( a )
+    previous = { start: start }
+    que = [ start ]
+    while len(que) > 0 and not end in previous: #breadth first search, for the shortest loop
+        n = que.pop(0)
+        for m in sorted( neighbours.get( n, [] ), key=str ):
+            if not m in previous:
+                previous[m] = n
+                que.append( m )
+    if not end in previous:
+        return None
+    objectNames = []
+    n = end
+    while True:
+        if n != None:
+            objectNames.append( n )
+        if n == start:
+            break
+        n = previous[n]
+    return objectNames
+
+
+residualSizes = { 'axisAlignment':3, 'planeOffset':1, 'axisDistance':3, 'angle':1, 'vertex':3 } #number of residuals of each equation
+
+class LoopClosureEquations:
+    '''
+    the constraint equations of constraintObj as a vector of residuals, which unlike the union equations are smooth at the solution.
+    Positions and axes are stored relative to the objects placements, as done for the unions.
+    '''
+    def __init__( self, variableManager, constraintObj ):
+        vM = variableManager
+        doc = vM.doc
+        self.obj1Name = constraintObj.Object1
+        self.obj2Name = constraintObj.Object2
+        obj1 = doc.getObject( self.obj1Name )
+        obj2 = doc.getObject( self.obj2Name )
+        self.a1_r = vM.rotateUndo( self.obj1Name, subElementAxis( obj1, constraintObj.SubElement1 ), vM.X0 )
+        self.a2_r = vM.rotateUndo( self.obj2Name, subElementAxis( obj2, constraintObj.SubElement2 ), vM.X0 )
+        self.pos1_r = vM.rotateAndMoveUndo( self.obj1Name, subElementPos( obj1, constraintObj.SubElement1 ), vM.X0 )
+        self.pos2_r = vM.rotateAndMoveUndo( self.obj2Name, subElementPos( obj2, constraintObj.SubElement2 ), vM.X0 )
+        t = constraintObj.Type
+        self.equations = [] #same as the unions added by addConstraints
+        if t == 'plane':
+            if constraintObj.SubElement2.startswith('Face'):
+                self.equations.append( ( 'axisAlignment', constraintObj.directionConstraint ) )
+            self.equations.append( ( 'planeOffset', constraintObj.offset.Value ) )
+        elif t == 'angle_between_planes':
+            self.equations.append( ( 'angle', constraintObj.angle.Value*numpy.pi/180 ) )
+        elif t == 'axial':
+            self.equations += [ ( 'axisAlignment', constraintObj.directionConstraint ), ( 'axisDistance', 0 ) ]
+        elif t == 'circularEdge':
+            self.equations += [ ( 'axisAlignment', constraintObj.directionConstraint ), ( 'axisDistance', 0 ), ( 'planeOffset', constraintObj.offset.Value ) ]
+        elif t == 'sphericalSurface':
+            self.equations.append( ( 'vertex', 0 ) )
+        else:
+            raise NotImplementedError('constraintType %s not supported yet' % t)
+
+    def residuals( self, vM, X ):
+        a1 = vM.rotate( self.obj1Name, self.a1_r, X )
+        a2 = vM.rotate( self.obj2Name, self.a2_r, X )
+        pos1 = vM.rotateAndMove( self.obj1Name, self.pos1_r, X )
+        pos2 = vM.rotateAndMove( self.obj2Name, self.pos2_r, X )
+        r = []
+        for name, value in self.equations:
+            if name == 'axisAlignment':
+                if value == 'aligned':
+                    r.extend( a1 - a2 )
+                elif value == 'opposed':
+                    r.extend( a1 + a2 )
+                else:
+                    r.extend( crossProduct( a1, a2 ) )
+            elif name == 'planeOffset':
+                r.append( dotProduct( a1, pos1 - pos2 ) - value )
+            elif name == 'axisDistance':
+                d = pos2 - pos1
+                r.extend( d - dotProduct( d, a1 ) * a1 )
+            elif name == 'angle':
+                r.append( numpy.cos( value ) - dotProduct( a1, a2 ) )
+            elif name == 'vertex':
+                r.extend( pos1 - pos2 )
+        return numpy.array( r )
+
+
+def independentColumns( J, tol=10**-6 ):
+    '''
+    indexes of a set of linearly independent columns of J spanning its column space, chosen using Gram-Schmidt with column pivoting.
+    Columns with norms less than tol times the largest column norm are treated as zero.
+    '''
+    J = numpy.array( J, dtype=float )
+    norms = numpy.sqrt( (J**2).sum(axis=0) )
+    if len(norms) == 0 or norms.max() == 0:
+        return []
+    threshold = tol * norms.max()
+    columns = []
+    while len(columns) < min( J.shape ):
+        norms = numpy.sqrt( (J**2).sum(axis=0) )
+        j = int( numpy.argmax( norms ) )
+        if norms[j] <= threshold:
+            break
+        q = J[:,j] / norms[j]
+        J = J - numpy.outer( q, dotProduct( q, J ) )
+        columns.append( j )
+    return sorted( columns )
@@ -0,0 +1,145 @@
+'''
+Profiling of the dof_reduction_solver, to find which constraints are responsible for slow solves.
+
+While a SolverProfiler is active (see the solveConstraints profiler argument), the solver records
+  - the time spent in solveConstraintEq for each union, and if the constraint equation was solved analytically or numerically
+  - the iterations, residual and gradient evaluations of the numerical searches, and their norm(f(x)) history (see SearchAnalyticsWrapper)
+  - the number of update() calls of the parent systems, and the update() cascade depth
+  - the cache retrieve/commit/load/save timings
+Results can be exported as JSON, or in the Chrome trace event format (open with chrome://tracing or https://ui.perfetto.dev).
+
+usage
+  profiler = SolverProfiler()
+  solveConstraints( doc, profiler=profiler )
+  print( profiler.summary() )
+  profiler.saveChromeTrace( 'solve_trace.json' )
+'''
+
+import time, json
+from contextlib import contextmanager
+
+active = None #the SolverProfiler of the current solve, None if not profiling
+
+@contextmanager
+def span( name, category, **args ):
+    'records the enclosed block as an event, if a profiler is active'
+    profiler = active
+    if profiler is None:
+        yield
+    else:
+        profiler.begin( name, category, **args )
+        try:
+            yield
+        finally:
+            profiler.end()
+
+class SolverProfiler:
+    def __init__( self ):
+        self.events = [] #dicts with name, cat (category), start, duration (s), self_time (duration excluding nested events), depth, args
+        self.stack = []
+        self.counters = { 'updates':0, 'update_depth_max':0 }
+        self.updateDepth = 0
+        self.t_start = time.time()
+
+    def begin( self, name, category, **args ):
+        event = { 'name':name, 'cat':category, 'start':time.time() - self.t_start, 'depth':len(self.stack), 'args':args, 'nested_time':0.0 }
+        self.events.append( event )
+        self.stack.append( event )
+        return event
+
+    def end( self, **args ):
+        event = self.stack.pop()
+        event['duration'] = time.time() - self.t_start - event['start']
+        event['self_time'] = event['duration'] - event.pop('nested_time')
+        event['args'].update( args )
+        if len(self.stack) > 0:
+            self.stack[-1]['nested_time'] += event['duration']
+        return event
+
+    def finish( self ):
+        'ends the events left open, i.e. by a solver error'
+        while len(self.stack) > 0:
+            self.end( unfinished=True )
+        self.updateDepth = 0
+
+    def annotate( self, **args ):
+        'adds args to the innermost open event, numerical values are added to those already recorded'
+        if len(self.stack) == 0:
+            return
+        eventArgs = self.stack[-1]['args']
+        for k, v in args.items():
+            if k in eventArgs and isinstance( v, (int, float) ) and not isinstance( v, bool ):
+                eventArgs[k] += v
+            else:
+                eventArgs[k] = v
+
+    def addSearch( self, search ):
+        'records a numerical search (SearchAnalyticsWrapper) against the innermost open event'
+        if len(self.stack) > 0:
+            self.stack[-1]['args'].setdefault( 'searches', [] ).append( search )
+
+    def updateStarted( self ):
+        self.counters['updates'] += 1
+        self.updateDepth += 1
+        self.counters['update_depth_max'] = max( self.counters['update_depth_max'], self.updateDepth )
+        self.annotate( updates=1 )
+
+    def updateFinished( self ):
+        self.updateDepth -= 1
+
+    def eventsAsDicts( self ):
+        events = []
+        for e in self.events:
+            e = dict( e, args=dict( e['args'] ) )
+            if 'searches' in e['args']:
+                e['args']['searches'] = [ s.toDict() for s in e['args']['searches'] ]
+            events.append( e )
+        return events
+
+    def toDict( self ):
+        return { 'events': self.eventsAsDicts(), 'counters': dict( self.counters ) }
+
+    def saveJSON( self, fileName ):
+        with open( fileName, 'w' ) as f:
+            json.dump( self.toDict(), f, indent=1 )
+
+    def chromeTrace( self ):
+        'events in the Chrome trace event format, as complete ("X") events with microsecond timestamps'
+        traceEvents = [ {
+            'name': e['name'], 'cat': e['cat'], 'ph': 'X', 'pid': 0, 'tid': 0,
+            'ts': e['start'] * 10**6, 'dur': e.get( 'duration', 0 ) * 10**6, 'args': e['args']
+        } for e in self.eventsAsDicts() ]
+        return { 'traceEvents': traceEvents, 'displayTimeUnit': 'ms', 'otherData': dict( self.counters ) }
+
+    def saveChromeTrace( self, fileName ):
+        with open( fileName, 'w' ) as f:
+            json.dump( self.chromeTrace(), f )
+
+    def constraintTotals( self ):
+        'returns {constraint name: totals}, summing the self_time, evaluations, etc. of the solveConstraintEq events of each constraint'
+        totals = {}
+        for e in self.events:
+            if e['cat'] != 'solveConstraintEq' or not 'duration' in e:
+                continue
+            t = totals.setdefault( e['name'], { 'time':0.0, 'calls':0, 'numerical':0, 'analytical':0, 'evaluations':0, 'jacobians':0, 'updates':0 } )
+            t['time'] += e['self_time']
+            t['calls'] += 1
+            solution = e['args'].get( 'solution' )
+            if solution in [ 'numerical', 'analytical' ]:
+                t[solution] += 1
+            for k in [ 'evaluations', 'jacobians', 'updates' ]:
+                t[k] += e['args'].get( k, 0 )
+        return totals
+
+    def summary( self, n=10 ):
+        'the n constraints with the most solveConstraintEq time (excluding that of the parent systems they trigger)'
+        totals = self.constraintTotals()
+        lines = [ 'solver profile: %i updates, update cascade depth max %i' % ( self.counters['updates'], self.counters['update_depth_max'] ),
+                  '  %-24s %8s %6s %10s %10s %11s %8s' % ( 'constraint', 'time [s]', 'calls', 'analytical', 'numerical', 'evaluations', 'updates' ) ]
+        for name in sorted( totals, key=lambda k: -totals[k]['time'] )[:n]:
+            t = totals[name]
+            lines.append( '  %-24s %8.3f %6i %10i %10i %11i %8i' % ( name, t['time'], t['calls'], t['analytical'], t['numerical'], t['evaluations'], t['updates'] ) )
+        for e in self.events:
+            if e['cat'] == 'cache':
+                lines.append( '  cache %s %3.3fs' % ( e['name'], e.get( 'duration', 0 ) ) )
+        return '\n'.join( lines )
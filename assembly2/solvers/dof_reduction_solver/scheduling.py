@@ -0,0 +1,61 @@
+'''
+Reordering of the constraint queue prior to solving.
+
+The solver adds constraints one at a time, in the order of doc.Objects. An irregular order causes
+  - parts to be added as free objects (AddFreeObjectsUnion), before they are linked to the fixed parts
+  - parts to be constrained to a part which still has degrees of freedom left, so that when that part is later constrained,
+    the parts hanging off it have to be moved as well. Such constraint equations are usually solved numerically instead of analytically.
+
+scheduleConstraints grows the assembly outward from the fixed parts:
+  1. constraints between parts already in the system are added first (so that a part is fully reduced before others are attached to it),
+     those removing the least degrees-of-freedom first, as they are the most likely to be satisfiable using the remaining degrees-of-freedom.
+  2. otherwise a new part is attached, using the constraint which removes the most degrees-of-freedom.
+  3. if no constraint is linked to the system, the first remaining constraint is added (i.e. as free objects).
+Ties are broken using the doc.Objects order. The schedule only depends on the constraint types and the parts they link,
+and not on constraint values, so editing a constraint value does not change the schedule (and the solver cache remains valid).
+'''
+
+def constraintDegreesOfFreedomRemoved( constraintObj ):
+    'number of degrees-of-freedom removed by constraintObj, from the unions addConstraints adds for it'
+    t = constraintObj.Type
+    if t == 'plane':
+        return 3 if constraintObj.SubElement2.startswith('Face') else 1
+    elif t == 'angle_between_planes':
+        return 1
+    elif t == 'axial':
+        return 4 + bool( constraintObj.lockRotation )
+    elif t == 'circularEdge':
+        return 5 + bool( constraintObj.lockRotation )
+    elif t == 'sphericalSurface':
+        return 3
+    return 0 #not supported, addConstraints raises the error
+
+
+def scheduleConstraints( doc, constraintObjectQue, baseObjectName ):
+    '''
+    returns the constraints in constraintObjectQue in the order they should be added to the constraint system.
+    baseObjectName - object fixed in place if none of the objects have a fixedPosition, see findBaseObject
+    '''
+    placed = set( [ baseObjectName ] )
+    for c in constraintObjectQue:
+        for objName in [ c.Object1, c.Object2 ]:
+            if getattr( doc.getObject( objName ), 'fixedPosition', False ):
+                placed.add( objName )
+    remaining = list( constraintObjectQue )
+    schedule = []
+    while len(remaining) > 0:
+        best = None
+        for i, c in enumerate( remaining ):
+            linked = ( c.Object1 in placed ) + ( c.Object2 in placed )
+            if linked == 2:
+                key = ( 0, constraintDegreesOfFreedomRemoved(c), i )
+            elif linked == 1:
+                key = ( 1, -constraintDegreesOfFreedomRemoved(c), i )
+            else:
+                key = ( 2, 0, i )
+            if best == None or key < best[0]:
+                best = key, i
+        c = remaining.pop( best[1] )
+        schedule.append( c )
+        placed.update( [ c.Object1, c.Object2 ] )
+    return schedule
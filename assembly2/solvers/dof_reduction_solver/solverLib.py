@@ -1,7 +1,9 @@
 import numpy
+from numpy import dot
 from numpy.linalg import norm
 from numpy.random import rand
 from .lineSearches import *
+from . import profiler as profilerLib
 
 def toStdOut(txt):
     print(txt)
@@ -88,11 +90,17 @@ class GradientApproximatorCentralDifference:
         return grad_f.transpose()
 
 def solve_via_Newtons_method( f_org, x0, maxStep, grad_f=None, x_tol=10**-6, f_tol=None, maxIt=100, randomPertubationCount=2, 
-                              debugPrintLevel=0, printF=toStdOut, lineSearchIt=5, record=False):
+                              debugPrintLevel=0, printF=toStdOut, lineSearchIt=5, record=False, broydenUpdates=False, broydenStallRatio=0.9):
     '''
     determine the routes of a non-linear equation using netwons method.
+    broydenUpdates - instead of recomputing grad_f every iteration, apply Broyden's rank-one update to the previous iteration's Jacobian.
+                     A fresh Jacobian is calculated if progress stalls, i.e. norm(f(x)) > broydenStallRatio * norm(f(x_previous)) or no step is taken.
     '''
-    f = SearchAnalyticsWrapper(f_org) if record else f_org
+    f = EvaluationCounter( SearchAnalyticsWrapper(f_org) if record else f_org )
+    converged = False
+    A = None
+    jacobians = 0
+    jacobianFresh = True
     n = len(x0)
     x = numpy.array(x0)
     x_c = numpy.zeros(n) * numpy.nan
@@ -111,20 +119,37 @@ def solve_via_Newtons_method( f_org, x0, maxStep, grad_f=None, x_tol=10**-6, f_t
         if debugPrintLevel > 1:
             printF('  x    %s' % x)
             printF('  f(x) %s' % (-b))
+        stalled = False
         if norm(x_c) <= x_tol:
-            break
+            if jacobianFresh:
+                converged = f_tol == None
+                break
+            stalled = True #no step taken using the updated Jacobian
         if f_tol != None:
             if singleEq and abs(b) < f_tol:
+                converged = True
                 break
             elif singleEq==False and all( abs(b) < f_tol ):
+                converged = True
                 break
-        if not isinstance( grad_f, GradientApproximatorForwardDifference):
-            A = grad_f(x)
+        if broydenUpdates and A is not None and not stalled and norm(b) <= broydenStallRatio * norm(f_x_prev):
+            f_x = numpy.atleast_1d( -b )
+            A = A + numpy.outer( f_x - f_x_prev - dot(A, x_c), x_c ) / dot( x_c, x_c )
+            b = numpy.atleast_1d( b )
+            jacobianFresh = False
+            if debugPrintLevel > 1:
+                printF('  Broyden update of grad_f')
         else:
-            A = grad_f(x, f0=-b)
-        if len(A.shape) == 1: #singleEq
-            A = numpy.array([A])
-            b = numpy.array([b])
+            if not isinstance( grad_f, GradientApproximatorForwardDifference):
+                A = grad_f(x)
+            else:
+                A = grad_f(x, f0=-b)
+            jacobians = jacobians + 1
+            jacobianFresh = True
+            if len(A.shape) == 1: #singleEq
+                A = numpy.array([A])
+                b = numpy.array([b])
+        f_x_prev = numpy.atleast_1d( -b ).flatten()
         try:
             x_c, residuals, rank, s = numpy.linalg.lstsq( A, b)
         except ValueError as e:
@@ -156,8 +181,132 @@ def solve_via_Newtons_method( f_org, x0, maxStep, grad_f=None, x_tol=10**-6, f_t
                 x_c = x_c + x_p
                 randomPertubationCount = randomPertubationCount - 1
             x_prev[i,:] = x
+    recordSolverStats( 'newton_broyden' if broydenUpdates else 'newton', i+1, f.count, jacobians, converged )
+    return x
+
+def solve_via_levenberg_marquardt( f_org, x0, maxStep, grad_f=None, x_tol=10**-6, f_tol=None, maxIt=100, lam0=10**-3, lam_max=10**16,
+                                   debugPrintLevel=0, printF=toStdOut, record=False ):
+    '''
+    determine the routes of a non-linear equation using damped least-squares (Levenberg-Marquardt).
+    Variables are scaled by maxStep, and the steps limited to maxStep as done in solve_via_Newtons_method.
+    The damping lam is adjusted according to ratio of the actual to the predicted reduction in norm(f(x))**2 (trust region control),
+    with the Jacobian only recomputed after a step is accepted. 
+    Unlike solve_via_Newtons_method no line searches or random pertubations are used, making the number of function evaluations repeatable.
+    Each iteration is one trial step.
+    '''
+    f = EvaluationCounter( SearchAnalyticsWrapper(f_org) if record else f_org )
+    n = len(x0)
+    x = numpy.array( x0, dtype=float )
+    scale = numpy.ones(n) * maxStep
+    if grad_f == None:
+        grad_f = GradientApproximatorCentralDifference(f)
+    r = numpy.atleast_1d( f(x) )
+    J = None
+    jacobians = 0
+    lam = None
+    nu = 2.0
+    converged = False
+    for i in range(maxIt):
+        cost = dot( r, r )
+        if debugPrintLevel > 0:
+            printF('it %02i: norm(f(x)) %1.1e lam %s' % (i, cost**0.5, '%1.1e' % lam if lam != None else None ))
+        if debugPrintLevel > 1:
+            printF('  x    %s' % x)
+            printF('  f(x) %s' % r)
+        if f_tol != None and all( abs(r) < f_tol ):
+            converged = True
+            break
+        if J is None:
+            J = numpy.atleast_2d( grad_f(x) ) * scale #scaled Jacobian
+            jacobians = jacobians + 1
+            g = dot( J.transpose(), r )
+            H = dot( J.transpose(), J )
+            if lam == None:
+                lam = lam0 * max( H.diagonal().max(), 10**-12 )
+        try:
+            z = numpy.linalg.solve( H + lam*numpy.eye(n), -g )
+        except numpy.linalg.LinAlgError:
+            z = numpy.linalg.lstsq( H + lam*numpy.eye(n), -g )[0]
+        if abs(z).max() > 1:
+            z = z / abs(z).max()
+        x_c = z * scale
+        r_c = numpy.atleast_1d( f(x + x_c) )
+        predicted = cost - norm( r + dot(J, z) )**2
+        actual = cost - dot( r_c, r_c )
+        rho = actual / predicted if predicted > 0 else -1
+        if debugPrintLevel > 1:
+            printF('  x_c  %s, gain ratio %1.2f' % (x_c, rho))
+        if rho > 0: #accept step
+            x = x + x_c
+            r = r_c
+            J = None
+            lam = lam * max( 1.0/3, 1 - (2*rho - 1)**3 )
+            nu = 2.0
+            if norm(x_c) <= x_tol:
+                converged = f_tol == None
+                break
+        else:
+            lam = lam * nu
+            nu = 2 * nu
+            if lam > lam_max:
+                if debugPrintLevel > 0:
+                    printF(' lam > lam_max, no further progress possible')
+                break
+    recordSolverStats( 'levenberg_marquardt', i+1, f.count, jacobians, converged )
     return x
 
+def nullSpace( A, tol=10**-6 ):
+    '''
+    orthonormal basis of the null space of A (as columns), determined using the singular value decomposition.
+    Singular values less than tol times the largest singular value are treated as zero.
+    '''
+    A = numpy.atleast_2d( A )
+    U, S, Vt = numpy.linalg.svd( A )
+    rank = int( sum( S > tol * S.max() ) ) if len(S) > 0 and S.max() > 0 else 0
+    return Vt[rank:].transpose()
+
+class EvaluationCounter:
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+    def __call__(self, x):
+        self.count = self.count + 1
+        return self.f(x)
+    def addNote(self, note):
+        if hasattr(self.f,'addNote'): self.f.addNote(note)
+
+solverStats = {} #solverStats[method] = { 'solves', 'converged', 'iterations', 'evaluations', 'jacobians' }, for comparing the numerical solvers
+
+def recordSolverStats( method, iterations, evaluations, jacobians, converged ):
+    '''
+    evaluations - function evaluations, including those used for approximating gradients
+    jacobians - number of times grad_f was called
+    '''
+    if not method in solverStats:
+        solverStats[method] = { 'solves':0, 'converged':0, 'iterations':0, 'evaluations':0, 'jacobians':0 }
+    stats = solverStats[method]
+    stats['solves'] += 1
+    stats['converged'] += 1 if converged else 0
+    stats['iterations'] += iterations
+    stats['evaluations'] += evaluations
+    stats['jacobians'] += jacobians
+    if profilerLib.active is not None:
+        profilerLib.active.annotate( numerical_solves=1, iterations=iterations, evaluations=evaluations, jacobians=jacobians, converged=converged )
+
+def solverStatsSnapshot():
+    return dict( ( method, dict(stats) ) for method, stats in solverStats.items() )
+
+def solverStatsSummary( snapshot={} ):
+    'summary of the numerical solves since snapshot (see solverStatsSnapshot)'
+    lines = []
+    for method, stats in sorted( solverStats.items() ):
+        start = snapshot.get( method, {} )
+        d = dict( ( k, v - start.get(k,0) ) for k,v in stats.items() )
+        if d['solves'] > 0:
+            lines.append( '%s: %i solves (%i converged), %i iterations, %i function evaluations (%1.1f per solve), %i jacobians' % (
+                method, d['solves'], d['converged'], d['iterations'], d['evaluations'], d['evaluations'] * 1.0 / d['solves'], d['jacobians'] ) )
+    return '; '.join( lines ) if lines else 'no numerical solves'
+
 analytics = {}
 class SearchAnalyticsWrapper:
     def __init__(self, f):
@@ -166,6 +315,8 @@ class SearchAnalyticsWrapper:
         self.f_x = []
         self.notes = {}
         analytics['lastSearch'] = self
+        if profilerLib.active is not None:
+            profilerLib.active.addSearch( self )
     def __call__(self, x):
         self.x.append(x)
         self.f_x.append( self.f(x) )
@@ -176,6 +327,13 @@ class SearchAnalyticsWrapper:
         self.notes[key] = note
     def __repr__(self):
         return '<SearchAnalyticsWrapper %i calls made>' % len(self.x)
+    def toDict(self):
+        'search history for exporting, x is not included as to keep the size down'
+        return {
+            'evaluations': len(self.x),
+            'f_norm': [ float( norm(f_x) ) for f_x in self.f_x ],
+            'notes': dict( ( str(k), v ) for k,v in self.notes.items() )
+        }
     def plot(self):
         from matplotlib import pyplot
         pyplot.figure()
@@ -8,6 +8,19 @@ import FreeCAD
 import assembly2
 import os, time, numpy
 test_assembly_path = os.path.join( assembly2.__dir__ , 'assembly2', 'solvers', 'test_assemblies' )
+#the test assemblies Test_Dof_Reduction_Solver expects to solve, i.e. excluding the known failures testAssembly_11-pipe_assembly and testAssembly_17-bspline_objects
+solvable_test_assemblies = [
+    'testAssembly_01', 'testAssembly_02', 'testAssembly_03', 'testAssembly_04', 'testAssembly_05', 'testAssembly_06', 'testAssembly_07', 'testAssembly_08', 'testAssembly_09',
+    'testAssembly_10-block_iregular_constraint_order',
+    'testAssembly_11b-pipe_assembly',
+    'testAssembly_12-angles_clock_face',
+    'testAssembly_13-spherical_surfaces_hip',
+    'testAssembly_13-spherical_surfaces_cube_vertices',
+    'testAssembly_14-lock_relative_axial_rotation',
+    'testAssembly_15-triangular_link_assembly',
+    'testAssembly_16-revolved_surface_objs',
+    'testAssembly_18-add_free_objects',
+]
 from assembly2.solvers import solveConstraints
 from assembly2.core import debugPrint
 
@@ -31,10 +44,10 @@ class Test_Dof_Reduction_Solver(unittest.TestCase):
     @classmethod
     def tearDownClass(cls):
         debugPrint(0,'\n------------------------------------------')
-        debugPrint(0,'  dof_reduction_solver passed %i/%i tests' % ( stats.n_solved, stats.n_attempted ) )
-        debugPrint(0,'    time solver:            %3.2f s' % stats.t_solver )
-        debugPrint(0,'    time cached solutions:  %3.2f s' % stats.t_cache )
-        debugPrint(0,'    total running time:     %3.2f s' % (time.time() - stats.t_start) )
+        debugPrint(0,'  dof_reduction_solver passed %i/%i tests', stats.n_solved, stats.n_attempted )
+        debugPrint(0,'    time solver:            %3.2f s', stats.t_solver )
+        debugPrint(0,'    time cached solutions:  %3.2f s', stats.t_cache )
+        debugPrint(0,'    total running time:     %3.2f s', time.time() - stats.t_start )
         debugPrint(0,'------------------------------------------')
 
 
@@ -147,6 +160,538 @@ class Test_Dof_Reduction_Solver(unittest.TestCase):
 
         
 
+# python2 test.py assembly2.solvers.dof_reduction_solver.tests.Test_split_components
+class Test_split_components(unittest.TestCase):
+    'solutions from solving independent sub-assemblies separately should satisfy the constraints of the complete assembly'
+
+    def placements( self, doc ):
+        P = []
+        for obj in doc.Objects:
+            if hasattr( obj, 'Placement' ) and not 'ConstraintInfo' in obj.Content:
+                P = P + list( obj.Placement.Base ) + list( obj.Placement.Rotation.Q )
+        return numpy.array(P)
+
+    def _test_file( self, testFile_basename, processes=1 ):
+        doc =  FreeCAD.open( os.path.join( test_assembly_path, testFile_basename + '.fcstd' ) )
+        constraintSystem = solveConstraints( doc, solver_name = 'dof_reduction_solver', use_cache = False, showFailureErrorDialog=False, split_components=True, processes=processes )
+        self.assertTrue( constraintSystem != None, 'split_components solve failed' )
+        P = self.placements( doc )
+        solveConstraints( doc, solver_name = 'dof_reduction_solver', use_cache = False, showFailureErrorDialog=False )
+        self.assertTrue(
+            numpy.allclose( P, self.placements( doc ) ),
+            'split_components solution differs from complete assembly solution: %s != %s' % ( P, self.placements( doc ) )
+        )
+        FreeCAD.closeDocument( doc.Name )
+
+    def test_constraintComponents( self ):
+        from components import constraintComponents
+        doc =  FreeCAD.open( os.path.join( test_assembly_path, 'testAssembly_02.fcstd' ) )
+        constraintObjectQue = [ obj for obj in doc.Objects if 'ConstraintInfo' in obj.Content ]
+        components = constraintComponents( doc, constraintObjectQue )
+        self.assertEqual( sum( len(constraints) for objectNames, constraints in components ), len(constraintObjectQue) )
+        for objectNames, constraints in components:
+            for c in constraints:
+                self.assertTrue( c.Object1 in objectNames and c.Object2 in objectNames )
+        FreeCAD.closeDocument( doc.Name )
+
+    def test_components_cache( self ):
+        'resolving with use_cache, the cached solution of every component should be reused'
+        import assembly2.solvers.dof_reduction_solver as dof_reduction_solver
+        doc =  FreeCAD.open( os.path.join( test_assembly_path, 'testAssembly_18-add_free_objects.fcstd' ) )
+        solveConstraints( doc, solver_name = 'dof_reduction_solver', use_cache = True, showFailureErrorDialog=False, split_components=True )
+        self.assertTrue( any( c.holdsDocument( doc ) for c in dof_reduction_solver.componentsCacheManager.caches.values() ) )
+        P = self.placements( doc )
+        constraintSystem = solveConstraints( doc, solver_name = 'dof_reduction_solver', use_cache = True, showFailureErrorDialog=False, split_components=True )
+        self.assertTrue( constraintSystem != None )
+        self.assertTrue( numpy.allclose( P, self.placements( doc ) ), 'cached solution differs: %s != %s' % ( P, self.placements( doc ) ) )
+        FreeCAD.closeDocument( doc.Name )
+
+    def testAssembly_02( self ):
+        self._test_file( 'testAssembly_02' )
+
+    def testAssembly_15_triangular_link_assembly( self ):
+        self._test_file( 'testAssembly_15-triangular_link_assembly' )
+
+    def testAssembly_18_add_free_objects( self ):
+        self._test_file( 'testAssembly_18-add_free_objects' )
+
+    def testAssembly_18_add_free_objects_parallel( self ):
+        self._test_file( 'testAssembly_18-add_free_objects', processes=2 )
+
+
+# python2 test.py assembly2.solvers.dof_reduction_solver.tests.Test_cache_retrieve
+class Test_cache_retrieve(unittest.TestCase):
+    'SolverCache.retrieve with copy-on-write snapshots, versus copy.deepcopy of the cached constraint system'
+    testFiles = [
+        'testAssembly_02',
+        'testAssembly_05',
+        'testAssembly_10-block_iregular_constraint_order',
+        'testAssembly_11b-pipe_assembly',
+        'testAssembly_12-angles_clock_face',
+        'testAssembly_13-spherical_surfaces_hip',
+        'testAssembly_15-triangular_link_assembly',
+        'testAssembly_18-add_free_objects',
+    ]
+
+    def _cache( self, doc ):
+        'solves doc, returning its SolverCache'
+        import assembly2.solvers.dof_reduction_solver as dof_reduction_solver
+        from assembly2.solvers.dof_reduction_solver import cacheLib
+        defaultCacheManager = dof_reduction_solver.cacheManager
+        dof_reduction_solver.cacheManager = cacheLib.SolverCacheManager()
+        try:
+            solveConstraints( doc, solver_name = 'dof_reduction_solver', use_cache = True, showFailureErrorDialog=False, split_components=False )
+            return list( dof_reduction_solver.cacheManager.caches.values() )[0]
+        finally:
+            dof_reduction_solver.cacheManager = defaultCacheManager
+
+    def _retrieve( self, cache, doc ):
+        'retrieves the cached constraint system for every constraint in doc, as done by solveConstraints'
+        from assembly2.solvers.dof_reduction_solver import FixedObjectSystem, findBaseObject
+        constraintObjectQue = [ obj for obj in doc.Objects if 'ConstraintInfo' in obj.Content ]
+        objectNames = sorted( cache.vM.index.keys(), key = lambda objName : cache.vM.index[objName] )
+        variableManager = cache.vM.__class__( doc, objectNames )
+        rootSystem = FixedObjectSystem( variableManager, findBaseObject( doc, objectNames ) )
+        constraintSystem, que_start = cache.retrieve( rootSystem, constraintObjectQue )
+        self.assertEqual( que_start, len(constraintObjectQue) )
+        constraintSystem.update()
+        return constraintSystem
+
+    def _test_file( self, testFile_basename ):
+        doc =  FreeCAD.open( os.path.join( test_assembly_path, testFile_basename + '.fcstd' ) )
+        try:
+            cache = self._cache( doc )
+            X = {}
+            for copyOnWrite in [ False, True ]:
+                cache.copyOnWrite = copyOnWrite
+                X[copyOnWrite] = self._retrieve( cache, doc ).variableManager.X
+            self.assertTrue( numpy.allclose( X[False], X[True] ), 'copy-on-write retrieve differs from deepcopy retrieve: %s != %s' % ( X[False], X[True] ) )
+        finally:
+            FreeCAD.closeDocument( doc.Name )
+
+    def test_assemblies( self ):
+        for testFile_basename in self.testFiles:
+            self._test_file( testFile_basename )
+
+    def test_mutating_retrieved_system( self ):
+        'changes made to a retrieved system, by the solve it is retrieved for, should not reach the cached snapshot'
+        from assembly2.solvers.dof_reduction_solver.constraintSystems import Assembly2SolverError
+        for testFile_basename in self.testFiles:
+            doc =  FreeCAD.open( os.path.join( test_assembly_path, testFile_basename + '.fcstd' ) )
+            try:
+                cache = self._cache( doc )
+                constraintSystem = self._retrieve( cache, doc )
+                X = constraintSystem.variableManager.X.copy()
+                degreesOfFreedom = [ d.str() for d in constraintSystem.degreesOfFreedom ]
+                for d in constraintSystem.degreesOfFreedom:
+                    d.setValue( d.getValue() + 0.3 )
+                try:
+                    constraintSystem.update()
+                except Assembly2SolverError: #numerical solves may fail after the dofs are moved, the systems they were updating are left changed either way
+                    pass
+                constraintSystem.degreesOfFreedom = []
+                constraintSystem.parentSystem.label = 'mutated'
+                constraintSystem = self._retrieve( cache, doc )
+                self.assertTrue( numpy.allclose( constraintSystem.variableManager.X, X ), '%s: %s != %s' % ( testFile_basename, constraintSystem.variableManager.X, X ) )
+                self.assertEqual( [ d.str() for d in constraintSystem.degreesOfFreedom ], degreesOfFreedom )
+                self.assertNotEqual( constraintSystem.parentSystem.label, 'mutated' )
+            finally:
+                FreeCAD.closeDocument( doc.Name )
+
+
+# python2 test.py assembly2.solvers.dof_reduction_solver.tests.Test_persistent_cache
+class Test_persistent_cache(unittest.TestCase):
+    'after reopening a document, the solver cache saved next to it should give a warm solve reusing every constraint'
+
+    def _test_file( self, testFile_basename ):
+        import assembly2.solvers.dof_reduction_solver as dof_reduction_solver
+        from assembly2.solvers.dof_reduction_solver import cacheLib, VariableManager, FixedObjectSystem, findBaseObject
+        testFile = os.path.join( test_assembly_path, testFile_basename + '.fcstd' )
+        defaultCacheManager = dof_reduction_solver.cacheManager
+        dof_reduction_solver.cacheManager = cacheLib.SolverCacheManager()
+        try:
+            doc =  FreeCAD.open( testFile )
+            constraintSystem = solveConstraints( doc, solver_name = 'dof_reduction_solver', use_cache = True, persistent_cache = True, showFailureErrorDialog=False, split_components=False )
+            X_org = constraintSystem.variableManager.X
+            FreeCAD.closeDocument( doc.Name )
+            cache = cacheLib.SolverCache() #as after restarting FreeCAD
+            doc =  FreeCAD.open( testFile )
+            self.assertTrue( cacheLib.loadCache( cache, doc ) )
+            constraintObjectQue = [ obj for obj in doc.Objects if 'ConstraintInfo' in obj.Content ]
+            objectNames = sorted( cache.vM.index.keys(), key = lambda objName : cache.vM.index[objName] )
+            variableManager = VariableManager( doc, objectNames )
+            constraintSystem, que_start = cache.retrieve( FixedObjectSystem( variableManager, findBaseObject( doc, objectNames ) ), constraintObjectQue )
+            self.assertEqual( que_start, len(constraintObjectQue) )
+            constraintSystem = solveConstraints( doc, solver_name = 'dof_reduction_solver', use_cache = True, persistent_cache = True, showFailureErrorDialog=False, split_components=False )
+            self.assertTrue(
+                numpy.allclose( X_org , constraintSystem.variableManager.X ),
+                'solution using the cache file differs from originial solution: %s != %s' % ( X_org , constraintSystem.variableManager.X )
+            )
+            FreeCAD.closeDocument( doc.Name )
+        finally:
+            dof_reduction_solver.cacheManager = defaultCacheManager
+            if os.path.exists( os.path.join( test_assembly_path, testFile_basename + cacheLib.cacheFileSuffix ) ):
+                os.remove( os.path.join( test_assembly_path, testFile_basename + cacheLib.cacheFileSuffix ) )
+
+    def testAssembly_02( self ):
+        self._test_file( 'testAssembly_02' )
+
+    def testAssembly_11b_pipe_assembly( self ):
+        self._test_file( 'testAssembly_11b-pipe_assembly' )
+
+    def test_disallowed_classes( self ):
+        'a cache file refering to anything other than solver classes, numpy arrays and basic builtin types should not be loaded'
+        import pickle, zlib
+        from assembly2.solvers.dof_reduction_solver import cacheLib
+        testFile = os.path.join( test_assembly_path, 'testAssembly_02.fcstd' )
+        doc =  FreeCAD.open( testFile )
+        try:
+            with open( cacheLib.cacheFilename( doc ), 'wb' ) as f:
+                f.write( zlib.compress( pickle.dumps( { 'format': cacheLib.cacheFileFormat, 'class': 'SolverCache', 'cache': os.getcwd } ) ) )
+            self.assertFalse( cacheLib.loadCache( cacheLib.SolverCache(), doc ) )
+        finally:
+            FreeCAD.closeDocument( doc.Name )
+            os.remove( os.path.join( test_assembly_path, 'testAssembly_02' + cacheLib.cacheFileSuffix ) )
+
+    def test_dotted_names( self ):
+        'dotted names would reach objects imported into the solver modules, such as io.FileIO in cache.py'
+        import pickle, io
+        from assembly2.solvers.dof_reduction_solver import cacheLib
+        payload = b'\x80\x02c' + cacheLib.__name__.encode('ascii') + b'\nio.FileIO\n.'
+        self.assertRaises( pickle.UnpicklingError, cacheLib._DocumentUnpickler( io.BytesIO( payload ), None ).load )
+        self.assertRaises( pickle.UnpicklingError, cacheLib._DocumentUnpickler( io.BytesIO(), None ).find_class, cacheLib.__name__, 'io' )
+
+
+# python2 test.py assembly2.solvers.dof_reduction_solver.tests.Test_cache_fingerprints
+class Test_cache_fingerprints(unittest.TestCase):
+
+    def test_fingerprints( self ):
+        'the CacheInputs of an unchanged document should have equal fingerprints, with the sub-element geometry read from the geometry store the second time'
+        from assembly2.solvers.dof_reduction_solver import cacheLib, VariableManager
+        doc =  FreeCAD.open( os.path.join( test_assembly_path, 'testAssembly_11b-pipe_assembly.fcstd' ) )
+        constraintObjectQue = [ obj for obj in doc.Objects if 'ConstraintInfo' in obj.Content ]
+        objectNames = sorted( set( sum( [ [ c.Object1, c.Object2 ] for c in constraintObjectQue ], [] ) ) )
+        from assembly2.solvers.common import geometryStore
+        geometryStore.clear()
+        inputs = [ cacheLib.CacheInput( VariableManager( doc, objectNames ), c ) for c in constraintObjectQue ]
+        n_stored = len( geometryStore )
+        self.assertTrue( n_stored > 0 )
+        inputs_2 = [ cacheLib.CacheInput( VariableManager( doc, objectNames ), c ) for c in constraintObjectQue ]
+        self.assertEqual( len( geometryStore ), n_stored )
+        self.assertEqual( inputs, inputs_2 )
+        self.assertEqual( set( inputs ), set( inputs_2 ) )
+        FreeCAD.closeDocument( doc.Name )
+
+    def test_stored_cacheInputs( self ):
+        'SolverCache.cacheInput should compute the CacheInput of an unchanged constraint only once'
+        from assembly2.solvers.dof_reduction_solver import cacheLib, VariableManager
+        doc =  FreeCAD.open( os.path.join( test_assembly_path, 'testAssembly_11b-pipe_assembly.fcstd' ) )
+        constraintObjectQue = [ obj for obj in doc.Objects if 'ConstraintInfo' in obj.Content ]
+        objectNames = sorted( set( sum( [ [ c.Object1, c.Object2 ] for c in constraintObjectQue ], [] ) ) )
+        cache = cacheLib.SolverCache()
+        variableManager = VariableManager( doc, objectNames )
+        for c in constraintObjectQue:
+            self.assertTrue( cache.cacheInput( variableManager, c ) is cache.cacheInput( variableManager, c ) )
+        FreeCAD.closeDocument( doc.Name )
+
+    def test_quantize( self ):
+        from assembly2.solvers.dof_reduction_solver.cache import quantize, fingerprintTolerance
+        self.assertEqual( quantize( [ 1.0, -2.0, 0 ] ), quantize( [ 1.0 + 0.1*fingerprintTolerance, -2.0 - 0.1*fingerprintTolerance, -0.0 ] ) )
+        self.assertNotEqual( quantize( [ 1.0 ] ), quantize( [ 1.0 + 2*fingerprintTolerance ] ) )
+
+
+# python2 test.py assembly2.solvers.dof_reduction_solver.tests.Test_geometry_store
+class Test_geometry_store(unittest.TestCase):
+    'positions and axes read from the geometry store should match getSubElementPos/getSubElementAxis, also after the objects are moved'
+
+    def _test_file( self, testFile_basename ):
+        from assembly2.solvers.common import geometryStore, subElementPos, subElementAxis, subElementCategory
+        from assembly2.selection import getSubElementPos, getSubElementAxis
+        doc =  FreeCAD.open( os.path.join( test_assembly_path, testFile_basename + '.fcstd' ) )
+        subElements = []
+        for c in doc.Objects:
+            if 'ConstraintInfo' in c.Content:
+                subElements = subElements + [ ( doc.getObject( c.Object1 ), c.SubElement1 ), ( doc.getObject( c.Object2 ), c.SubElement2 ) ]
+        geometryStore.clear()
+        for i in range(2): #moving the objects the second time around, after the geometry has been stored
+            for obj, subElementName in subElements:
+                if i == 1:
+                    obj.Placement.Base = obj.Placement.Base + FreeCAD.Vector( 1, 2, 3 )
+                    obj.Placement.Rotation = obj.Placement.Rotation.multiply( FreeCAD.Rotation( FreeCAD.Vector(0,0,1), 10 ) )
+                self.assertTrue( numpy.allclose( subElementPos( obj, subElementName ), getSubElementPos( obj, subElementName ) ) )
+                if subElementCategory( obj, subElementName ) in ['plane','cylindricalSurface','circularEdge','linearEdge']:
+                    self.assertTrue( numpy.allclose( subElementAxis( obj, subElementName ), getSubElementAxis( obj, subElementName ) ) )
+            if i == 0:
+                n_stored = len( geometryStore )
+        self.assertEqual( len( geometryStore ), n_stored, 'moving the objects should not add geometry store entries' )
+        FreeCAD.closeDocument( doc.Name )
+
+    def testAssembly_11b_pipe_assembly( self ):
+        self._test_file( 'testAssembly_11b-pipe_assembly' )
+
+    def testAssembly_16_revolved_surface_objs( self ):
+        self._test_file( 'testAssembly_16-revolved_surface_objs' )
+
+    def test_eviction( self ):
+        'the least recently used entries should be evicted once the store is full'
+        import assembly2.solvers.common as common
+        doc =  FreeCAD.open( os.path.join( test_assembly_path, 'testAssembly_11b-pipe_assembly.fcstd' ) )
+        c = [ obj for obj in doc.Objects if 'ConstraintInfo' in obj.Content ][0]
+        obj1, obj2 = doc.getObject( c.Object1 ), doc.getObject( c.Object2 )
+        geometryStoreLimit = common.geometryStoreLimit
+        common.geometryStore.clear()
+        common.geometryStoreLimit = 1
+        try:
+            common.subElementPos( obj1, c.SubElement1 )
+            common.subElementPos( obj2, c.SubElement2 )
+            self.assertEqual( len( common.geometryStore ), 1 )
+            self.assertEqual( list( common.geometryStore.keys() )[0][1:3], ( c.Object2, c.SubElement2 ) )
+        finally:
+            common.geometryStoreLimit = geometryStoreLimit
+            FreeCAD.closeDocument( doc.Name )
+
+
+# python2 test.py assembly2.solvers.dof_reduction_solver.tests.Test_cache_manager
+class Test_cache_manager(unittest.TestCase):
+    'switching between open assemblies should reuse the cached solution of each assembly'
+
+    def test_switching_documents( self ):
+        import assembly2.solvers.dof_reduction_solver as dof_reduction_solver
+        from assembly2.solvers.dof_reduction_solver import cacheLib
+        defaultCacheManager = dof_reduction_solver.cacheManager
+        cacheManager = cacheLib.SolverCacheManager()
+        dof_reduction_solver.cacheManager = cacheManager
+        docs = [ FreeCAD.open( os.path.join( test_assembly_path, testFile_basename + '.fcstd' ) ) for testFile_basename in [ 'testAssembly_02', 'testAssembly_15-triangular_link_assembly' ] ]
+        try:
+            for i in range(3):
+                for doc in docs:
+                    self.assertTrue( solveConstraints( doc, solver_name = 'dof_reduction_solver', use_cache = True, showFailureErrorDialog=False, split_components=False ) != None )
+            self.assertEqual( cacheManager.stats, { 'hits':4, 'misses':2, 'evictions':0 } )
+            cacheManager.memoryBudget = 0 #only the most recently used cache is kept
+            solveConstraints( docs[0], solver_name = 'dof_reduction_solver', use_cache = True, showFailureErrorDialog=False, split_components=False )
+            self.assertEqual( cacheManager.stats['evictions'], 1 )
+            self.assertEqual( len( cacheManager.caches ), 1 )
+            debugPrint(1, cacheManager.statsSummary() )
+        finally:
+            dof_reduction_solver.cacheManager = defaultCacheManager
+            for doc in docs:
+                FreeCAD.closeDocument( doc.Name )
+
+
+# python2 test.py assembly2.solvers.dof_reduction_solver.tests.Test_update_memoization
+class Test_update_memoization(unittest.TestCase):
+    'skipping update() for systems whose objects placement variables are unchanged should not alter the solution'
+
+    def _test_file( self, testFile_basename ):
+        from constraintSystems import ConstraintSystemPrototype, updateStats
+        X = {}
+        for updateMemoization in [ False, True ]:
+            ConstraintSystemPrototype.updateMemoization = updateMemoization
+            doc =  FreeCAD.open( os.path.join( test_assembly_path, testFile_basename + '.fcstd' ) )
+            updateStats_start = dict( updateStats )
+            try:
+                constraintSystem = solveConstraints( doc, solver_name = 'dof_reduction_solver', use_cache = False, showFailureErrorDialog=False )
+            finally:
+                ConstraintSystemPrototype.updateMemoization = True
+            debugPrint(1, '%s updateMemoization=%s: updates %i, skipped %i', testFile_basename, updateMemoization, updateStats['updates'] - updateStats_start['updates'], updateStats['skipped'] - updateStats_start['skipped'] )
+            X[updateMemoization] = constraintSystem.variableManager.X
+            FreeCAD.closeDocument( doc.Name )
+        self.assertTrue( numpy.allclose( X[False], X[True] ), 'solution with updateMemoization differs: %s != %s' % ( X[False], X[True] ) )
+
+    def testAssembly_10_block_iregular_constraint_order( self ):
+        self._test_file( 'testAssembly_10-block_iregular_constraint_order')
+
+    def testAssembly_11b_pipe_assembly( self ):
+        self._test_file( 'testAssembly_11b-pipe_assembly' )
+
+
+# python2 test.py assembly2.solvers.dof_reduction_solver.tests.Test_rotation_cache
+class Test_rotation_cache(unittest.TestCase):
+    'VariableManager.rotationMatrices should return the cached matrices while an objects rotation variables are unchanged, and recalculate them once they change'
+
+    def test_rotation_matrices( self ):
+        from assembly2.solvers.dof_reduction_solver.variableManager import VariableManager, QuaternionVariableManager
+        doc =  FreeCAD.open( os.path.join( test_assembly_path, 'testAssembly_15-triangular_link_assembly.fcstd' ) )
+        try:
+            for variableManager_class in [ VariableManager, QuaternionVariableManager ]:
+                vM = variableManager_class( doc )
+                X = vM.X.copy() + 0.1
+                for objectName, i in vM.index.items():
+                    R, R_T = vM.rotationMatrices( objectName, X )
+                    self.assertTrue( numpy.allclose( R, vM.calculateRotationMatrix( objectName, X[i+3:i+6] ) ) )
+                    self.assertTrue( numpy.allclose( R_T, R.transpose() ) )
+                    X_moved = X.copy()
+                    X_moved[i:i+3] = X_moved[i:i+3] + 1.0 #translation only, cache hit
+                    R_hit, R_T_hit = vM.rotationMatrices( objectName, X_moved )
+                    self.assertTrue( R_hit is R and R_T_hit is R_T )
+                    X_rotated = X.copy()
+                    X_rotated[i+4] = X_rotated[i+4] + 0.2 #rotation variable changed, so the cache entry is invalid
+                    R_new, R_T_new = vM.rotationMatrices( objectName, X_rotated )
+                    self.assertFalse( numpy.allclose( R_new, R ) )
+                    self.assertTrue( numpy.allclose( R_new, vM.calculateRotationMatrix( objectName, X_rotated[i+3:i+6] ) ) )
+                    self.assertTrue( numpy.allclose( vM.rotationMatrices( objectName, X )[0], R ) )
+        finally:
+            FreeCAD.closeDocument( doc.Name )
+
+
+# python2 test.py assembly2.solvers.dof_reduction_solver.tests.Test_quaternion_parameterization
+class Test_quaternion_parameterization(unittest.TestCase):
+    'solving with rotation_parameterization="quaternion" should satisfy every constraint, leaving the same number of degrees of freedom'
+
+    def _test_file( self, testFile_basename ):
+        n_dofs = {}
+        for rotation_parameterization in [ 'azimuth_elevation', 'quaternion' ]:
+            doc =  FreeCAD.open( os.path.join( test_assembly_path, testFile_basename + '.fcstd' ) )
+            constraintSystem = solveConstraints( doc, solver_name = 'dof_reduction_solver', use_cache = False, showFailureErrorDialog=False, rotation_parameterization=rotation_parameterization )
+            self.assertTrue( constraintSystem != None, '%s solve failed' % rotation_parameterization )
+            n_dofs[rotation_parameterization] = len( constraintSystem.degreesOfFreedom )
+            X = constraintSystem.variableManager.X
+            while constraintSystem.parentSystem != None:
+                self.assertTrue( abs( constraintSystem.constraintEq_value(X) ) <= constraintSystem.solveConstraintEq_tol, '%s not satisfied' % constraintSystem.str() )
+                constraintSystem = constraintSystem.parentSystem
+            FreeCAD.closeDocument( doc.Name )
+        self.assertEqual( n_dofs['azimuth_elevation'], n_dofs['quaternion'] )
+
+    def testAssembly_04_angle_constraint( self ):
+        self._test_file( 'testAssembly_04' )
+
+    def testAssembly_11b_pipe_assembly( self ):
+        self._test_file( 'testAssembly_11b-pipe_assembly' )
+
+    def testAssembly_13_spherical_surfaces_hip( self ):
+        self._test_file( 'testAssembly_13-spherical_surfaces_hip' )
+
+    def testAssembly_15_triangular_link_assembly( self ):
+        self._test_file( 'testAssembly_15-triangular_link_assembly' )
+
+
+# python2 test.py assembly2.solvers.dof_reduction_solver.tests.Test_analytical_gradients
+class Test_analytical_gradients(unittest.TestCase):
+    'analyticalGradient is on by default, so constraintEq_grad should agree with central differences on the test assemblies'
+
+    def test_assemblies( self ):
+        from constraintSystems import ConstraintSystemPrototype, gradientCheckStats
+        stats_start = dict( gradientCheckStats )
+        ConstraintSystemPrototype.analyticalGradientCheck = True
+        try:
+            for testFile_basename in solvable_test_assemblies:
+                doc =  FreeCAD.open( os.path.join( test_assembly_path, testFile_basename + '.fcstd' ) )
+                try:
+                    failures_start = gradientCheckStats['failures']
+                    constraintSystem = solveConstraints( doc, solver_name = 'dof_reduction_solver', use_cache = False, showFailureErrorDialog=False )
+                    self.assertTrue( constraintSystem != None, '%s solve failed' % testFile_basename )
+                    self.assertEqual( gradientCheckStats['failures'], failures_start, '%s analytical gradient check failed' % testFile_basename )
+                finally:
+                    FreeCAD.closeDocument( doc.Name )
+        finally:
+            ConstraintSystemPrototype.analyticalGradientCheck = False
+        debugPrint(0, 'analytical gradient checks %i, failures %i', *[ gradientCheckStats[k] - stats_start[k] for k in [ 'checks', 'failures' ] ] )
+
+
+# python2 test.py assembly2.solvers.dof_reduction_solver.tests.Test_constraint_scheduling
+class Test_constraint_scheduling(unittest.TestCase):
+    'solving the solvable test assemblies in doc.Objects order and in scheduled order; scheduling should never add numerical solutions, and should remove some for the irregularly ordered testAssembly_10'
+
+    def test_assemblies( self ):
+        from constraintSystems import solutionStats
+        from scheduling import scheduleConstraints
+        from assembly2.solvers.common import findBaseObject
+        totals = { False:[0,0], True:[0,0] }
+        for testFile_basename in solvable_test_assemblies:
+            doc =  FreeCAD.open( os.path.join( test_assembly_path, testFile_basename + '.fcstd' ) )
+            try:
+                constraintObjectQue = [ obj for obj in doc.Objects if 'ConstraintInfo' in obj.Content ]
+                objectNames = sum( [ [ c.Object1, c.Object2 ] for c in constraintObjectQue ], [] )
+                schedule = scheduleConstraints( doc, constraintObjectQue, findBaseObject( doc, objectNames ) )
+                self.assertEqual( sorted( c.Name for c in schedule ), sorted( c.Name for c in constraintObjectQue ) )
+                self.assertEqual( schedule, scheduleConstraints( doc, constraintObjectQue, findBaseObject( doc, objectNames ) ) )
+                counts = {}
+                for schedule_constraints in [ False, True ]:
+                    stats_start = dict( solutionStats )
+                    constraintSystem = solveConstraints( doc, solver_name = 'dof_reduction_solver', use_cache = False, showFailureErrorDialog=False, schedule_constraints=schedule_constraints )
+                    self.assertTrue( constraintSystem != None, '%s solve failed, schedule_constraints=%s' % ( testFile_basename, schedule_constraints ) )
+                    counts[schedule_constraints] = [ solutionStats[k] - stats_start[k] for k in [ 'analytical', 'numerical' ] ]
+                    for i in range(2):
+                        totals[schedule_constraints][i] += counts[schedule_constraints][i]
+                debugPrint(1, '%s: analytical/numerical solutions %i/%i, scheduled %i/%i', testFile_basename, *( counts[False] + counts[True] ) )
+                self.assertTrue( counts[True][1] <= counts[False][1], '%s: more numerical solutions when scheduled, %i > %i' % ( testFile_basename, counts[True][1], counts[False][1] ) )
+                if testFile_basename == 'testAssembly_10-block_iregular_constraint_order':
+                    self.assertTrue( counts[True][1] < counts[False][1], '%s: scheduling did not reduce the numerical solutions (%i)' % ( testFile_basename, counts[True][1] ) )
+            finally:
+                FreeCAD.closeDocument( doc.Name )
+        debugPrint(0, 'analytical/numerical solutions of the constraint equations: doc.Objects order %i/%i, scheduled %i/%i', *( totals[False] + totals[True] ) )
+
+
+# python2 test.py assembly2.solvers.dof_reduction_solver.tests.Test_solver_profiler
+class Test_solver_profiler(unittest.TestCase):
+
+    def test_profile( self ):
+        import json
+        import profiler
+        doc =  FreeCAD.open( os.path.join( test_assembly_path, 'testAssembly_15-triangular_link_assembly.fcstd' ) )
+        solverProfiler = profiler.SolverProfiler()
+        constraintSystem = solveConstraints( doc, solver_name = 'dof_reduction_solver', use_cache = True, showFailureErrorDialog=False, profiler=solverProfiler )
+        self.assertFalse( constraintSystem is None )
+        self.assertTrue( profiler.active is None, 'profiler should only be active during the solve' )
+        constraintNames = [ obj.Name for obj in doc.Objects if 'ConstraintInfo' in obj.Content ]
+        totals = solverProfiler.constraintTotals()
+        self.assertEqual( sorted( totals.keys() ), sorted( constraintNames ) )
+        self.assertTrue( all( 'duration' in e for e in solverProfiler.events ) )
+        self.assertTrue( 'commit' in [ e['name'] for e in solverProfiler.events if e['cat'] == 'cache' ] )
+        trace = json.loads( json.dumps( solverProfiler.chromeTrace() ) )
+        self.assertEqual( len( trace['traceEvents'] ), len( solverProfiler.events ) )
+        json.dumps( solverProfiler.toDict() )
+        debugPrint(1, solverProfiler.summary() )
+        FreeCAD.closeDocument( doc.Name )
+
+
+# python2 test.py assembly2.solvers.dof_reduction_solver.tests.Test_debug_trace
+class Test_debug_trace(unittest.TestCase):
+
+    def setUp( self ):
+        self.level = debugPrint.level
+        debugPrint.level = 0
+
+    def tearDown( self ):
+        debugPrint.disableTrace()
+        debugPrint.level = self.level
+
+    def test_lazy_messages( self ):
+        calls = []
+        def msg():
+            calls.append( 1 )
+            return 'message'
+        debugPrint( 4, msg )
+        self.assertEqual( calls, [] )
+        self.assertEqual( debugPrint.guard, 0 )
+        debugPrint.enableTrace( level=4, size=3 )
+        self.assertEqual( debugPrint.guard, 4 )
+        X = numpy.zeros(2)
+        debugPrint( 4, 'X %s', X )
+        X[0] = 1
+        self.assertEqual( debugPrint.traceMessages(), [ 'X %s' % numpy.zeros(2) ] )
+        names = [ 'a' ]
+        debugPrint( 4, 'names %s', names )
+        names.append( 'b' ) #traced messages are formatted when traced
+        self.assertEqual( debugPrint.traceMessages()[-1], "names ['a']" )
+        for i in range(5):
+            debugPrint( 4, 'message %i', i )
+        debugPrint( 5, 'not traced %i', 5 )
+        self.assertEqual( debugPrint.traceMessages(), [ 'message 2', 'message 3', 'message 4' ] )
+        debugPrint.disableTrace()
+        self.assertEqual( debugPrint.guard, 0 )
+
+    def test_solve_with_trace( self ):
+        doc =  FreeCAD.open( os.path.join( test_assembly_path, 'testAssembly_15-triangular_link_assembly.fcstd' ) )
+        debugPrint.enableTrace( level=4, size=200 )
+        constraintSystem = solveConstraints( doc, solver_name = 'dof_reduction_solver', use_cache = False, showFailureErrorDialog=False )
+        self.assertFalse( constraintSystem is None )
+        messages = debugPrint.traceMessages()
+        self.assertTrue( 0 < len(messages) <= 200 )
+        self.assertTrue( any( m.startswith('Constraint system solved') for m in messages ) )
+        FreeCAD.closeDocument( doc.Name )
+
+
 # python2 test.py assembly2.solvers.dof_reduction_solver.tests.Tests_solverLib
 class Tests_solverLib(unittest.TestCase):
 
@@ -181,6 +726,56 @@ class Tests_solverLib(unittest.TestCase):
         xMin = solve_via_Newtons_method( self.f1, rand(2)+3, maxStep, x_tol=0, debugPrintLevel=0 )
         self.assertAllClose( xMin, [2, -1 ] )
 
+    def test_solve_via_Newtons_method_broyden( self ):
+        from solverLib import solve_via_Newtons_method, rand
+        maxStep = [0.5, 0.5]
+        calls = { True:0, False:0 }
+        for broydenUpdates in [ False, True ]:
+            def grad_f( x ):
+                calls[broydenUpdates] += 1
+                return self.grad_f1( x )
+            xMin = solve_via_Newtons_method( self.f1, rand(2)+3, maxStep, grad_f=grad_f, x_tol=0, f_tol=10**-12, broydenUpdates=broydenUpdates )
+            self.assertAllClose( xMin, [2, -1 ] )
+        self.assertTrue( calls[True] < calls[False], 'Broyden updates used %i Jacobians, versus %i without' % ( calls[True], calls[False] ) )
+
+    def test_solve_via_levenberg_marquardt( self ):
+        from solverLib import solve_via_levenberg_marquardt, rand
+        maxStep = [0.5, 0.5]
+        xMin = solve_via_levenberg_marquardt( self.f1, rand(2)+3, maxStep, x_tol=0, f_tol=10**-12 )
+        self.assertAllClose( xMin, [2, -1 ] )
+        xMin = solve_via_levenberg_marquardt( self.f1, rand(2)+3, maxStep, grad_f=self.grad_f1, x_tol=0, f_tol=10**-12 )
+        self.assertAllClose( xMin, [2, -1 ] )
+        xRoot = solve_via_levenberg_marquardt( self.f2, rand(2), maxStep, grad_f=self.grad_f2, x_tol=0, f_tol=10**-12 ) #single equation
+        self.assertTrue( abs( self.f2(xRoot) ) < 10**-12 )
+
+    def test_levenberg_marquardt_convergence( self ):
+        'Rosenbrock function as residuals, root at [1, 1] reached along a curved valley'
+        from solverLib import solve_via_levenberg_marquardt, solverStatsSnapshot, solverStats
+        f = lambda x : numpy.array([ 10*(x[1] - x[0]**2), 1 - x[0] ])
+        grad_f = lambda x : numpy.array([ [ -20*x[0], 10 ], [ -1, 0 ] ])
+        stats_start = solverStatsSnapshot().get( 'levenberg_marquardt', { 'solves':0, 'converged':0 } )
+        xRoot = solve_via_levenberg_marquardt( f, [ -1.2, 1.0 ], [ 1.0, 1.0 ], grad_f=grad_f, x_tol=0, f_tol=10**-12 )
+        self.assertAllClose( xRoot, [ 1, 1 ] )
+        self.assertEqual( solverStats['levenberg_marquardt']['solves'] - stats_start['solves'], 1 )
+        self.assertEqual( solverStats['levenberg_marquardt']['converged'] - stats_start['converged'], 1 )
+
+    def test_levenberg_marquardt_damping( self ):
+        'the undamped step from x0 overshoots the root of arctan, so it has to be rejected and the damping increased'
+        from solverLib import solve_via_levenberg_marquardt
+        f_values = []
+        def f( x ):
+            f_values.append( abs( numpy.arctan( x[0] ) ) )
+            return numpy.array([ numpy.arctan( x[0] ) ])
+        grad_f_values = []
+        def grad_f( x ):
+            grad_f_values.append( abs( numpy.arctan( x[0] ) ) )
+            return numpy.array([ [ 1 / ( 1 + x[0]**2 ) ] ])
+        xRoot = solve_via_levenberg_marquardt( f, [ 2.0 ], [ 10.0 ], grad_f=grad_f, x_tol=0, f_tol=10**-12 )
+        self.assertTrue( abs( xRoot[0] ) < 10**-12 )
+        self.assertTrue( f_values[1] > f_values[0], 'first trial step expected to overshoot' )
+        self.assertTrue( len(f_values) > len(grad_f_values) + 1, 'expected rejected steps' ) #rejected steps reuse the Jacobian
+        self.assertTrue( all( a > b for a, b in zip( grad_f_values[:-1], grad_f_values[1:] ) ), 'accepted steps should reduce abs(f): %s' % grad_f_values )
+
     def f2( self,X) :
         y,z=X
         return y + y*z + (1.0-y)**3
@@ -304,3 +899,103 @@ class Tests_degrees_of_freedom(unittest.TestCase):
                 #print('  d.getValue() %f value %f, diff %e' % (returnedValue, value, returnedValue - value))
                 if abs(returnedValue - value) > tol :
                     raise ValueError("d.getValue() - value != %1.0e, [diff %e]" % (tol, returnedValue - value))
+
+    def test_motionVectors( self ):
+        'check the dof motion vectors used for analytical gradients against finite differences'
+        from degreesOfFreedom import PlacementDegreeOfFreedom, LinearMotionDegreeOfFreedom, AxisRotationDegreeOfFreedom, normalize
+        from numpy.random import rand
+        from variableManager import VariableManager
+        import FreeCAD, Part
+        FreeCAD.newDocument("testDoc_motionVectors")
+        objName = "box"
+        box = FreeCAD.ActiveDocument.addObject("Part::FeaturePython", objName)
+        box.Shape = Part.makeBox(2,3,2)
+        box.Placement.Base.x = rand()
+        class FakeSystem:
+            def __init__(self, variableManager):
+                self.variableManager = variableManager
+        vM = VariableManager(FreeCAD.ActiveDocument)
+        vM.X[3:6] = rand(3) - 0.5
+        constaintSystem = FakeSystem(vM)
+        dofs = [ PlacementDegreeOfFreedom( constaintSystem, objName, object_dof ) for object_dof in range(6) ]
+        d = LinearMotionDegreeOfFreedom( constaintSystem, objName )
+        d.setDirection( normalize(rand(3) - 0.5) )
+        dofs.append(d)
+        d = AxisRotationDegreeOfFreedom( constaintSystem, objName )
+        d.setAxis( normalize(rand(3) - 0.5), normalize(rand(3) - 0.5) )
+        d.setValue(0)
+        dofs.append(d)
+        p_r = rand(3) #point relative to the part
+        eps = 10**-6
+        for d in dofs:
+            v, w = d.motionVectors()
+            value = d.getValue()
+            base = vM.X[0:3].copy()
+            p = vM.rotateAndMove( objName, p_r, vM.X )
+            d.setValue( value + eps )
+            p_plus = vM.rotateAndMove( objName, p_r, vM.X )
+            d.setValue( value - eps )
+            p_minus = vM.rotateAndMove( objName, p_r, vM.X )
+            d.setValue( value )
+            dp_fd = ( p_plus - p_minus ) / ( 2*eps )
+            dp_analytical = v + numpy.cross( w, p - base )
+            self.assertTrue( numpy.linalg.norm( dp_fd - dp_analytical ) < 10**-6, '%s: %s != %s' % (d, dp_analytical, dp_fd) )
+
+
+# python2 test.py assembly2.solvers.dof_reduction_solver.tests.Test_loop_closure
+class Test_loop_closure(unittest.TestCase):
+
+    def test_independent_columns( self ):
+        from loops import independentColumns
+        J = numpy.array([ [1.0, 2.0, 0.0, 1.0 ], [0.0, 0.0, 1.0, 1.0 ], [0.0, 0.0, 0.0, 0.0] ])
+        columns = independentColumns( J )
+        self.assertEqual( len(columns), 2 )
+        self.assertEqual( numpy.linalg.matrix_rank( J[:,columns] ), 2 )
+        self.assertEqual( independentColumns( numpy.zeros([3,2]) ), [] )
+
+    def test_assemblies( self ):
+        'the solvable test assemblies should still solve with loop_closure, including the triangular link assembly'
+        for testFile_basename in solvable_test_assemblies:
+            doc =  FreeCAD.open( os.path.join( test_assembly_path, testFile_basename + '.fcstd' ) )
+            try:
+                constraintSystem = solveConstraints( doc, solver_name = 'dof_reduction_solver', use_cache = False, showFailureErrorDialog=False,
+                                                     schedule_constraints=True, loop_closure=True )
+                self.assertTrue( constraintSystem != None, '%s solve failed with loop_closure' % testFile_basename )
+                X = constraintSystem.variableManager.X
+                while constraintSystem.parentSystem != None: #closures are satisfied to the tolerance of the unions they replace
+                    self.assertTrue( abs( constraintSystem.constraintEq_value(X) ) <= constraintSystem.solveConstraintEq_tol, '%s not satisfied' % constraintSystem.str() )
+                    constraintSystem = constraintSystem.parentSystem
+            finally:
+                FreeCAD.closeDocument( doc.Name )
+
+
+# python2 test.py assembly2.solvers.dof_reduction_solver.tests.Test_null_space_degrees_of_freedom
+class Test_null_space_degrees_of_freedom(unittest.TestCase):
+
+    def test_null_space( self ):
+        from solverLib import nullSpace
+        A = numpy.array([ [1.0, 2.0, 0.0], [2.0, 4.0, 0.0] ])
+        N = nullSpace( A )
+        self.assertEqual( N.shape, (3,2) )
+        self.assertTrue( abs( numpy.dot( A, N ) ).max() < 10**-12 )
+        self.assertTrue( abs( numpy.dot( N.transpose(), N ) - numpy.eye(2) ).max() < 10**-12 )
+        self.assertEqual( nullSpace( numpy.zeros([1,2]) ).shape, (2,2) )
+
+    def test_assemblies( self ):
+        'solving the solvable test assemblies with numericalDegreesOfFreedom = "null_space", instead of by trial-and-error locking'
+        from constraintSystems import ConstraintSystemPrototype, solutionStats
+        for numericalDegreesOfFreedom in [ 'trial', 'null_space' ]:
+            ConstraintSystemPrototype.numericalDegreesOfFreedom = numericalDegreesOfFreedom
+            stats_start = dict( solutionStats )
+            t_start = time.time()
+            try:
+                for testFile_basename in solvable_test_assemblies:
+                    doc =  FreeCAD.open( os.path.join( test_assembly_path, testFile_basename + '.fcstd' ) )
+                    try:
+                        constraintSystem = solveConstraints( doc, solver_name = 'dof_reduction_solver', use_cache = False, showFailureErrorDialog=False )
+                        self.assertTrue( constraintSystem != None, '%s solve failed using numericalDegreesOfFreedom=%s' % ( testFile_basename, numericalDegreesOfFreedom ) )
+                    finally:
+                        FreeCAD.closeDocument( doc.Name )
+            finally:
+                ConstraintSystemPrototype.numericalDegreesOfFreedom = 'trial'
+            debugPrint(0, 'numericalDegreesOfFreedom=%s: %i test assemblies solved in %3.2fs, numerical solutions %i', numericalDegreesOfFreedom, len(solvable_test_assemblies), time.time() - t_start, solutionStats['numerical'] - stats_start['numerical'] )
@@ -39,9 +39,12 @@ from assembly2.core import debugPrint
 
 
 class VariableManager:
+    rotationCaching = True #cache each objects rotation matrix (and its transpose), as the rotate functions are called several times per constraint evaluation
+    lockDormantDofs = False #see ConstraintSystemPrototype.generateDegreesOfFreedomNumerically
     def __init__(self, doc, objectNames=None):
         self.doc = doc
         self.index = {}
+        self.rotationCache = {}
         X = []
         if objectNames == None:
             objectNames = [obj.Name for obj in doc.Objects if hasattr(obj,'Placement')]
@@ -59,6 +62,9 @@ class VariableManager:
         self.X = self.X0.copy()
 
     def updateFreeCADValues(self, X, tol_base = 10.0**-8, tol_rotation = 10**-6):
+        rotationVariables = numpy.reshape( X, (-1,6) )[:,3:] #azi, ela, theta of each object
+        axes = azimuth_and_elevation_angles_to_axis_batch( rotationVariables[:,0], rotationVariables[:,1] )
+        Q = quaternion_batch( rotationVariables[:,2], axes[:,0], axes[:,1], axes[:,2] )
         for objectName in self.index.keys():
             i = self.index[objectName]
             obj = self.doc.getObject(objectName)
@@ -67,35 +73,144 @@ class VariableManager:
             #obj.Placement.Base.z = X[i+2]
             if norm( numpy.array(obj.Placement.Base) - X[i:i+3] ) > tol_base: #for speed considerations only update placement variables if change in values occurs
                 obj.Placement.Base = tuple( X[i:i+3] )
-            azi, ela, theta =  X[i+3:i+6]
-            axis = azimuth_and_elevation_angles_to_axis( azi, ela )
-            new_Q = quaternion( theta, *axis ) #tuple type
+            new_Q = tuple( Q[i//6] )
             if norm( numpy.array(obj.Placement.Rotation.Q) - numpy.array(new_Q)) > tol_rotation:
                 obj.Placement.Rotation.Q = new_Q
 
     def bounds(self):
         return [ [ -inf, inf], [ -inf, inf], [ -inf, inf], [-pi,pi], [-pi,pi], [-pi,pi] ] * len(self.index)
 
+    def rotationMatrices( self, objectName, X ):
+        'returns R, R_transpose for objectNames rotation variables in X. Cached per object, invalidated when objectNames rotation variables change.'
+        i = self.index[objectName]
+        key = ( X[i+3], X[i+4], X[i+5] )
+        if self.rotationCaching:
+            cached = self.rotationCache.get( objectName )
+            if cached != None and cached[0] == key:
+                return cached[1], cached[2]
+        R = self.calculateRotationMatrix( objectName, key )
+        R_T = R.transpose()
+        if self.rotationCaching:
+            self.rotationCache[objectName] = ( key, R, R_T )
+        return R, R_T
+
+    def calculateRotationMatrix( self, objectName, rotationVariables ):
+        return azimuth_elevation_rotation_matrix( *rotationVariables )
+
+    def angularVelocities( self, objectName, X ):
+        'returns the angular velocity vectors resulting from unit changes in each of objectNames 3 rotation variables in X'
+        i = self.index[objectName]
+        return azimuth_elevation_angular_velocities( *X[i+3:i+6] )
+
+    def setRotation( self, objectName, axis, angle, R_post=None, Q_post=None ):
+        '''
+        set objectNames rotation variables in self.X, so that its rotation matrix is axis_rotation_matrix( angle, *axis ) * R_post.
+        Q_post - R_post as a quaternion (wikipedia order), used by parameterizations which compose rotations as quaternions.
+        '''
+        if R_post is not None:
+            R = dotProduct( axis_rotation_matrix( angle, *axis ), R_post )
+            axis, angle = rotation_matrix_axis_and_angle( R )
+        azi, ela = axis_to_azimuth_and_elevation_angles(*axis)
+        i = self.index[objectName]
+        self.X[i+3:i+6] = azi, ela, angle
+
+    def placementVariables( self, objectName, X ):
+        'returns objectNames placement variables, in form which can be passed to setPlacementVariables of another variable manager of the same type'
+        i = self.index[objectName]
+        return X[i:i+6].copy()
+
+    def setPlacementVariables( self, objectName, X, values ):
+        i = self.index[objectName]
+        X[i:i+6] = values
+
     def rotate(self, objectName, p, X):
         'rotate a vector p by objectNames placement variables defined in X'
-        i = self.index[objectName]
-        return azimuth_elevation_rotation( p, *X[i+3:i+6])
+        return dotProduct( self.rotationMatrices( objectName, X )[0], p )
 
     def rotateUndo( self, objectName, p, X):
-        i = self.index[objectName]
-        R = azimuth_elevation_rotation_matrix(*X[i+3:i+6])
-        return numpy.linalg.solve(R,p)
+        return dotProduct( self.rotationMatrices( objectName, X )[1], p ) #R is orthonormal, so inverse(R) = transpose(R)
 
     def rotateAndMove( self, objectName, p, X):
         'rotate the vector p by objectNames placement rotation and then move using objectNames placement'
         i = self.index[objectName]
-        return azimuth_elevation_rotation( p, *X[i+3:i+6]) + X[i:i+3]
+        return dotProduct( self.rotationMatrices( objectName, X )[0], p ) + X[i:i+3]
 
     def rotateAndMoveUndo( self, objectName, p, X): # or un(rotate_and_then_move) #synomyn to get co-ordinates relative to objects placement variables.
         i = self.index[objectName]
         v = numpy.array(p) - X[i:i+3]
-        R = azimuth_elevation_rotation_matrix(*X[i+3:i+6])
-        return numpy.linalg.solve(R,v)
+        return dotProduct( self.rotationMatrices( objectName, X )[1], v )
+
+
+class QuaternionVariableManager( VariableManager ):
+    '''
+    Rotations stored as unit quaternions. Each objects orientation when the variable manager was created is stored as its reference quaternion,
+    with its 3 rotation variables in X being the rotation vector (axis*angle) of its rotation relative to the reference orientation:
+      R = axis_rotation_matrix( norm(r), *r/norm(r) ) * R_ref
+
+    Unlike the azimuth, elevation, angle parameterization this is not singular at the poles,
+    and AxisRotationDegreeOfFreedom values are set by composing quaternions directly,
+    instead of going through a rotation matrix, rotation_matrix_axis_and_angle and axis_to_azimuth_and_elevation_angles.
+    '''
+    lockDormantDofs = True #otherwise a dormant rotation vector dof can satisfy the constraint during the trial-and-error search for the dofs to pass through, as happens with spherical joints
+    def __init__(self, doc, objectNames=None):
+        VariableManager.__init__( self, doc, objectNames )
+        self.Q_ref = {}
+        self.R_ref = {}
+        for objectName, i in self.index.items():
+            q_1, q_2, q_3, q_0 = self.doc.getObject(objectName).Placement.Rotation.Q
+            self.Q_ref[objectName] = normalize( numpy.array([ q_0, q_1, q_2, q_3 ]) )
+            self.R_ref[objectName] = azimuth_elevation_rotation_matrix( *self.X0[i+3:i+6] )
+            self.X0[i+3:i+6] = 0
+        self.X = self.X0.copy()
+
+    def quaternion( self, objectName, X ):
+        'returns objectNames rotation as quaternion (wikipedia order)'
+        i = self.index[objectName]
+        return quaternion_multiply( rotation_vector_to_quaternion( X[i+3:i+6] ), self.Q_ref[objectName] )
+
+    def updateFreeCADValues(self, X, tol_base = 10.0**-8, tol_rotation = 10**-6):
+        for objectName in self.index.keys():
+            i = self.index[objectName]
+            obj = self.doc.getObject(objectName)
+            if norm( numpy.array(obj.Placement.Base) - X[i:i+3] ) > tol_base:
+                obj.Placement.Base = tuple( X[i:i+3] )
+            q_0, q_1, q_2, q_3 = self.quaternion( objectName, X )
+            new_Q = ( q_1, q_2, q_3, q_0 )
+            Q = numpy.array(obj.Placement.Rotation.Q)
+            if min( norm( Q - numpy.array(new_Q) ), norm( Q + numpy.array(new_Q) ) ) > tol_rotation:
+                obj.Placement.Rotation.Q = new_Q
+
+    def calculateRotationMatrix( self, objectName, rotationVariables ):
+        r = numpy.array( rotationVariables )
+        theta = norm(r)
+        if theta == 0:
+            return self.R_ref[objectName]
+        return dotProduct( axis_rotation_matrix( theta, *(r/theta) ), self.R_ref[objectName] )
+
+    def angularVelocities( self, objectName, X ):
+        i = self.index[objectName]
+        return rotation_vector_angular_velocities( X[i+3:i+6] )
+
+    def setRotation( self, objectName, axis, angle, R_post=None, Q_post=None ):
+        q = numpy.array( quaternion2( angle, *axis ) )
+        if R_post is not None:
+            q = quaternion_multiply( q, Q_post )
+        i = self.index[objectName]
+        self.X[i+3:i+6] = quaternion_to_rotation_vector( quaternion_multiply( q, quaternion_conjugate( self.Q_ref[objectName] ) ) )
+
+    def placementVariables( self, objectName, X ):
+        i = self.index[objectName]
+        return numpy.concatenate([ X[i:i+3], self.quaternion( objectName, X ) ])
+
+    def setPlacementVariables( self, objectName, X, values ):
+        i = self.index[objectName]
+        X[i:i+3] = values[:3]
+        X[i+3:i+6] = quaternion_to_rotation_vector( quaternion_multiply( values[3:], quaternion_conjugate( self.Q_ref[objectName] ) ) )
+
+variableManager_classes = {
+    'azimuth_elevation' : VariableManager,
+    'quaternion' : QuaternionVariableManager,
+    }
 
 
 class ReversePlacementTransformWithBoundsNormalization:
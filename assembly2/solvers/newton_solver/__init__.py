@@ -9,6 +9,8 @@ from assembly2.solvers.common import *
 from assembly2.core import QtGui
 from .variableManager import VariableManager
 from assembly2.constraints import *
+from .constraints import AngleConstraint, AxialConstraint, CircularEdgeConstraint, PlaneConstraint, SphericalSurfaceConstraint
+from assembly2.solvers.dof_reduction_solver.solverLib import recordSolverStats
 import numpy
 
 
@@ -29,7 +31,7 @@ def solve_via_bfgs( constraintEqs, x0, bounds ):
     import scipy.optimize
     algName = 'scipy.optimize.fmin_bfgs'
     errorNorm = lambda x: numpy.linalg.norm(constraintEqs(x))
-    R = scipy.optimize.fmin_bfgs( errorNorm, x0 , disp=False, full_output=True)
+    R = scipy.optimize.fmin_bfgs( errorNorm, x0 , fprime=getattr( constraintEqs, 'normGradient', None ), disp=False, full_output=True)
     optResults = dict( zip(['xOpt', 'fOpt' , 'gOpt', 'BOpt', 'func_calls', 'grad_calls', 'warnInt'], R ) ) # see scipy.optimize.fmin_bfgs docs for info
     if optResults['warnInt'] == 0:
         warningMsg = ''
@@ -42,7 +44,7 @@ def solve_via_slsqp( constraintEqs, x0, bounds , iterations=160 ):
     import scipy.optimize
     algName = 'scipy.optimize.fmin_slsqp (Sequential Least SQuares Programming)'
     errorNorm = lambda x: numpy.linalg.norm(constraintEqs(x))
-    R = scipy.optimize.fmin_slsqp( errorNorm, x0, bounds=bounds, disp=False, full_output=True, iter=iterations)
+    R = scipy.optimize.fmin_slsqp( errorNorm, x0, fprime=getattr( constraintEqs, 'normGradient', None ), bounds=bounds, disp=False, full_output=True, iter=iterations)
     optResults = dict( zip(['xOpt', 'fOpt' , 'iter', 'imode', 'smode'], R ) ) # see scipy.optimize.fmin_bfgs docs for info
     if optResults['imode'] == 0:
         warningMsg = ''
@@ -50,6 +52,24 @@ def solve_via_slsqp( constraintEqs, x0, bounds , iterations=160 ):
         warningMsg = optResults['smode']
     return algName, warningMsg, optResults
 
+def solve_via_least_squares( constraintEqs, x0, bounds, iterations=None ):
+    '''
+    solve as a nonlinear least-squares problem. If constraintEqs is a ConstraintEquations instance, the constraints residual vectors are used
+    with the analytic sparse Jacobian, as to scale to assemblies with many parts. The Euler angles bounds are ignored, as rotations are periodic.
+    '''
+    import scipy.optimize
+    algName = 'scipy.optimize.least_squares (Trust Region Reflective)'
+    if hasattr( constraintEqs, 'residuals' ):
+        R = scipy.optimize.least_squares( constraintEqs.residuals, x0, jac=constraintEqs.jacobian, method='trf', max_nfev=iterations )
+    else:
+        R = scipy.optimize.least_squares( constraintEqs, x0, method='trf', max_nfev=iterations )
+    optResults = { 'xOpt':R.x, 'fOpt':numpy.linalg.norm( constraintEqs(R.x) ), 'nfev':R.nfev, 'status':R.status }
+    if R.status > 0:
+        warningMsg = ''
+    else:
+        warningMsg = R.message
+    return algName, warningMsg, optResults
+
 #def solve_via_fsolve( constraintEqs, x0, bounds ):
 #    import scipy
 #    Does not work as number of constraint equations does not equal number of variables.
@@ -58,24 +78,134 @@ def solve_via_slsqp( constraintEqs, x0, bounds , iterations=160 ):
 #    infodict['xOpt'] = xOpt
 #    return algName, warningMsg, infodict
 
+def solve_and_count( solver, constraintEqs, x0, bounds ):
+    'returns the solver results, and the number of constraint equation evaluations and jacobians it used'
+    evaluations, jacobians = constraintEqs.evaluations, constraintEqs.jacobians
+    R = solver( constraintEqs, x0, bounds )
+    return R, constraintEqs.evaluations - evaluations, constraintEqs.jacobians - jacobians
+
+def record_solver_stats( solver, counted_results ):
+    'records the output of solve_and_count in solverStats (see dof_reduction_solver.solverLib) and returns the solver results'
+    ( algName, warningMsg, optResults ), evaluations, jacobians = counted_results
+    converged = warningMsg == '' and optResults['fOpt'] < 10**-4
+    iterations = optResults.get( 'iter', jacobians ) #for the solvers not reporting iterations, each iteration requires a jacobian
+    recordSolverStats( 'newton_solver.%s' % getattr( solver, '__name__', 'solver' ), iterations, evaluations, jacobians, converged )
+    return algName, warningMsg, optResults
+
+def solve_restarts_in_parallel( solver, constraintEqs, startingPoints, bounds, processes=None ):
+    '''
+    run solver from each of the startingPoints in a multiprocessing pool, returning the first successful result (or the last result if all fail).
+    Results are checked in startingPoints order, so that the outcome is the same as trying the startingPoints one after another.
+    A later attempt which succeeds first therefore still waits for the earlier attempts to finish; the attempts still running are terminated once the outcome is known.
+    Returns None if there are no startingPoints.
+    '''
+    if len(startingPoints) == 0:
+        return None
+    import multiprocessing
+    if processes is None:
+        processes = min( len(startingPoints), multiprocessing.cpu_count() )
+    pool = multiprocessing.Pool( processes )
+    try:
+        pending = [ pool.apply_async( solve_and_count, ( solver, constraintEqs, x, bounds ) ) for x in startingPoints ]
+        for p in pending:
+            algName, warningMsg, optResults = record_solver_stats( solver, p.get() )
+            debugPrint( 3, '%s', optResults )
+            if warningMsg == '' and optResults['fOpt'] < 10**-4:
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+    return algName, warningMsg, optResults
+
 def objects_violating_constraints( constraints ):
     violatedConstraints = [c for c in constraints if not c.satisfied() ]
     vNames = [ vc.constraintObj.Name for vc in violatedConstraints ]
-    debugPrint( 3, "violated constraints: " + ', '.join(vNames) )
+    debugPrint( 3, "violated constraints: %s", ', '.join(vNames) )
     vObjects = sum( [ vc.objectNames() for vc in violatedConstraints ], [] )
-    debugPrint( 3, "objects associated to these constraints: " + ', '.join( list(set(vObjects))))
+    debugPrint( 3, "objects associated to these constraints: %s", ', '.join( set(vObjects) ) )
     return vObjects
 
 
 
+class ConstraintEquations:
+    '''
+    equations which need to solved inorder to assemble parts, called with the placement variables x returns the errors of all constraints.
+    For least-squares solvers, residuals(x) returns the concatenated residual vectors of the constraints.
+    Each constraint only depends on the placement variables of its 2 objects, so the analytic Jacobians (jacobian, errorsJacobian)
+    are assembled as sparse matrices from the constraints 12 column Jacobians.
+    '''
+    def __init__( self, variableManager, constraints ):
+        self.variableManager = variableManager
+        self.constraints = constraints
+        self.jacobianColumns = [ self.constraintColumns(c) for c in constraints ]
+        self.evaluations = 0
+        self.jacobians = 0
+    def constraintColumns( self, c ):
+        'returns (local, global) column indexes, mapping the columns of c.errorsJacobian() and c.residualsJacobian() to placement variables'
+        local = []
+        cols = []
+        for k, objName in enumerate( c.objectNames() ):
+            variableIndexes = self.variableManager.variableIndexes( objName )
+            if len(variableIndexes) > 0:
+                local.extend( range( k*6, (k+1)*6 ) )
+                cols.extend( variableIndexes )
+        return local, cols
+    def __call__( self, x ):
+        self.evaluations += 1
+        self.variableManager.setValues(x)
+        errors = sum( [c.errors() for c in self.constraints], [] )
+        if debugPrint.guard >= 4: debugPrint( 4, "constraint errors %s", errors )
+        return errors
+    def residuals( self, x ):
+        self.evaluations += 1
+        self.variableManager.setValues(x)
+        return numpy.array( sum( [c.residuals() for c in self.constraints], [] ) )
+    def assembleJacobian( self, x, jacobianName ):
+        import scipy.sparse
+        self.jacobians += 1
+        self.variableManager.setValues(x)
+        rows = []
+        cols = []
+        data = []
+        i = 0
+        for c, (localCols, globalCols) in zip( self.constraints, self.jacobianColumns ):
+            J_c = getattr( c, jacobianName )()
+            for j in range( J_c.shape[0] ):
+                rows.extend( [i + j] * len(globalCols) )
+                cols.extend( globalCols )
+                data.extend( J_c[ j, localCols ] )
+            i = i + J_c.shape[0]
+        return scipy.sparse.csr_matrix( ( data, (rows, cols) ), shape=( i, len(x) ) )
+    def jacobian( self, x ):
+        'analytic Jacobian of residuals(x), using the constraints residualsJacobian'
+        return self.assembleJacobian( x, 'residualsJacobian' )
+    def errorsJacobian( self, x ):
+        return self.assembleJacobian( x, 'errorsJacobian' )
+    def normGradient( self, x ):
+        'analytic gradient of numpy.linalg.norm( self(x) ), the objective of the minimization based solvers'
+        e = numpy.array( self(x) )
+        e_norm = numpy.linalg.norm( e )
+        if e_norm == 0:
+            return numpy.zeros( len(x) )
+        return self.errorsJacobian( x ).T.dot( e ) / e_norm
+
 def solveConstraints(
         doc,
         showFailureErrorDialog=True,
         printErrors=True,
         use_cache=False,
         solver=solve_via_slsqp,
-        random_restart_attempts=1
+        random_restart_attempts=1,
+        random_seed=None,
+        parallel_restarts=False,
+        restart_processes=None
 ):
+    '''
+    random_restart_attempts - number of peturbed starting points tried if the first solve attempt fails
+    random_seed - seed for the starting point peturbations, for reproducible solves
+    parallel_restarts - try the random restarts concurrently in a pool of restart_processes (default: cpu count) processes.
+                        Not done when the FreeCAD GUI is running, where the restarts are tried one after another.
+    '''
     assert not use_cache, "cache not implemented for Newton solver"
     T_start = time.time()
     variableManager = VariableManager( doc )
@@ -89,7 +219,7 @@ def solveConstraints(
         }
     for obj in doc.Objects:
         if 'ConstraintInfo' in obj.Content:
-            debugPrint(3, "assembly2solver parsing %s" % obj.Name )
+            debugPrint( 3, "assembly2solver parsing %s", obj.Name )
             #try:
             constraints.append( mapper[obj.Type]( doc, obj, variableManager) )
             #except AttributeError, msg:
@@ -108,45 +238,56 @@ def solveConstraints(
 
     violatedConstraints = [c for c in constraints if not c.satisfied() ]
     vNames = [ vc.constraintObj.Name for vc in violatedConstraints ]
-    debugPrint( 3, "violated constraints: " + ', '.join(vNames) )
+    debugPrint( 3, "violated constraints: %s", ', '.join(vNames) )
     vObjects = sum( [ vc.objectNames() for vc in violatedConstraints ], [] )
-    debugPrint( 3, "objects associated to these constraints: " + ', '.join( list(set(vObjects))))
+    debugPrint( 3, "objects associated to these constraints: %s", ', '.join( set(vObjects) ) )
     vObjects_connectivety = [ sum( obj in c.objectNames() for c in constraints ) for obj in vObjects ]
-    debugPrint( 3, "repective connectivety %s " %  vObjects_connectivety)
+    debugPrint( 3, "repective connectivety %s ", vObjects_connectivety )
     if len(violatedConstraints) == 1 and len(vObjects_connectivety) == 2 and sum(vObjects_connectivety) > 2:
         if not variableManager.objFixed(vObjects[0]) and not variableManager.objFixed(vObjects[1]):
             for obj, conn in zip(vObjects, vObjects_connectivety):
                 if conn == 1: # makes vObjects_connectivety[0] == 1 or vObjects_connectivety[1] == 1 unnessary
                     variableManager.fixEveryObjectExcept( obj )
-                    debugPrint( 3, "moving %s as to satisfy %s, everything else fixed" % ( obj, vNames[0]) )
+                    debugPrint( 3, "moving %s as to satisfy %s, everything else fixed", obj, vNames[0] )
                     constraints = violatedConstraints
     
-    def constraintEqs(x): #equations which need to solved inorder to assemble parts
-        variableManager.setValues(x)
-        errors = sum( [c.errors() for c in constraints], [] )
-        debugPrint( 4, "constraint errors %s" % errors )
-        return errors
+    constraintEqs = ConstraintEquations( variableManager, constraints )
 
     x0 = variableManager.getValues()
-    debugPrint(3, "variableManager.getValues() %s" % x0)
-
-    algName, warningMsg, optResults = solver(constraintEqs, x0, variableManager.bounds() )
-    debugPrint(3, str(optResults))
-    if warningMsg !=  '' or optResults['fOpt'] > 10**-4 and random_restart_attempts > 0:
-        for i in range(random_restart_attempts):
-            variableManager.setValues(x0)
-            xN = variableManager.peturbValues( vObjects )
-            algName, warningMsg, optResults = solver(constraintEqs, xN, variableManager.bounds() )
-            debugPrint(3, str(optResults))
-            if warningMsg == '' and optResults['fOpt'] < 10**-4:
-                break
+    debugPrint( 3, "variableManager.getValues() %s", x0 )
+
+    algName, warningMsg, optResults = record_solver_stats( solver, solve_and_count( solver, constraintEqs, x0, variableManager.bounds() ) )
+    debugPrint( 3, '%s', optResults )
+    if ( warningMsg !=  '' or optResults['fOpt'] > 10**-4 ) and random_restart_attempts > 0:
+        rng = numpy.random.RandomState( random_seed )
+        if parallel_restarts and QtGui.qApp != None:
+            debugPrint( 2, 'trying the random restarts serially, as worker processes are not started while the FreeCAD GUI is running' )
+            parallel_restarts = False
+        if parallel_restarts:
+            startingPoints = []
+            for i in range(random_restart_attempts):
+                variableManager.setValues(x0)
+                startingPoints.append( variableManager.peturbValues( vObjects, rng ) )
+            debugPrint( 3, "trying %i random restarts in parallel", random_restart_attempts )
+            restartResults = solve_restarts_in_parallel( solver, constraintEqs, startingPoints, variableManager.bounds(), restart_processes )
+            if restartResults != None:
+                algName, warningMsg, optResults = restartResults
+        else:
+            for i in range(random_restart_attempts):
+                variableManager.setValues(x0)
+                xN = variableManager.peturbValues( vObjects, rng )
+                algName, warningMsg, optResults = record_solver_stats( solver, solve_and_count( solver, constraintEqs, xN, variableManager.bounds() ) )
+                debugPrint( 3, '%s', optResults )
+                if warningMsg == '' and optResults['fOpt'] < 10**-4:
+                    break
     
 
     if warningMsg == '' and optResults['fOpt'] < 10**-4: #then constraints satisfied
         variableManager.setValues( optResults['xOpt'] )
         variableManager.updateFreeCADValues( )
         return  optResults['xOpt']
-    elif showFailureErrorDialog and QtGui.qApp != None:
+    debugPrint.dumpTrace( 'newton solver failed, debug trace' )
+    if showFailureErrorDialog and QtGui.qApp != None:
         FreeCAD.Console.PrintError("UNABLE TO SOLVE ASSEMBLY CONSTRAINTS. Info:\n")
         FreeCAD.Console.PrintError("  optimization algorithm could not minimize the norm of constraint errors\n" )
         FreeCAD.Console.PrintError("    optimization algorithm used  : %s\n" % algName )
@@ -1,5 +1,12 @@
 from assembly2.lib3D import *
-from assembly2.selection import getSubElementPos, getSubElementAxis
+from assembly2.solvers.common import subElementPos, subElementAxis
+
+class PicklableConstraintObj:
+    'stands in for the constraintObj when a constraint is pickled, for example to solve in another process'
+    def __init__( self, constraintObj ):
+        self.Name = constraintObj.Name
+        self.Object1 = constraintObj.Object1
+        self.Object2 = constraintObj.Object2
 
 class ConstraintPrototype:
     def __init__( self, doc, constraintObj, variableManager):
@@ -18,12 +25,110 @@ class ConstraintPrototype:
         self.registerVariables()
 
     def registerVariables( self ):
-        raise RuntimeError, "ConstraintPrototype class not supposed to used directly"
+        raise RuntimeError("ConstraintPrototype class not supposed to used directly")
 
     def errors( self ):
         'returns a list of errors, which the solver tries to reduce to 0'
-        raise RuntimeError, "ConstraintPrototype class not supposed to used directly"
-    
+        raise RuntimeError("ConstraintPrototype class not supposed to used directly")
+
+    def residuals( self ):
+        '''
+        returns the residual vector used when solving as a least-squares problem (see solve_via_least_squares).
+        Unlike errors, residuals are not squared or abs'ed, so that they vary linearly near the solution.
+        '''
+        return self.errors()
+
+    directionResidualsWeight = 10**2 #as for the 10**4 weighting in errors, otherwise the axis distance residuals (with there 10 lever arm) make the opposite direction a local minimum
+
+    def directionResiduals( self, a1, a2 ):
+        if self.directionConstraint == "none" :
+            d = numpy.cross( a1, a2 )
+        elif self.directionConstraint == "aligned":
+            d = a1 - a2
+        else: #opposed
+            d = a1 + a2
+        return ( self.directionResidualsWeight * d ).tolist()
+
+    def axisDistanceResiduals( self, c1, a1, c2, a2 ):
+        'offsets from axis 1 of 3 points on axis 2, matching distance_between_two_axes_3_points'
+        R = []
+        for t in [-10, 0, 10]:
+            d = c2 + t*a2 - c1
+            R.extend( d - numpy.dot(d, a1)*a1 )
+        return R
+
+    def errorsJacobian( self ):
+        '''
+        returns the derivative of errors() with respect to the placement variables of Object1 and Object2,
+        as a len(errors) x 12 array (columns 0-5 Object1, 6-11 Object2).
+        '''
+        raise NotImplementedError("%s has no analytic errors jacobian" % self.__class__.__name__)
+
+    def residualsJacobian( self ):
+        'as errorsJacobian but for residuals()'
+        raise NotImplementedError("%s has no analytic residuals jacobian" % self.__class__.__name__)
+
+    def axisJacobian( self, p, a_r, objInd ):
+        'derivative (3x12 array) of p.rotate(a_r), p being the placement of Object1 (objInd=0) or Object2 (objInd=1)'
+        J = numpy.zeros([3,12])
+        J[:, objInd*6:(objInd+1)*6] = p.rotate_jacobian( a_r )
+        return J
+
+    def pointJacobian( self, p, pos_r, objInd ):
+        'derivative (3x12 array) of p.rotate_and_then_move(pos_r)'
+        J = numpy.zeros([3,12])
+        J[:, objInd*6:(objInd+1)*6] = p.rotate_and_then_move_jacobian( pos_r )
+        return J
+
+    def axisProductErrorJacobian( self, a1, a2, Da1, Da2 ):
+        'derivative of the ax_const term in errors (before weighting)'
+        d_prod = numpy.dot( a2, Da1 ) + numpy.dot( a1, Da2 )
+        if self.directionConstraint == "none" :
+            return -numpy.sign( numpy.dot( a1, a2 ) ) * d_prod
+        elif self.directionConstraint == "aligned":
+            return -d_prod
+        else: #opposed
+            return d_prod
+
+    def directionResidualsJacobian( self, a1, a2, Da1, Da2 ):
+        if self.directionConstraint == "none" :
+            D = numpy.cross( Da1.T, a2 ).T + numpy.cross( a1, Da2.T ).T
+        elif self.directionConstraint == "aligned":
+            D = Da1 - Da2
+        else: #opposed
+            D = Da1 + Da2
+        return self.directionResidualsWeight * D
+
+    def axisDistanceOffsetsAndJacobians( self, c1, a1, c2, a2, Dc1, Da1, Dc2, Da2 ):
+        'returns [(offset, offset derivative), ...] for the 3 points used in axisDistanceResiduals'
+        R = []
+        for t in [-10, 0, 10]:
+            d = c2 + t*a2 - c1
+            Dd = Dc2 + t*Da2 - Dc1
+            d_a1 = numpy.dot(d, a1)
+            offset = d - d_a1*a1
+            D_offset = Dd - numpy.outer( a1, numpy.dot(a1, Dd) + numpy.dot(d, Da1) ) - d_a1*Da1
+            R.append( (offset, D_offset) )
+        return R
+
+    def axisDistanceResidualsJacobian( self, *args ):
+        return numpy.vstack([ D for offset, D in self.axisDistanceOffsetsAndJacobians( *args ) ])
+
+    def axisDistanceErrorJacobian( self, *args ):
+        'derivative of distance_between_two_axes_3_points, assuming a unit length axis 1'
+        J = numpy.zeros(12)
+        for offset, D in self.axisDistanceOffsetsAndJacobians( *args ):
+            n = norm( offset )
+            if n > 0:
+                J = J + numpy.dot( offset, D ) / n
+        return J
+
+    def __getstate__( self ):
+        state = self.__dict__.copy()
+        state['doc'] = None
+        state['constraintObj'] = PicklableConstraintObj( self.constraintObj )
+        return state
+
     def satisfied( self, eps=10**-3 ):
         return all( numpy.array(self.errors()) < eps )
 
@@ -33,11 +138,11 @@ class ConstraintPrototype:
 
     def getPos(self, objName, subElement):
         obj =  self.doc.getObject( objName )
-        return getSubElementPos(obj, subElement)
+        return subElementPos(obj, subElement)
 
     def getAxis(self, objName, subElement):
         obj =  self.doc.getObject( objName )
-        return getSubElementAxis(obj, subElement)
+        return subElementAxis(obj, subElement)
 
 
 
@@ -61,6 +166,24 @@ class AngleConstraint(ConstraintPrototype):
                10**4 * ( self.desired_dot_product - numpy.dot(a1 , a2) )
                ]
 
+     def residuals(self):
+          p1 = self.variableManager.getPlacementValues( self.constraintObj.Object1 )
+          p2 = self.variableManager.getPlacementValues( self.constraintObj.Object2 )
+          return [ self.directionResidualsWeight * ( self.desired_dot_product - numpy.dot( p1.rotate( self.a1_r ), p2.rotate( self.a2_r ) ) ) ]
+
+     def dotProductJacobian(self):
+          p1 = self.variableManager.getPlacementValues( self.constraintObj.Object1 )
+          p2 = self.variableManager.getPlacementValues( self.constraintObj.Object2 )
+          a1 = p1.rotate( self.a1_r )
+          a2 = p2.rotate( self.a2_r )
+          return numpy.dot( a2, self.axisJacobian( p1, self.a1_r, 0 ) ) + numpy.dot( a1, self.axisJacobian( p2, self.a2_r, 1 ) )
+
+     def errorsJacobian(self):
+          return numpy.array([ -10**4 * self.dotProductJacobian() ])
+
+     def residualsJacobian(self):
+          return numpy.array([ -self.directionResidualsWeight * self.dotProductJacobian() ])
+
 
 
 class AxialConstraint(ConstraintPrototype): 
@@ -74,7 +197,7 @@ class AxialConstraint(ConstraintPrototype):
           self.a1_r = p1.rotate_undo( a1 ) #_r = relative to objects placement
           self.a2_r = p2.rotate_undo( a2 )
           self.c1_r = p1.rotate_and_then_move_undo( pos1 )
-          #debugPrint(4, 'surface1.center %s, rotate_and_then_move_undo %s' % (surface1.Center, self.c1_r))
+          #debugPrint( 4, 'surface1.center %s, rotate_and_then_move_undo %s', surface1.Center, self.c1_r )
           self.c2_r = p2.rotate_and_then_move_undo( pos2 )
           self.directionConstraint = self.constraintObj.directionConstraint
 
@@ -85,10 +208,10 @@ class AxialConstraint(ConstraintPrototype):
           a2 = p2.rotate( self.a2_r )
           c1 = p1.rotate_and_then_move( self.c1_r )
           c2 = p2.rotate_and_then_move( self.c2_r )
-          #debugPrint(4, 'a1 %s' % a1.__repr__())
-          #debugPrint(4, 'a2 %s' % a2.__repr__())
-          #debugPrint(4, 'c1 %s' % c1.__repr__())
-          #debugPrint(4, 'c2 %s' % c2.__repr__())
+          #debugPrint( 4, 'a1 %s', a1.__repr__() )
+          #debugPrint( 4, 'a2 %s', a2.__repr__() )
+          #debugPrint( 4, 'c1 %s', c1.__repr__() )
+          #debugPrint( 4, 'c2 %s', c2.__repr__() )
           ax_prod = numpy.dot( a1, a2 )
           if self.directionConstraint == "none" :
                ax_const = (1 - abs(ax_prod))
@@ -102,6 +225,47 @@ class AxialConstraint(ConstraintPrototype):
                distance_between_two_axes_3_points(c1,a1,c2,a2)
                ]
 
+     def residuals(self):
+          p1 = self.variableManager.getPlacementValues( self.constraintObj.Object1 )
+          p2 = self.variableManager.getPlacementValues( self.constraintObj.Object2 )
+          a1 = p1.rotate( self.a1_r )
+          a2 = p2.rotate( self.a2_r )
+          c1 = p1.rotate_and_then_move( self.c1_r )
+          c2 = p2.rotate_and_then_move( self.c2_r )
+          return self.directionResiduals( a1, a2 ) + self.axisDistanceResiduals( c1, a1, c2, a2 )
+
+     def errorsJacobian(self):
+          p1 = self.variableManager.getPlacementValues( self.constraintObj.Object1 )
+          p2 = self.variableManager.getPlacementValues( self.constraintObj.Object2 )
+          a1 = p1.rotate( self.a1_r )
+          a2 = p2.rotate( self.a2_r )
+          c1 = p1.rotate_and_then_move( self.c1_r )
+          c2 = p2.rotate_and_then_move( self.c2_r )
+          Da1 = self.axisJacobian( p1, self.a1_r, 0 )
+          Da2 = self.axisJacobian( p2, self.a2_r, 1 )
+          Dc1 = self.pointJacobian( p1, self.c1_r, 0 )
+          Dc2 = self.pointJacobian( p2, self.c2_r, 1 )
+          return numpy.array([
+               self.axisProductErrorJacobian( a1, a2, Da1, Da2 ) * 10**4,
+               self.axisDistanceErrorJacobian( c1, a1, c2, a2, Dc1, Da1, Dc2, Da2 )
+               ])
+
+     def residualsJacobian(self):
+          p1 = self.variableManager.getPlacementValues( self.constraintObj.Object1 )
+          p2 = self.variableManager.getPlacementValues( self.constraintObj.Object2 )
+          a1 = p1.rotate( self.a1_r )
+          a2 = p2.rotate( self.a2_r )
+          c1 = p1.rotate_and_then_move( self.c1_r )
+          c2 = p2.rotate_and_then_move( self.c2_r )
+          Da1 = self.axisJacobian( p1, self.a1_r, 0 )
+          Da2 = self.axisJacobian( p2, self.a2_r, 1 )
+          Dc1 = self.pointJacobian( p1, self.c1_r, 0 )
+          Dc2 = self.pointJacobian( p2, self.c2_r, 1 )
+          return numpy.vstack([
+               self.directionResidualsJacobian( a1, a2, Da1, Da2 ),
+               self.axisDistanceResidualsJacobian( c1, a1, c2, a2, Dc1, Da1, Dc2, Da2 )
+               ])
+
 class CircularEdgeConstraint(ConstraintPrototype): 
      def registerVariables( self ):
           p1 = self.variableManager.getPlacementValues( self.constraintObj.Object1 )
@@ -113,7 +277,7 @@ class CircularEdgeConstraint(ConstraintPrototype):
           self.a1_r = p1.rotate_undo( a1 ) #_r = relative to objects placement
           self.a2_r = p2.rotate_undo( a2 )
           self.c1_r = p1.rotate_and_then_move_undo( pos1 )
-          #debugPrint(4, 'surface1.center %s, rotate_and_then_move_undo %s' % (surface1.Center, self.c1_r))
+          #debugPrint( 4, 'surface1.center %s, rotate_and_then_move_undo %s', surface1.Center, self.c1_r )
           self.c2_r = p2.rotate_and_then_move_undo( pos2 )
           self.directionConstraint = self.constraintObj.directionConstraint
           self.offset = self.constraintObj.offset.Value
@@ -125,10 +289,10 @@ class CircularEdgeConstraint(ConstraintPrototype):
           a2 = p2.rotate( self.a2_r )
           c1 = p1.rotate_and_then_move( self.c1_r )
           c2 = p2.rotate_and_then_move( self.c2_r )
-          #debugPrint(4, 'a1 %s' % a1.__repr__())
-          #debugPrint(4, 'a2 %s' % a2.__repr__())
-          #debugPrint(4, 'c1 %s' % c1.__repr__())
-          #debugPrint(4, 'c2 %s' % c2.__repr__())
+          #debugPrint( 4, 'a1 %s', a1.__repr__() )
+          #debugPrint( 4, 'a2 %s', a2.__repr__() )
+          #debugPrint( 4, 'c1 %s', c1.__repr__() )
+          #debugPrint( 4, 'c2 %s', c2.__repr__() )
           ax_prod = numpy.dot( a1, a2 )
           if self.directionConstraint == "none" :
               ax_const = (1 - abs(ax_prod))
@@ -145,6 +309,53 @@ class CircularEdgeConstraint(ConstraintPrototype):
                distance_between_two_axes_3_points(c1,a1,c2,a2)
                ]
 
+     def residuals(self):
+          p1 = self.variableManager.getPlacementValues( self.constraintObj.Object1 )
+          p2 = self.variableManager.getPlacementValues( self.constraintObj.Object2 )
+          a1 = p1.rotate( self.a1_r )
+          a2 = p2.rotate( self.a2_r )
+          c1 = p1.rotate_and_then_move( self.c1_r )
+          c2 = p2.rotate_and_then_move( self.c2_r )
+          dist = numpy.dot(a1, c1 - c2)
+          return self.directionResiduals( a1, a2 ) + [ dist - self.offset ] + self.axisDistanceResiduals( c1, a1, c2, a2 )
+
+     def errorsJacobian(self):
+          p1 = self.variableManager.getPlacementValues( self.constraintObj.Object1 )
+          p2 = self.variableManager.getPlacementValues( self.constraintObj.Object2 )
+          a1 = p1.rotate( self.a1_r )
+          a2 = p2.rotate( self.a2_r )
+          c1 = p1.rotate_and_then_move( self.c1_r )
+          c2 = p2.rotate_and_then_move( self.c2_r )
+          Da1 = self.axisJacobian( p1, self.a1_r, 0 )
+          Da2 = self.axisJacobian( p2, self.a2_r, 1 )
+          Dc1 = self.pointJacobian( p1, self.c1_r, 0 )
+          Dc2 = self.pointJacobian( p2, self.c2_r, 1 )
+          dist = numpy.dot(a1, c1 - c2)
+          D_dist = numpy.dot(c1 - c2, Da1) + numpy.dot(a1, Dc1 - Dc2)
+          return numpy.array([
+               self.axisProductErrorJacobian( a1, a2, Da1, Da2 ) * 10**4,
+               2*(dist - self.offset) * D_dist,
+               self.axisDistanceErrorJacobian( c1, a1, c2, a2, Dc1, Da1, Dc2, Da2 )
+               ])
+
+     def residualsJacobian(self):
+          p1 = self.variableManager.getPlacementValues( self.constraintObj.Object1 )
+          p2 = self.variableManager.getPlacementValues( self.constraintObj.Object2 )
+          a1 = p1.rotate( self.a1_r )
+          a2 = p2.rotate( self.a2_r )
+          c1 = p1.rotate_and_then_move( self.c1_r )
+          c2 = p2.rotate_and_then_move( self.c2_r )
+          Da1 = self.axisJacobian( p1, self.a1_r, 0 )
+          Da2 = self.axisJacobian( p2, self.a2_r, 1 )
+          Dc1 = self.pointJacobian( p1, self.c1_r, 0 )
+          Dc2 = self.pointJacobian( p2, self.c2_r, 1 )
+          D_dist = numpy.dot(c1 - c2, Da1) + numpy.dot(a1, Dc1 - Dc2)
+          return numpy.vstack([
+               self.directionResidualsJacobian( a1, a2, Da1, Da2 ),
+               D_dist,
+               self.axisDistanceResidualsJacobian( c1, a1, c2, a2, Dc1, Da1, Dc2, Da2 )
+               ])
+
 
 class PlaneConstraint(ConstraintPrototype): 
      def registerVariables( self ):
@@ -170,7 +381,7 @@ class PlaneConstraint(ConstraintPrototype):
           pos1 = p1.rotate_and_then_move( self.pos1_r )
           pos2 = p2.rotate_and_then_move( self.pos2_r )
           dist = numpy.dot(a1, pos1 - pos2) #distance between planes
-          #debugPrint(2, 'dist %f' % dist)
+          #debugPrint( 2, 'dist %f', dist )
           ax_prod = numpy.dot( a1, a2 )
           if self.directionConstraint == "none" :
                ax_const = (1 - abs(ax_prod))
@@ -184,6 +395,44 @@ class PlaneConstraint(ConstraintPrototype):
               (dist - self.planeOffset)**2,
           ]
 
+     def residuals(self):
+          p1 = self.variableManager.getPlacementValues( self.constraintObj.Object1 )
+          p2 = self.variableManager.getPlacementValues( self.constraintObj.Object2 )
+          a1 = p1.rotate( self.a1_r )
+          a2 = p2.rotate( self.a2_r )
+          pos1 = p1.rotate_and_then_move( self.pos1_r )
+          pos2 = p2.rotate_and_then_move( self.pos2_r )
+          dist = numpy.dot(a1, pos1 - pos2)
+          return self.directionResiduals( a1, a2 ) + [ dist - self.planeOffset ]
+
+     def errorsJacobian(self):
+          p1 = self.variableManager.getPlacementValues( self.constraintObj.Object1 )
+          p2 = self.variableManager.getPlacementValues( self.constraintObj.Object2 )
+          a1 = p1.rotate( self.a1_r )
+          a2 = p2.rotate( self.a2_r )
+          pos1 = p1.rotate_and_then_move( self.pos1_r )
+          pos2 = p2.rotate_and_then_move( self.pos2_r )
+          Da1 = self.axisJacobian( p1, self.a1_r, 0 )
+          Da2 = self.axisJacobian( p2, self.a2_r, 1 )
+          dist = numpy.dot(a1, pos1 - pos2)
+          D_dist = numpy.dot(pos1 - pos2, Da1) + numpy.dot(a1, self.pointJacobian( p1, self.pos1_r, 0 ) - self.pointJacobian( p2, self.pos2_r, 1 ))
+          return numpy.array([
+              self.axisProductErrorJacobian( a1, a2, Da1, Da2 ) * 10**5,
+              2*(dist - self.planeOffset) * D_dist,
+          ])
+
+     def residualsJacobian(self):
+          p1 = self.variableManager.getPlacementValues( self.constraintObj.Object1 )
+          p2 = self.variableManager.getPlacementValues( self.constraintObj.Object2 )
+          a1 = p1.rotate( self.a1_r )
+          a2 = p2.rotate( self.a2_r )
+          pos1 = p1.rotate_and_then_move( self.pos1_r )
+          pos2 = p2.rotate_and_then_move( self.pos2_r )
+          Da1 = self.axisJacobian( p1, self.a1_r, 0 )
+          Da2 = self.axisJacobian( p2, self.a2_r, 1 )
+          D_dist = numpy.dot(pos1 - pos2, Da1) + numpy.dot(a1, self.pointJacobian( p1, self.pos1_r, 0 ) - self.pointJacobian( p2, self.pos2_r, 1 ))
+          return numpy.vstack([ self.directionResidualsJacobian( a1, a2, Da1, Da2 ), D_dist ])
+
 
 class SphericalSurfaceConstraint(ConstraintPrototype): 
      def registerVariables( self ):
@@ -202,3 +451,21 @@ class SphericalSurfaceConstraint(ConstraintPrototype):
           return [
               norm(pos1 - pos2)
           ]
+
+     def residuals(self):
+          p1 = self.variableManager.getPlacementValues( self.constraintObj.Object1 )
+          p2 = self.variableManager.getPlacementValues( self.constraintObj.Object2 )
+          return ( p1.rotate_and_then_move( self.pos1_r ) - p2.rotate_and_then_move( self.pos2_r ) ).tolist()
+
+     def residualsJacobian(self):
+          p1 = self.variableManager.getPlacementValues( self.constraintObj.Object1 )
+          p2 = self.variableManager.getPlacementValues( self.constraintObj.Object2 )
+          return self.pointJacobian( p1, self.pos1_r, 0 ) - self.pointJacobian( p2, self.pos2_r, 1 )
+
+     def errorsJacobian(self):
+          p1 = self.variableManager.getPlacementValues( self.constraintObj.Object1 )
+          p2 = self.variableManager.getPlacementValues( self.constraintObj.Object2 )
+          d = p1.rotate_and_then_move( self.pos1_r ) - p2.rotate_and_then_move( self.pos2_r )
+          if norm(d) == 0:
+               return numpy.zeros([1,12])
+          return numpy.array([ numpy.dot( d, self.residualsJacobian() ) / norm(d) ])
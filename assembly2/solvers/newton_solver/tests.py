@@ -16,6 +16,15 @@ class Stats:
     pass
 stats = Stats()
 
+def load_constraintEquations( testFile_basename ):
+    'returns doc, ConstraintEquations and the initial placement variables for a test assembly'
+    from assembly2.solvers.newton_solver import VariableManager, ConstraintEquations, AxialConstraint, PlaneConstraint, SphericalSurfaceConstraint, AngleConstraint, CircularEdgeConstraint
+    doc =  FreeCAD.open( os.path.join( test_assembly_path, testFile_basename + '.fcstd' ) )
+    variableManager = VariableManager( doc )
+    mapper = { 'axial':AxialConstraint, 'plane':PlaneConstraint, 'circularEdge':CircularEdgeConstraint, 'angle_between_planes':AngleConstraint, 'sphericalSurface':SphericalSurfaceConstraint }
+    constraints = [ mapper[obj.Type]( doc, obj, variableManager ) for obj in doc.Objects if 'ConstraintInfo' in obj.Content ]
+    return doc, ConstraintEquations( variableManager, constraints ), numpy.array( variableManager.getValues() )
+
 # To do
 #   from assembly2.solvers.dof_reduction_solver.tests import Test_Dof_Reduction_Solver
 #   class Test_Newton_Slsqp_Solver(Test_Dof_Reduction_Solver):
@@ -38,10 +47,10 @@ class Test_Newton_Slsqp_Solver(unittest.TestCase):
     @classmethod
     def tearDownClass(cls):
         debugPrint(0,'\n------------------------------------------')
-        debugPrint(0,'  Newton_slsqp_solver passed %i/%i tests' % ( stats.n_solved, stats.n_attempted ) )
-        debugPrint(0,'    time solver:            %3.2f s' % stats.t_solver )
-        debugPrint(0,'    time cached solutions:  %3.2f s' % stats.t_cache )
-        debugPrint(0,'    total running time:     %3.2f s' % (time.time() - stats.t_start) )
+        debugPrint(0,'  Newton_slsqp_solver passed %i/%i tests', stats.n_solved, stats.n_attempted )
+        debugPrint(0,'    time solver:            %3.2f s', stats.t_solver )
+        debugPrint(0,'    time cached solutions:  %3.2f s', stats.t_cache )
+        debugPrint(0,'    total running time:     %3.2f s', time.time() - stats.t_start )
         debugPrint(0,'------------------------------------------')
 
     
@@ -146,3 +155,79 @@ class Test_Newton_Slsqp_Solver(unittest.TestCase):
     @unittest.skip("takes along time to run")     
     def testAssembly_18_add_free_objects( self ):
         self._test_file( 'testAssembly_18-add_free_objects')
+
+
+# python2 test.py assembly2.solvers.newton_solver.tests.Test_Newton_Least_Squares_Solver
+class Test_Newton_Least_Squares_Solver(unittest.TestCase):
+
+    def _test_file( self, testFile_basename ):
+        doc =  FreeCAD.open( os.path.join( test_assembly_path, testFile_basename + '.fcstd' ) )
+        t_start = time.time()
+        xOpt = solveConstraints( doc, solver_name = 'newton_solver_least_squares', use_cache = False, showFailureErrorDialog=False )
+        debugPrint(1, '%s solved in %3.2fs', testFile_basename, time.time() - t_start )
+        self.assertFalse( xOpt is None, '%s solve failed' % testFile_basename )
+        FreeCAD.closeDocument( doc.Name )
+
+    def test_analytic_jacobians( self ):
+        'analytic Jacobians of the residuals, errors and error norm should match their finite difference approximations'
+        from assembly2.solvers.dof_reduction_solver.solverLib import GradientApproximatorCentralDifference
+        for testFile_basename in [ 'testAssembly_12-angles_clock_face', 'testAssembly_13-spherical_surfaces_hip', 'testAssembly_15-triangular_link_assembly' ]:
+            doc, constraintEqs, x0 = load_constraintEquations( testFile_basename )
+            x = x0 + 0.1*numpy.random.RandomState(0).randn( len(x0) ) #away from the solution, where the errors abs and norm terms are not differentiable
+            checks = [
+                ( constraintEqs.jacobian(x).toarray(), GradientApproximatorCentralDifference( constraintEqs.residuals )( x ) ),
+                ( constraintEqs.errorsJacobian(x).toarray(), GradientApproximatorCentralDifference( lambda y: numpy.array( constraintEqs(y) ) )( x ) ),
+                ( constraintEqs.normGradient(x), GradientApproximatorCentralDifference( lambda y: numpy.linalg.norm( constraintEqs(y) ) )( x ) ),
+                ]
+            for J_analytic, J_fd in checks:
+                self.assertEqual( J_analytic.shape, J_fd.shape )
+                self.assertTrue( numpy.allclose( J_analytic, J_fd, atol=10**-6 * max( 1, abs(J_fd).max() ) ), '%s: analytic Jacobian != finite difference approximation' % testFile_basename )
+            FreeCAD.closeDocument( doc.Name )
+
+    def testAssembly_02_3_cubes( self ):
+        self._test_file( 'testAssembly_02' )
+
+    def testAssembly_12_angles_clock_face( self ):
+        self._test_file( 'testAssembly_12-angles_clock_face')
+
+    def testAssembly_13_spherical_surfaces_hip( self ):
+        self._test_file( 'testAssembly_13-spherical_surfaces_hip')
+
+    def testAssembly_15_triangular_link_assembly( self ):
+        self._test_file( 'testAssembly_15-triangular_link_assembly')
+
+
+# python2 test.py assembly2.solvers.newton_solver.tests.Test_Newton_Parallel_Restarts
+class Test_Newton_Parallel_Restarts(unittest.TestCase):
+
+    def _solve( self, testFile_basename, **solverArgs ):
+        doc =  FreeCAD.open( os.path.join( test_assembly_path, testFile_basename + '.fcstd' ) )
+        xOpt = solveConstraints( doc, solver_name = 'newton_solver_slsqp', use_cache = False, showFailureErrorDialog=False, **solverArgs )
+        FreeCAD.closeDocument( doc.Name )
+        return xOpt
+
+    def test_pickling( self ):
+        'constraint equations are sent to the restart processes by pickling, which should not change the errors'
+        import pickle
+        doc, constraintEqs, x0 = load_constraintEquations( 'testAssembly_15-triangular_link_assembly' )
+        constraintEqs_copy = pickle.loads( pickle.dumps( constraintEqs ) )
+        x = x0 + 0.1*numpy.random.RandomState(0).randn( len(x0) )
+        self.assertTrue( numpy.allclose( constraintEqs(x), constraintEqs_copy(x) ) )
+        FreeCAD.closeDocument( doc.Name )
+
+    def test_same_as_serial_restarts( self ):
+        'for the same random_seed, parallel restarts should return the same solution as the serial restarts'
+        for testFile_basename in [ 'testAssembly_13-spherical_surfaces_hip', 'testAssembly_15-triangular_link_assembly' ]:
+            x_serial = self._solve( testFile_basename, random_restart_attempts=4, random_seed=1 )
+            x_parallel = self._solve( testFile_basename, random_restart_attempts=4, random_seed=1, parallel_restarts=True )
+            self.assertEqual( x_serial is None, x_parallel is None )
+            if x_serial is not None:
+                self.assertTrue( numpy.allclose( x_serial, x_parallel ) )
+
+    def test_no_restarts( self ):
+        'with random_restart_attempts=0 there is nothing to try in parallel'
+        from assembly2.solvers.newton_solver import solve_restarts_in_parallel, solve_via_slsqp
+        self.assertEqual( solve_restarts_in_parallel( solve_via_slsqp, None, [], None ), None )
+        x_serial = self._solve( 'testAssembly_13-spherical_surfaces_hip', random_restart_attempts=0 )
+        x_parallel = self._solve( 'testAssembly_13-spherical_surfaces_hip', random_restart_attempts=0, parallel_restarts=True )
+        self.assertEqual( x_serial is None, x_parallel is None )
@@ -19,6 +19,15 @@ class VariableManager:
             if not pV.fixed:
                 pV.setValues( values[ i*6: (i+1)*6 ] )
                 i = i + 1
+    def variableIndexes(self, objectName):
+        'indexes of objectNames placement variables in getValues(), [] if objectName is fixed'
+        i = 0
+        for key,pV in self.placementVariables.iteritems():
+            if not pV.fixed:
+                if key == objectName:
+                    return list( range( i*6, (i+1)*6 ) )
+                i = i + 1
+        return []
     def updateFreeCADValues(self):
         [ pV.updateFreeCADValues() for pV in self.placementVariables.values() if not pV.fixed ]
     def bounds(self):
@@ -27,14 +36,15 @@ class VariableManager:
             if not pV.fixed:
                 bounds = bounds + pV.bounds()
         return bounds
-    def peturbValues(self, objectsToPeturb):
+    def peturbValues(self, objectsToPeturb, rng=numpy.random):
+        'rng - random number generator, pass a numpy.random.RandomState for reproducible peturbations'
         X = []
         for key,pV in self.placementVariables.iteritems():
             if not pV.fixed:
                 y = numpy.array( pV.getValues() )
                 if key in objectsToPeturb:
-                    y[0:3] = y[0:3] + 42*( numpy.random.rand(3) - 0.5 )
-                    y[3:6] = 2*pi *( numpy.random.rand(3) - 0.5 )
+                    y[0:3] = y[0:3] + 42*( rng.rand(3) - 0.5 )
+                    y[3:6] = 2*pi *( rng.rand(3) - 0.5 )
                 X = X + y.tolist()
         return X
     def fixObj( self, objectName ):
@@ -45,6 +55,11 @@ class VariableManager:
                 pV.fixed = True
     def objFixed( self, objectName ):
         return self.placementVariables[objectName].fixed 
+    def __getstate__( self ):
+        'FreeCAD documents can not be pickled, drop doc so that the variableManager can be sent to other processes for solving'
+        state = self.__dict__.copy()
+        state['doc'] = None
+        return state
 
 class PlacementVariables:
     def __init__(self, doc, objName):
@@ -99,11 +114,23 @@ class PlacementVariables:
         #self.doc.getObject(self.objName).touch()
     
     def rotate( self, p):
-        #debugPrint( 3, "p %s" % p)
-        #debugPrint( 3, "theta %2.1f, phi %2.1f, psi %2.1f" % ( self.theta/pi*180, self.phi/pi*180, self.psi/pi*180 ))
-        #debugPrint( 3, 'result %s' % euler_ZYX_rotation( p, self.theta, self.phi, self.psi ))
+        #debugPrint( 3, "p %s", p )
+        #debugPrint( 3, "theta %2.1f, phi %2.1f, psi %2.1f", self.theta/pi*180, self.phi/pi*180, self.psi/pi*180 )
+        #debugPrint( 3, 'result %s', euler_ZYX_rotation( p, self.theta, self.phi, self.psi ) )
         return euler_ZYX_rotation( p, self.theta, self.phi, self.psi )
 
+    def rotate_jacobian( self, p ):
+        'derivative (3x6 array) of rotate(p) with respect to the placement variables x, y, z, theta, phi, psi'
+        J = numpy.zeros([3,6])
+        for j, dR in enumerate( euler_ZYX_rotation_matrix_derivatives( self.theta, self.phi, self.psi ) ):
+            J[:,3+j] = numpy.dot( dR, p )
+        return J
+
+    def rotate_and_then_move_jacobian( self, p ):
+        J = self.rotate_jacobian( p )
+        J[:,:3] = numpy.eye(3)
+        return J
+
     def rotate_undo( self, p ): # or unrotate
         R = euler_ZYX_rotation_matrix( self.theta, self.phi, self.psi )
         return numpy.linalg.solve(R,p)
@@ -113,4 +140,9 @@ class PlacementVariables:
 
     def rotate_and_then_move_undo( self, p): # or un(rotate_and_then_move)
         return self.rotate_undo( numpy.array(p) - numpy.array([ self.x, self.y, self.z ]) )        
+
+    def __getstate__( self ):
+        state = self.__dict__.copy()
+        state['doc'] = None
+        return state
     
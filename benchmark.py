@@ -0,0 +1,217 @@
+'''
+benchmark the assembly2 solvers over the test assemblies in assembly2/solvers/test_assemblies, for example
+  FreeCAD_assembly2$ python benchmark.py --output baseline.json
+  ... make changes ...
+  FreeCAD_assembly2$ python benchmark.py --output new.json --compare baseline.json
+or a micro-benchmark of part of the solver, for example
+  FreeCAD_assembly2$ python benchmark.py --micro_benchmark rotation_cache --files assembly2/solvers/test_assemblies/testAssembly_15-triangular_link_assembly.fcstd
+
+each assembly/solver configuration is run in a fresh process, recording
+  - solved, wall time (for the cached configuration, the time to re-solve using the cache)
+  - constraint equation evaluations, jacobians and iterations of the numerical solvers (see dof_reduction_solver.solverLib.solverStats)
+  - analytical and numerical solutions of constraint equations (dof_reduction_solver only)
+  - peak memory (resident set size) of the process
+'''
+import sys, os
+sys.path.append('/usr/lib/freecad/lib/') #path to FreeCAD library on Linux
+try:
+    import FreeCAD, FreeCADGui
+except ImportError as msg:
+    print('Import error, is this script being run from Python2?')
+    raise ImportError(msg)
+if not hasattr(FreeCADGui, 'addCommand'): #FreeCAD running without GUI
+    FreeCADGui.addCommand = lambda name, command : None
+
+import assembly2
+import argparse, json, time, traceback, glob, platform
+from assembly2.core import debugPrint
+from assembly2.solvers import solveConstraints
+from assembly2.solvers.dof_reduction_solver.solverLib import solverStatsSnapshot
+from assembly2.solvers.dof_reduction_solver.constraintSystems import updateStats, solutionStats
+
+test_assembly_path = os.path.join( assembly2.__dir__ , 'assembly2', 'solvers', 'test_assemblies' )
+
+configurations = { # name : (solver_name, use_cache, solverArgs)
+    'dof_reduction_solver' : ( 'dof_reduction_solver', False, {} ),
+    'dof_reduction_solver_cached' : ( 'dof_reduction_solver', True, {} ),
+    'dof_reduction_solver_scheduled' : ( 'dof_reduction_solver', False, { 'schedule_constraints':True } ),
+    'dof_reduction_solver_loop_closure' : ( 'dof_reduction_solver', False, { 'schedule_constraints':True, 'loop_closure':True } ),
+    'newton_solver_slsqp' : ( 'newton_solver_slsqp', False, {} ),
+    'newton_solver_least_squares' : ( 'newton_solver_least_squares', False, {} ),
+}
+
+def peak_memory():
+    'peak resident set size of this process in kB, None if not available (e.g. on Windows)'
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    return maxrss / 1024 if sys.platform == 'darwin' else maxrss #bytes on Mac, kB on Linux
+
+def stats_snapshot():
+    return solverStatsSnapshot(), dict( updateStats ), dict( solutionStats )
+
+def stats_since( snapshot ):
+    solverStats_start, updateStats_start, solutionStats_start = snapshot
+    counts = dict( ( k, 0 ) for k in [ 'solves', 'iterations', 'evaluations', 'jacobians' ] )
+    for method, stats in solverStatsSnapshot().items():
+        for k in counts:
+            counts[k] += stats[k] - solverStats_start.get( method, {} ).get( k, 0 )
+    counts['updates'] = updateStats['updates'] - updateStats_start['updates']
+    counts['analytical_solutions'] = solutionStats['analytical'] - solutionStats_start['analytical']
+    counts['numerical_solutions'] = solutionStats['numerical'] - solutionStats_start['numerical']
+    return counts
+
+def benchmark_case( job ):
+    'job - (fileName, configuration), returns the benchmark results as a dict'
+    fileName, configuration = job
+    solver_name, use_cache, solverArgs = configurations[configuration]
+    result = { 'file': os.path.basename( fileName ), 'configuration': configuration, 'solved': False }
+    try:
+        doc = FreeCAD.open( fileName )
+        if use_cache: #first solve fills the cache
+            solveConstraints( doc, solver_name = solver_name, use_cache = True, showFailureErrorDialog = False, **solverArgs )
+        snapshot = stats_snapshot()
+        t_start = time.time()
+        solution = solveConstraints( doc, solver_name = solver_name, use_cache = use_cache, showFailureErrorDialog = False, **solverArgs )
+        result['time'] = time.time() - t_start
+        result['solved'] = solution is not None
+        result.update( stats_since( snapshot ) )
+        FreeCAD.closeDocument( doc.Name )
+    except Exception:
+        result['error'] = traceback.format_exc()
+    result['peak_memory_kB'] = peak_memory()
+    return result
+
+def run_benchmarks( fileNames, configurationNames, processes=1 ):
+    import multiprocessing
+    jobs = [ ( fileName, c ) for fileName in fileNames for c in configurationNames ]
+    pool = multiprocessing.Pool( processes, maxtasksperchild=1 ) #fresh process for each job, so that peak memory and caches are not shared
+    try:
+        results = []
+        for result in pool.imap( benchmark_case, jobs, chunksize=1 ):
+            debugPrint( 1, '%s %s: %s %s', result['file'], result['configuration'], 'solved' if result['solved'] else 'FAILED', '%3.2fs' % result['time'] if 'time' in result else '' )
+            results.append( result )
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+def benchmark_rotation_cache( fileName, evaluations=1000 ):
+    'constraint residual evaluations per second, with and without VariableManager.rotationCaching, returns a report line'
+    from assembly2.solvers.dof_reduction_solver.variableManager import VariableManager
+    evals_per_second = {}
+    for rotationCaching in [ False, True ]:
+        VariableManager.rotationCaching = rotationCaching
+        doc = FreeCAD.open( fileName )
+        try:
+            constraintSystem = solveConstraints( doc, solver_name = 'dof_reduction_solver', use_cache = False, showFailureErrorDialog = False )
+            if constraintSystem is None:
+                return '%s: not solved' % os.path.basename( fileName )
+            systems = []
+            while constraintSystem.parentSystem != None:
+                systems.append( constraintSystem )
+                constraintSystem = constraintSystem.parentSystem
+            X = systems[0].variableManager.X.copy()
+            t_start = time.time()
+            for i in range( evaluations ): #perturb one rotation variable at a time, as done by gradient approximations
+                X[ (i % (len(X)//6))*6 + 3 + i % 3 ] += 10**-7
+                for constraintSystem in systems:
+                    constraintSystem.constraintEq_value( X )
+            evals_per_second[rotationCaching] = evaluations * len(systems) / ( time.time() - t_start )
+        finally:
+            VariableManager.rotationCaching = True
+            FreeCAD.closeDocument( doc.Name )
+    return '%s: %i residual evaluations per second without rotation cache, %i with rotation cache' % ( os.path.basename( fileName ), evals_per_second[False], evals_per_second[True] )
+
+def benchmark_numerical_solvers( fileName ):
+    'solves fileName using each of the dof_reduction_solver numerical solvers, returns a report line comparing iterations and function evaluations'
+    from assembly2.solvers.dof_reduction_solver.constraintSystems import ConstraintSystemPrototype
+    from assembly2.solvers.dof_reduction_solver.solverLib import solverStatsSummary
+    lines = [ os.path.basename( fileName ) + ':' ]
+    for numericalSolver in [ 'newton', 'newton_broyden', 'levenberg_marquardt' ]:
+        ConstraintSystemPrototype.numericalSolver = numericalSolver
+        doc = FreeCAD.open( fileName )
+        try:
+            stats_start = solverStatsSnapshot()
+            t_start = time.time()
+            solved = solveConstraints( doc, solver_name = 'dof_reduction_solver', use_cache = False, showFailureErrorDialog = False ) is not None
+            lines.append( '  %s: %s in %3.2fs, %s' % ( numericalSolver, 'solved' if solved else 'FAILED', time.time() - t_start, solverStatsSummary( stats_start ) ) )
+        finally:
+            ConstraintSystemPrototype.numericalSolver = 'newton'
+            FreeCAD.closeDocument( doc.Name )
+    return '\n'.join( lines )
+
+micro_benchmarks = { # name : function( fileName ) returning a report
+    'rotation_cache' : benchmark_rotation_cache,
+    'numerical_solvers' : benchmark_numerical_solvers,
+}
+
+def compare( results, baseline, time_tolerance=0.2, min_time_difference=0.05 ):
+    '''
+    compares results against baseline results, returns a report (list of lines) and the number of regressions.
+    regressions are assemblies which the baseline solved but no longer solve, or which are slower by more than time_tolerance (relative)
+    and min_time_difference seconds, the latter so that timing noise of the quick solves is not reported.
+    '''
+    baseline_results = dict( ( ( r['file'], r['configuration'] ), r ) for r in baseline['results'] )
+    lines = [ '%-55s %-28s %10s %10s %7s %12s' % ( 'assembly', 'configuration', 'base [s]', 'new [s]', 'ratio', 'evaluations' ) ]
+    regressions = 0
+    for r in results:
+        b = baseline_results.get( ( r['file'], r['configuration'] ) )
+        if b is None:
+            lines.append( '%-55s %-28s %s' % ( r['file'], r['configuration'], 'not in baseline' ) )
+            continue
+        if b['solved'] and not r['solved']:
+            regressions += 1
+            lines.append( '%-55s %-28s %s' % ( r['file'], r['configuration'], 'REGRESSION: no longer solved' ) )
+        elif b['solved'] and r['solved']:
+            ratio = r['time'] / b['time'] if b['time'] > 0 else 1.0
+            flag = ''
+            if ratio > 1 + time_tolerance and r['time'] - b['time'] > min_time_difference:
+                regressions += 1
+                flag = '  REGRESSION: slower'
+            lines.append( '%-55s %-28s %10.3f %10.3f %7.2f %5i -> %-5i%s' % ( r['file'], r['configuration'], b['time'], r['time'], ratio, b['evaluations'], r['evaluations'], flag ) )
+        else:
+            lines.append( '%-55s %-28s %s' % ( r['file'], r['configuration'], 'solved now' if r['solved'] else 'unsolved in both' ) )
+    lines.append( '%i regressions' % regressions )
+    return lines, regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description = 'benchmark the assembly2 solvers over the test assemblies' )
+    parser.add_argument('--files', type=str, nargs='*', default=None, help='assembly files to benchmark, default all test_assemblies')
+    parser.add_argument('--configurations', type=str, nargs='*', default=sorted(configurations.keys()), choices=sorted(configurations.keys()) )
+    parser.add_argument('--processes', type=int, default=1, help='number of benchmarks to run concurrently, 1 for more reliable timings')
+    parser.add_argument('--output', type=str, default='benchmark.json', help='JSON output file, - for stdout (use with --debug_level 0)')
+    parser.add_argument('--compare', type=str, default=None, help='baseline JSON file (output of a previous run) to compare against')
+    parser.add_argument('--time_tolerance', type=float, default=0.2, help='relative slow down treated as a regression when comparing')
+    parser.add_argument('--min_time_difference', type=float, default=0.05, help='slow downs of less than this many seconds are not treated as regressions')
+    parser.add_argument('--micro_benchmark', type=str, default=None, choices=sorted(micro_benchmarks.keys()), help='run this micro-benchmark over the assembly files instead, printing a report per file')
+    parser.add_argument('--debug_level', type=int, default=1 )
+    args = parser.parse_args()
+
+    debugPrint.level = args.debug_level
+    fileNames = args.files if args.files else sorted( glob.glob( os.path.join( test_assembly_path, '*.fcstd' ) ) )
+    if args.micro_benchmark:
+        for fileName in fileNames:
+            print( micro_benchmarks[args.micro_benchmark]( os.path.abspath( fileName ) ) )
+        sys.exit(0)
+    t_start = time.time()
+    results = run_benchmarks( [ os.path.abspath(f) for f in fileNames ], args.configurations, args.processes )
+    output = {
+        'results' : results,
+        'environment' : { 'platform' : platform.platform(), 'python' : platform.python_version(), 'processes' : args.processes },
+        'time' : time.time() - t_start
+    }
+    if args.output == '-':
+        json.dump( output, sys.stdout, indent=2, sort_keys=True )
+        sys.stdout.write('\n')
+    else:
+        with open( args.output, 'w' ) as f:
+            json.dump( output, f, indent=2, sort_keys=True )
+    if args.compare:
+        with open( args.compare ) as f:
+            baseline = json.load( f )
+        lines, regressions = compare( results, baseline, args.time_tolerance, args.min_time_difference )
+        sys.stderr.write( '\n'.join( lines ) + '\n' )
+        sys.exit( 1 if regressions > 0 else 0 )
@@ -0,0 +1,104 @@
+'''
+headless batch solving of assembly2 .fcstd files, for example
+  FreeCAD_assembly2$ python solve.py --solver dof_reduction_solver --processes 4 --output results.json variants/*.fcstd
+writes the solved placements, degrees-of-freedom count and timings of each assembly as JSON. No dialogs are opened.
+'''
+import sys, os
+sys.path.append('/usr/lib/freecad/lib/') #path to FreeCAD library on Linux
+try:
+    import FreeCAD, FreeCADGui
+except ImportError as msg:
+    print('Import error, is this script being run from Python2?')
+    raise ImportError(msg)
+if not hasattr(FreeCADGui, 'addCommand'): #FreeCAD running without GUI
+    FreeCADGui.addCommand = lambda name, command : None
+
+import assembly2
+import argparse, json, time, traceback
+from assembly2.core import debugPrint
+from assembly2.solvers import solveConstraints
+
+solver_names = [ 'dof_reduction_solver', 'newton_solver_slsqp', 'newton_solver_least_squares' ]
+
+def placements( doc ):
+    'placements of the assembly2 parts (objects with a fixedPosition property) in doc'
+    P = {}
+    for obj in doc.Objects:
+        if hasattr( obj, 'fixedPosition' ):
+            base = obj.Placement.Base
+            P[obj.Name] = {
+                'base' : [ base.x, base.y, base.z ],
+                'rotation' : list( obj.Placement.Rotation.Q ),
+                'fixed' : obj.fixedPosition
+            }
+    return P
+
+def solve_file( job ):
+    'job - (fileName, solver_name, save), returns a dict of results which can be written as JSON'
+    fileName, solver_name, save = job
+    result = { 'file': fileName, 'solver': solver_name, 'solved': False }
+    t_start = time.time()
+    try:
+        doc = FreeCAD.open( fileName )
+        t_solve_start = time.time()
+        solution = solveConstraints( doc, solver_name = solver_name, showFailureErrorDialog = False, use_cache = False )
+        result['time_solve'] = time.time() - t_solve_start
+        result['solved'] = solution is not None
+        #only the dof_reduction_solver returns a constraint system with degreesOfFreedom
+        if hasattr( solution, 'degreesOfFreedomCount' ):
+            result['degrees_of_freedom'] = solution.degreesOfFreedomCount
+        else:
+            result['degrees_of_freedom'] = len( solution.degreesOfFreedom ) if hasattr( solution, 'degreesOfFreedom' ) else None
+        result['placements'] = placements( doc )
+        if save and result['solved']:
+            doc.save()
+        FreeCAD.closeDocument( doc.Name )
+    except Exception:
+        result['error'] = traceback.format_exc()
+    result['time_total'] = time.time() - t_start
+    return result
+
+def solve_files( fileNames, solver_name, processes=1, save=False ):
+    jobs = [ ( fileName, solver_name, save ) for fileName in fileNames ]
+    if processes > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool( processes, maxtasksperchild=1 ) #fresh FreeCAD session for every assembly
+        try:
+            results = pool.map( solve_file, jobs, chunksize=1 )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [ solve_file( job ) for job in jobs ]
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description = 'solve assembly2 constraints of .fcstd files without the FreeCAD GUI' )
+    parser.add_argument('fileNames', type=str, nargs='+', help='assembly2 .fcstd files')
+    parser.add_argument('--solver', type=str, default='dof_reduction_solver', choices=solver_names )
+    parser.add_argument('--processes', type=int, default=1, help='number of assemblies to solve in parallel')
+    parser.add_argument('--output', type=str, default='-', help='JSON output file, - for stdout')
+    parser.add_argument('--save', action='store_true', help='save the solved assemblies, overwriting the .fcstd files')
+    parser.add_argument('--debug_level', type=int, default=0 )
+    args = parser.parse_args()
+
+    debugPrint.level = args.debug_level
+    t_start = time.time()
+    results = solve_files( [ os.path.abspath(f) for f in args.fileNames ], args.solver, args.processes, args.save )
+    output = {
+        'results' : results,
+        'summary' : {
+            'solver' : args.solver,
+            'files' : len(results),
+            'solved' : sum( r['solved'] for r in results ),
+            'errors' : sum( 'error' in r for r in results ),
+            'time' : time.time() - t_start
+        }
+    }
+    if args.output == '-':
+        json.dump( output, sys.stdout, indent=2, sort_keys=True )
+        sys.stdout.write('\n')
+    else:
+        with open( args.output, 'w' ) as f:
+            json.dump( output, f, indent=2, sort_keys=True )
+    sys.exit( 0 if output['summary']['solved'] == len(results) else 1 )